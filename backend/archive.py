@@ -0,0 +1,104 @@
+"""Archival tier for attendance, announcements and notes.
+
+Documents older than ARCHIVE_AFTER_DAYS, or belonging to a class that ended
+before that cutoff, are moved to `<collection>_archive` so the live
+collections (and their indexes) only hold the current terms.
+
+Each pass walks the matching documents in `_id` order, ARCHIVE_BATCH_SIZE at
+a time: an aggregation `$merge` copies exactly those `_id`s into the
+archive, then each one is deleted from the live collection only if its
+`updated_at` is still the one read at the start. A document edited in
+between stays live and is archived, edit included, on the next pass.
+`$merge` replaces on `_id`, so an interrupted run is simply repeated.
+
+For the collections /api/sync serves, every moved document gets a
+tombstone, so clients drop it from their local cache.
+"""
+import os
+from datetime import datetime, timezone, timedelta
+
+from pymongo import DeleteOne
+
+from database import db
+from jobs import update_job
+from cache import content_cache
+from tombstones import record_tombstones
+
+ARCHIVED_COLLECTIONS = ["attendance", "announcements", "notes"]
+# Archived collections that /api/sync serves -> their id field (for tombstones)
+SYNCED_ID_FIELDS = {"announcements": "announcement_id", "notes": "note_id"}
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", str(24 * 60 * 60)))
+
+
+def archive_name(collection: str) -> str:
+    return f"{collection}_archive"
+
+
+async def _ended_class_ids(cutoff: datetime):
+    # end_time is stored as the ISO string the client sent ("2025-06-30T15:00")
+    cutoff_str = cutoff.strftime("%Y-%m-%dT%H:%M")
+    classes = await db.classes.find({"end_time": {"$lt": cutoff_str}}, {"_id": 0, "class_id": 1}).to_list(None)
+    return [c["class_id"] for c in classes]
+
+
+async def archive_collection(collection: str, match: dict, on_batch=None) -> int:
+    id_field = SYNCED_ID_FIELDS.get(collection)
+    fields = {"_id": 1, "class_id": 1, "updated_at": 1, **({id_field: 1} if id_field else {})}
+    moved = 0
+    last_id = None
+    while True:
+        query = match if last_id is None else {"$and": [match, {"_id": {"$gt": last_id}}]}
+        batch = await db[collection].find(query, fields).sort("_id", 1).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            return moved
+        last_id = batch[-1]["_id"]
+        ids = [d["_id"] for d in batch]
+        await db[collection].aggregate([
+            {"$match": {"_id": {"$in": ids}}},
+            {"$merge": {"into": archive_name(collection), "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]).to_list(None)
+        # Only what is unchanged since it was read (and so since it was copied)
+        await db[collection].bulk_write(
+            [DeleteOne({"_id": d["_id"], "updated_at": d.get("updated_at")}) for d in batch], ordered=False
+        )
+        kept = set(await db[collection].distinct("_id", {"_id": {"$in": ids}}))
+        gone = [d for d in batch if d["_id"] not in kept]
+        moved += len(gone)
+        if id_field:
+            await record_tombstones(collection, gone, id_field)
+        for class_id in {d.get("class_id") for d in gone}:
+            await content_cache.invalidate(class_id)
+        if on_batch:
+            await on_batch(moved)
+
+
+async def run_archive(job_id=None, older_than_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    ended = await _ended_class_ids(cutoff)
+    match = {"$or": [{"created_at": {"$lt": cutoff}}, {"class_id": {"$in": ended}}]}
+    progress = {}
+    for collection in ARCHIVED_COLLECTIONS:
+        async def report(moved, collection=collection):
+            progress[collection] = moved
+            await update_job(job_id, progress=progress)
+        progress[collection] = await archive_collection(collection, match, report)
+    return {"cutoff": cutoff, "ended_classes": len(ended), "moved": progress}
+
+
+async def find_with_archive(collection: str, query: dict, sort: list, limit: int, include_archived: bool = False,
+                            projection: dict = None):
+    """Query the live collection, or live + archive when `include_archived`."""
+    projection = projection or {"_id": 0}
+    if not include_archived:
+        return await db[collection].find(query, projection).sort(sort).to_list(limit)
+    pipeline = [
+        {"$match": query},
+        {"$unionWith": {"coll": archive_name(collection), "pipeline": [{"$match": query}]}},
+        {"$sort": dict(sort)},
+        {"$limit": limit},
+        {"$project": projection},
+    ]
+    return await db[collection].aggregate(pipeline).to_list(limit)
@@ -3,22 +3,27 @@ from datetime import datetime, timezone, timedelta
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status, Request
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 
-from database import db
+from loaders import get_loaders
+from passwords import pwd_context
 
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-temporary-secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_rehash(plain_password, hashed_password):
+    """(ok, new_hash): new_hash is set when the stored hash is weaker than
+    pwd_context's current parameters (e.g. a bulk-imported password) and
+    should be saved in its place."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def hash_password(password):
     return pwd_context.hash(password)
 
@@ -32,7 +37,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(request: Request):
+def current_user_id(request: Request) -> str:
+    """The user_id from the auth cookie, without loading the user. For hot
+    endpoints (e.g. video heartbeats) where the user lookup is the cost."""
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -44,8 +51,12 @@ async def get_current_user(request: Request):
 
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return user_id
+
 
-    user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+async def get_current_user(request: Request):
+    user_id = current_user_id(request)
+    user = await get_loaders(request).users.load(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -0,0 +1,230 @@
+"""Read-through cache for per-class content (class document, announcements,
+notes, assignments).
+
+Entries are keyed on a per-class version: `announcements:<class_id>:<version>`.
+Write handlers call `invalidate(class_id)`, which replaces the version, so
+every older entry for that class simply stops being addressed and ages out —
+there is no need to enumerate and delete keys, and a reader that raced with
+a writer can only ever store its result under the superseded version.
+
+A missing version (never set, or evicted) is replaced by a brand-new one,
+never by a fixed default, so losing a version key costs a miss but can never
+bring back entries stored under an older version.
+
+Backends:
+  * RedisBackend — shared by all workers; selected by setting CACHE_URL
+                   (redis://...), which is how the app is deployed.
+  * LRUBackend   — in-process, capped by entry count and bytes. An
+                   invalidation only reaches the worker that made it, so it
+                   is used only when the app runs as a single process
+                   (WEB_CONCURRENCY=1, e.g. local development). It doubles
+                   as the local stand-in for the shared store.
+  * NullBackend  — stores nothing; several workers and no CACHE_URL.
+
+All backends hand back encoded bytes, so every result is a fresh copy the
+caller may modify.
+"""
+import os
+import time
+from collections import OrderedDict
+
+import bson
+
+import metrics
+
+CACHE_URL = os.getenv("CACHE_URL")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Set by gunicorn.conf.py for its workers; a bare `uvicorn server:app` is one process
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+class LRUBackend:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self.evictions = 0
+
+    async def get(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (expires_at, value)
+        self._bytes += len(value)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def add(self, key, value, ttl=None):
+        """Store `value` unless the key is present; returns what is stored now."""
+        current = await self.get(key)
+        if current is not None:
+            return current
+        await self.set(key, value, ttl)
+        return value
+
+    async def delete(self, key):
+        self._remove(key)
+
+    def _remove(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= len(item[1])
+
+    async def close(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+_redis = None
+
+
+def redis_client():
+    """The process-wide Redis client for CACHE_URL (imported on first use)."""
+    global _redis
+    if _redis is None:
+        import redis.asyncio as redis
+
+        _redis = redis.from_url(CACHE_URL)
+    return _redis
+
+
+class RedisBackend:
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or redis_client()
+
+    async def get(self, key):
+        return await self.client.get(key)
+
+    async def set(self, key, value, ttl=None):
+        await self.client.set(key, value, ex=ttl)
+
+    async def add(self, key, value, ttl=None):
+        if await self.client.set(key, value, ex=ttl, nx=True):
+            return value
+        return await self.client.get(key) or value
+
+    async def delete(self, key):
+        await self.client.delete(key)
+
+    async def close(self):
+        if self._client is not None or _redis is not None:
+            await self.client.aclose()
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class NullBackend:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value, ttl=None):
+        pass
+
+    async def add(self, key, value, ttl=None):
+        return value
+
+    async def delete(self, key):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {"backend": "off"}
+
+
+def _encode(value):
+    return bson.encode({"v": value})
+
+
+def _decode(raw):
+    return bson.decode(raw)["v"]
+
+
+def _new_version():
+    return str(time.time_ns()).encode()
+
+
+class ContentCache:
+    def __init__(self, backend, ttl=CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def _version(self, class_id):
+        key = f"ver:{class_id}"
+        raw = await self.backend.get(key)
+        if raw is None:
+            # Never fall back to a fixed version: entries stored under it
+            # before an invalidation would become visible again
+            raw = await self.backend.add(key, _new_version())
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    async def get_or_load(self, class_id, kind, loader):
+        """Cached value of `kind` for the class, or `await loader()` on a miss.
+        None results are not cached."""
+        key = f"{kind}:{class_id}:{await self._version(class_id)}"
+        raw = await self.backend.get(key)
+        if raw is not None:
+            self.hits += 1
+            return _decode(raw)
+        self.misses += 1
+        value = await loader()
+        if value is None:
+            return None
+        raw = _encode(value)
+        await self.backend.set(key, raw, self.ttl)
+        # Hand back a decoded copy: the loader's object may be shared
+        # (single-flight) and the caller is free to modify what it gets.
+        return _decode(raw)
+
+    async def invalidate(self, class_id):
+        """Retire every cached entry for the class by moving its version on."""
+        await self.backend.set(f"ver:{class_id}", _new_version())
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            **self.backend.stats(),
+        }
+
+
+def _default_backend():
+    if CACHE_URL:
+        return RedisBackend()
+    if WORKERS == 1:
+        return LRUBackend()
+    return NullBackend()
+
+
+content_cache = ContentCache(_default_backend())
+metrics.register("cache", content_cache.stats)
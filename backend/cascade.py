@@ -0,0 +1,84 @@
+"""Cascade deletion of a class's dependent documents, and the orphan sweeper
+that catches anything a cascade missed (crash, deploy, pre-existing data).
+
+Deletes run in throttled batches of CASCADE_BATCH_SIZE documents by `_id`, with
+a short pause between batches, so a large class never issues one huge
+delete_many that monopolises the primary.
+"""
+import asyncio
+import os
+
+from database import db
+from jobs import update_job
+
+# Collections holding documents that belong to a class via `class_id`.
+# (`schedules` are owned by a teacher, not a class, so they are not included.)
+DEPENDENTS = [
+    "announcements", "assignments", "notes", "attendance", "progress", "progress_history", "videos", "video_progress",
+    "announcements_archive", "notes_archive", "attendance_archive",
+    "attendance_class_rollups", "attendance_student_rollups",
+]
+
+CASCADE_BATCH_SIZE = int(os.getenv("CASCADE_BATCH_SIZE", "500"))
+CASCADE_BATCH_PAUSE = float(os.getenv("CASCADE_BATCH_PAUSE", "0.05"))
+ORPHAN_SWEEP_INTERVAL = int(os.getenv("ORPHAN_SWEEP_INTERVAL", str(6 * 60 * 60)))
+
+
+async def delete_in_batches(collection: str, query: dict, on_batch=None) -> int:
+    deleted = 0
+    while True:
+        batch = await db[collection].find(query, {"_id": 1}).limit(CASCADE_BATCH_SIZE).to_list(CASCADE_BATCH_SIZE)
+        if not batch:
+            return deleted
+        result = await db[collection].delete_many({"_id": {"$in": [d["_id"] for d in batch]}})
+        deleted += result.deleted_count
+        if on_batch:
+            await on_batch(deleted)
+        await asyncio.sleep(CASCADE_BATCH_PAUSE)
+
+
+async def cascade_delete_class(class_ids, job_id=None) -> dict:
+    """Delete every dependent of the given (already deleted) classes."""
+    if isinstance(class_ids, str):
+        class_ids = [class_ids]
+    query = {"class_id": {"$in": list(class_ids)}}
+    progress = {}
+    for collection in DEPENDENTS:
+        async def report(deleted, collection=collection):
+            progress[collection] = deleted
+            await update_job(job_id, progress=progress)
+        progress[collection] = await delete_in_batches(collection, query, report)
+    return progress
+
+
+async def find_orphans(collection: str) -> dict:
+    """{class_id: document count} for dependents whose class no longer exists."""
+    pipeline = [
+        {"$match": {"class_id": {"$exists": True}}},
+        {"$group": {"_id": "$class_id", "count": {"$sum": 1}}},
+        {"$lookup": {"from": "classes", "localField": "_id", "foreignField": "class_id", "as": "class"}},
+        {"$match": {"class": {"$size": 0}}},
+        {"$project": {"count": 1}},
+    ]
+    return {row["_id"]: row["count"] async for row in db[collection].aggregate(pipeline)}
+
+
+async def sweep_orphans(dry_run: bool = False, job_id=None) -> dict:
+    """Find (and unless `dry_run`, delete) orphaned dependents, collection by
+    collection, reporting progress on the job document."""
+    report = {}
+    for collection in DEPENDENTS:
+        orphans = await find_orphans(collection)
+        entry = {"classes": len(orphans), "documents": sum(orphans.values()), "deleted": 0}
+        report[collection] = entry
+        await update_job(job_id, progress=report)
+        if dry_run or not orphans:
+            continue
+        class_ids = list(orphans)
+        for i in range(0, len(class_ids), CASCADE_BATCH_SIZE):
+            chunk = {"class_id": {"$in": class_ids[i:i + CASCADE_BATCH_SIZE]}}
+            async def on_batch(deleted, base=entry["deleted"]):
+                entry["deleted"] = base + deleted
+                await update_job(job_id, progress=report)
+            await delete_in_batches(collection, chunk, on_batch)
+    return {"dry_run": dry_run, "collections": report}
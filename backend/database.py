@@ -1,5 +1,11 @@
 import os
+import logging
+import threading
+import time
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from pymongo.monitoring import ConnectionPoolListener
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -9,5 +15,297 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.getenv("MONGO_URL")
 db_name = os.getenv("DB_NAME")
 
-client = AsyncIOMotorClient(mongo_url)
-db = client[db_name]
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+class PoolWaitMonitor(ConnectionPoolListener):
+    """Moving average of how long operations wait to check a connection out
+    of the Motor pool. A rising figure means Mongo (or the pool) is the
+    bottleneck; loadshed.py sheds requests on it.
+
+    Events arrive on Motor's executor threads, hence the lock.
+    """
+
+    def __init__(self, alpha=0.2, stale_after=2.0):
+        self.alpha = alpha
+        self.stale_after = stale_after
+        self._avg = 0.0
+        self._updated_at = 0.0
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+
+    def _record(self, seconds):
+        with self._lock:
+            self._avg = seconds if not self.checkouts else self._avg + self.alpha * (seconds - self._avg)
+            self._updated_at = time.monotonic()
+            self.checkouts += 1
+
+    def wait_seconds(self):
+        """Current average wait; 0 once no checkout has happened for a while."""
+        if time.monotonic() - self._updated_at > self.stale_after:
+            return 0.0
+        return self._avg
+
+    def connection_checked_out(self, event):
+        if getattr(event, "duration", None) is not None:
+            self._record(event.duration)
+
+    def connection_check_out_failed(self, event):
+        self.failures += 1
+        if getattr(event, "duration", None) is not None:
+            self._record(event.duration)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def stats(self):
+        return {
+            "wait_ms": round(self.wait_seconds() * 1000, 2),
+            "checkouts": self.checkouts,
+            "failures": self.failures,
+        }
+
+
+pool_wait = PoolWaitMonitor()
+
+
+def connect():
+    """Create the Motor client for this process (idempotent).
+
+    Called from the app lifespan so the client is built after gunicorn forks
+    the worker; scripts that just import `db` get it on first use instead.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(mongo_url, event_listeners=[pool_wait])
+    return _client
+
+
+def close():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+class _Lazy:
+    """Module-level stand-in that resolves to the real client/database on use,
+    so `from database import db` keeps working without connecting at import."""
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+
+client = _Lazy(connect)
+db = _Lazy(lambda: connect()[db_name])
+
+
+async def run_in_transaction(fn):
+    """Run `await fn(session)` inside a transaction.
+
+    Transactions need a replica set (Atlas always is). On a standalone dev
+    server the first write fails with IllegalOperation before anything is
+    applied; `fn` is then run without a session and a warning is logged.
+    """
+    async with await connect().start_session() as session:
+        try:
+            async with session.start_transaction():
+                return await fn(session)
+        except OperationFailure as exc:
+            if exc.code != 20:  # IllegalOperation: not a replica set member
+                raise
+    logger.warning("Transactions unsupported by this MongoDB deployment; writing without one")
+    return await fn(None)
+
+
+# How long deletion markers for /api/sync are kept (see tombstones.py)
+TOMBSTONE_TTL_DAYS = int(os.getenv("TOMBSTONE_TTL_DAYS", "30"))
+
+# Indexes backing the hot queries in server.py and routes/. create_index is a
+# no-op when the index already exists, so this is safe on every boot.
+INDEXES = {
+    "users": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("invite_token_hash", ASCENDING)], {"unique": True, "sparse": True}),
+        # role queries; also covers GET /api/credits (no document fetch)
+        ([("role", ASCENDING), ("user_id", ASCENDING), ("name", ASCENDING), ("email", ASCENDING), ("credit_balance", ASCENDING)], {}),
+    ],
+    "classes": [
+        ([("class_id", ASCENDING)], {"unique": True}),
+        ([("teacher_id", ASCENDING)], {}),
+        ([("end_time", ASCENDING)], {}),
+        ([("class_id", ASCENDING), ("updated_at", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "enrollments": [
+        ([("user_id", ASCENDING), ("class_id", ASCENDING)], {"unique": True}),
+        ([("class_id", ASCENDING)], {}),
+    ],
+    "videos": [
+        ([("video_id", ASCENDING)], {"unique": True}),
+        ([("class_id", ASCENDING)], {}),
+        ([("class_id", ASCENDING), ("updated_at", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "announcements": [
+        ([("announcement_id", ASCENDING)], {"unique": True}),
+        # /api/feed: one stream per class, sorted by (created_at desc, announcement_id)
+        ([("class_id", ASCENDING), ("created_at", DESCENDING), ("announcement_id", ASCENDING)], {}),
+        ([("created_at", DESCENDING), ("announcement_id", ASCENDING)], {}),
+        ([("class_id", ASCENDING), ("updated_at", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "assignments": [
+        ([("assignment_id", ASCENDING)], {"unique": True}),
+        ([("class_id", ASCENDING), ("due_date", ASCENDING)], {}),
+        ([("class_id", ASCENDING), ("created_at", DESCENDING), ("assignment_id", ASCENDING)], {}),
+        ([("created_at", DESCENDING), ("assignment_id", ASCENDING)], {}),
+        ([("class_id", ASCENDING), ("updated_at", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "notes": [
+        ([("note_id", ASCENDING)], {"unique": True}),
+        ([("class_id", ASCENDING), ("session_date", DESCENDING)], {}),
+        ([("class_id", ASCENDING), ("created_at", DESCENDING), ("note_id", ASCENDING)], {}),
+        ([("created_at", DESCENDING), ("note_id", ASCENDING)], {}),
+        ([("class_id", ASCENDING), ("updated_at", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "attendance": [
+        ([("class_id", ASCENDING), ("session_date", DESCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING)], {}),
+        # multikey: one entry per student in `records`, for per-student lookups
+        ([("records.student_id", ASCENDING), ("session_date", DESCENDING), ("attendance_id", DESCENDING)], {}),
+    ],
+    "progress": [
+        ([("class_id", ASCENDING), ("student_id", ASCENDING)], {"unique": True}),
+        ([("student_id", ASCENDING)], {}),
+    ],
+    "progress_history": [
+        ([("class_id", ASCENDING), ("student_id", ASCENDING), ("month", ASCENDING), ("count", ASCENDING)], {}),
+    ],
+    "credit_transactions": [
+        ([("student_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("created_at", ASCENDING)], {}),
+    ],
+    "credit_snapshots": [
+        ([("student_id", ASCENDING), ("as_of", DESCENDING)], {}),
+    ],
+    "credit_snapshot_runs": [
+        ([("as_of", DESCENDING)], {}),
+    ],
+    "invoices": [
+        ([("invoice_id", ASCENDING)], {"unique": True}),
+        # one invoice per student per billing run (period + description)
+        ([("student_id", ASCENDING), ("billing_key", ASCENDING)],
+         {"unique": True, "partialFilterExpression": {"billing_key": {"$exists": True}}}),
+        ([("student_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("created_at", DESCENDING)], {}),
+        ([("status", ASCENDING), ("due_date", ASCENDING)], {}),
+        ([("student_id", ASCENDING), ("updated_at", ASCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "revenue_rollups": [
+        ([("month", ASCENDING)], {"unique": True}),
+    ],
+    "schedules": [
+        ([("teacher_id", ASCENDING)], {}),
+    ],
+    "announcements_archive": [
+        ([("class_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+    "notes_archive": [
+        ([("class_id", ASCENDING), ("session_date", DESCENDING)], {}),
+    ],
+    "attendance_archive": [
+        ([("class_id", ASCENDING), ("session_date", DESCENDING)], {}),
+    ],
+    "attendance_class_rollups": [
+        ([("class_id", ASCENDING)], {"unique": True}),
+    ],
+    "attendance_student_rollups": [
+        ([("class_id", ASCENDING), ("student_id", ASCENDING)], {"unique": True}),
+    ],
+    "idempotency_keys": [
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": 24 * 60 * 60}),
+    ],
+    "tombstones": [
+        ([("class_id", ASCENDING), ("deleted_at", ASCENDING)], {"sparse": True}),
+        ([("user_ids", ASCENDING), ("deleted_at", ASCENDING)], {"sparse": True}),
+        ([("deleted_at", ASCENDING)], {"expireAfterSeconds": TOMBSTONE_TTL_DAYS * 24 * 60 * 60}),
+    ],
+    "video_progress": [
+        ([("student_id", ASCENDING), ("video_id", ASCENDING)], {"unique": True}),
+        ([("class_id", ASCENDING), ("video_id", ASCENDING)], {}),
+    ],
+    "feed_markers": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "jobs": [
+        ([("job_id", ASCENDING)], {"unique": True}),
+        ([("kind", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+}
+
+# Indexes an entry in INDEXES has replaced; dropped on boot so existing
+# databases do not keep paying for them on every write.
+RETIRED_INDEXES = {
+    # covered by the feed's (class_id, created_at, <id>) / (created_at, <id>) indexes
+    "announcements": ["class_id_1_created_at_-1", "created_at_1"],
+    "assignments": ["class_id_1_created_at_-1", "created_at_1"],
+    "notes": ["class_id_1_created_at_-1", "created_at_1"],
+}
+
+
+async def ensure_indexes():
+    """Create INDEXES and drop RETIRED_INDEXES. A failure (e.g. existing
+    duplicate data blocking a unique index) is logged and skipped rather than
+    failing startup."""
+    database = connect()[db_name]
+    for collection, specs in INDEXES.items():
+        for keys, options in specs:
+            try:
+                await database[collection].create_index(keys, **options)
+            except Exception as exc:
+                logger.warning("Could not create index %s on %s: %s", keys, collection, exc)
+    for collection, names in RETIRED_INDEXES.items():
+        for name in names:
+            try:
+                await database[collection].drop_index(name)
+            except OperationFailure as exc:
+                if exc.code != 27:  # IndexNotFound: already gone
+                    logger.warning("Could not drop index %s on %s: %s", name, collection, exc)
@@ -1,22 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException
-from googleapiclient.discovery import build
+from fastapi.responses import RedirectResponse
 from  auth import get_current_user
 from  database import db
-import uuid
-from fastapi.responses import RedirectResponse
-from google_auth_oauthlib.flow import Flow
 import os
 
 router = APIRouter(prefix="/google", tags=["Google"])
 
-from fastapi import APIRouter
-from fastapi.responses import RedirectResponse
-from google_auth_oauthlib.flow import Flow
-import os
+SCOPES = [
+    "openid",
+    "https://www.googleapis.com/auth/userinfo.email",
+    "https://www.googleapis.com/auth/userinfo.profile",
+    "https://www.googleapis.com/auth/calendar",
+]
 
-router = APIRouter(prefix="/google", tags=["Google"])
 
-def exchange_code_for_credentials(code: str):
+def _redirect_uri():
+    return os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/api/google/callback")
+
+
+def build_flow():
+    # google_auth_oauthlib (and the googleapiclient stack behind it) is slow
+    # to import and only needed by these two routes, so it is imported on
+    # first use instead of on every cold start.
+    from google_auth_oauthlib.flow import Flow
 
     client_config = {
         "web": {
@@ -26,52 +32,25 @@ def exchange_code_for_credentials(code: str):
             "token_uri": "https://oauth2.googleapis.com/token",
             "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
             "client_secret": os.getenv("GOOGLE_CLIENT_SECRET"),
-            "redirect_uris": [os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/api/google/callback")],
+            "redirect_uris": [_redirect_uri()],
         }
     }
 
-    flow = Flow.from_client_config(
-        client_config,
-        scopes=[
-            "openid",
-            "https://www.googleapis.com/auth/userinfo.email",
-            "https://www.googleapis.com/auth/userinfo.profile",
-            "https://www.googleapis.com/auth/calendar",
-        ],
-        redirect_uri=os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/api/google/callback"),
-    )
+    return Flow.from_client_config(client_config, scopes=SCOPES, redirect_uri=_redirect_uri())
 
-    flow.fetch_token(code=code)
 
+def exchange_code_for_credentials(code: str):
+    flow = build_flow()
+    flow.fetch_token(code=code)
     return flow.credentials
 
 @router.get("/login")
 async def google_login(user = Depends(get_current_user)):
-    
-    if user.role != "teacher":
+
+    if user.get("role") != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can connect Google")
-    client_config = {
-        "web": {
-            "client_id": os.getenv("GOOGLE_CLIENT_ID"),
-            "project_id": "classhub",
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_secret": os.getenv("GOOGLE_CLIENT_SECRET"),
-            "redirect_uris": [os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/api/google/callback")],
-        }
-    }
 
-    flow = Flow.from_client_config(
-        client_config,
-        scopes=[
-            "openid",
-            "https://www.googleapis.com/auth/userinfo.email",
-            "https://www.googleapis.com/auth/userinfo.profile",
-            "https://www.googleapis.com/auth/calendar",
-        ],
-        redirect_uri=os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/api/google/callback"),
-    )
+    flow = build_flow()
 
     authorization_url, state = flow.authorization_url(
         access_type="offline",
@@ -101,4 +80,4 @@ async def google_callback(code: str, state: str):
         }
     )
 
-    return {"message": "Google connected successfully"}
\ No newline at end of file
+    return {"message": "Google connected successfully"}
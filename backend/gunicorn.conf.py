@@ -0,0 +1,56 @@
+"""Gunicorn profile for production.
+
+Every worker is a separate uvicorn process with its own Motor client, so
+nothing is shared between workers except what lives in Mongo. The app is
+therefore not preloaded: pymongo clients are not fork-safe and must be
+created after the fork, inside each worker.
+
+Start with:  gunicorn server:app -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Async workers are CPU bound on JSON/Pydantic/argon2 work, not I/O bound,
+# so one worker per core is the sweet spot. WEB_CONCURRENCY overrides it
+# (Render sets it from the instance size).
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Workers inherit this, so per-process state (cache.py) knows it is not alone
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+preload_app = False
+
+# Recycle workers now and then to cap slow memory growth; the jitter keeps
+# them from all restarting at the same moment.
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+
+# Drain: on SIGTERM a worker stops accepting connections and gets this long
+# to finish in-flight requests before it is killed.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Render terminates TLS in front of us. Only its proxies may set
+# X-Forwarded-For: uvicorn then takes the last hop they appended as
+# request.client.host, which the client cannot forge. Trusting "*" would let
+# any caller pick its own address and dodge the per-IP rate limits.
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s booted", worker.pid)
+
+
+def worker_int(worker):
+    worker.log.info("Worker %s interrupted, draining", worker.pid)
+
+
+def worker_exit(server, worker):
+    server.log.info("Worker %s exited", worker.pid)
@@ -0,0 +1,219 @@
+"""`Idempotency-Key` support for mutating endpoints.
+
+A client that retries a POST with the same Idempotency-Key gets the stored
+response back instead of running the handler again, so a retry after a
+timeout cannot double-charge credits or double-create invoices.
+
+Keys are scoped to the authenticated user. The first request records
+{fingerprint, status: "in_progress"} in `db.idempotency_keys` (TTL-indexed,
+IDEMPOTENCY_TTL_SECONDS); when the handler finishes the response is stored
+on the record. A repeat then:
+  * replays the stored response, marked `Idempotent-Replayed: true`;
+  * gets 409 while the original is still running;
+  * gets 422 if the same key comes with a different request body.
+Server errors (5xx) are not stored, so those can be retried for real.
+
+Completed responses are also held in a small in-process LRU in front of
+Mongo, each until the same expiry as its record; they never change, so that
+cache is safe with several workers.
+"""
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError
+
+from auth import SECRET_KEY, ALGORITHM
+from database import db
+
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IN_PROGRESS_TIMEOUT = 120
+MAX_STORED_BODY = 1024 * 1024
+LOCAL_CACHE_SIZE = 2048
+
+IDEMPOTENT_ROUTES = [re.compile(p) for p in (
+    r"^/api/students/[^/]+/credits$",
+    r"^/api/credits/bulk$",
+    r"^/api/invoices$",
+    r"^/api/invoices/batch$",
+    r"^/api/enrollments$",
+    r"^/api/classes$",
+    r"^/api/classes/[^/]+/attendance$",
+    r"^/api/classes/[^/]+/enrollments/bulk$",
+)]
+
+REPLAYED_HEADERS = {b"content-type", b"location"}
+
+
+def _caller(scope):
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            for part in value.decode("latin-1").split(";"):
+                key, _, token = part.strip().partition("=")
+                if key == "access_token":
+                    try:
+                        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+                    except JWTError:
+                        return None
+    return None
+
+
+def _fingerprint(scope, body):
+    return hashlib.sha256(
+        b"\0".join([scope["path"].encode(), scope.get("query_string", b""), body])
+    ).hexdigest()
+
+
+def _record_id(user_id, key):
+    return hashlib.sha256(f"{user_id}\0".encode() + key).hexdigest()
+
+
+async def _send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._completed = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not any(
+            p.match(scope["path"]) for p in IDEMPOTENT_ROUTES
+        ):
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers", []))
+        key = headers.get(b"idempotency-key")
+        user_id = _caller(scope)
+        if not key or not user_id:
+            return await self.app(scope, receive, send)
+
+        # Read the whole body once to fingerprint it, then replay it to the app.
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        fingerprint = _fingerprint(scope, body)
+        record_id = _record_id(user_id, key)
+
+        record = self._recall(record_id)
+        created_at = datetime.now(timezone.utc)
+        if record is None:
+            try:
+                await db.idempotency_keys.insert_one({
+                    "_id": record_id,
+                    "fingerprint": fingerprint,
+                    "status": "in_progress",
+                    "created_at": created_at,
+                })
+            except DuplicateKeyError:
+                record = await db.idempotency_keys.find_one({"_id": record_id})
+                if record is not None:
+                    created_at = await self._take_over_abandoned(record, fingerprint)
+                    if created_at is not None:
+                        record = None
+        if record is not None:
+            return await self._replay(record, fingerprint, record_id, send)
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        captured = {"status": 500, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                captured["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await db.idempotency_keys.delete_one({"_id": record_id})
+            raise
+
+        response_body = b"".join(captured["body"])
+        if captured["status"] >= 500 or len(response_body) > MAX_STORED_BODY:
+            await db.idempotency_keys.delete_one({"_id": record_id})
+            return
+        response = {
+            "status": captured["status"],
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in captured["headers"] if k.lower() in REPLAYED_HEADERS],
+            "body": response_body,
+        }
+        await db.idempotency_keys.update_one(
+            {"_id": record_id}, {"$set": {"status": "completed", "response": response}}
+        )
+        self._remember(record_id, {
+            "fingerprint": fingerprint, "status": "completed", "response": response, "created_at": created_at,
+        })
+
+    async def _take_over_abandoned(self, record, fingerprint):
+        """An in-progress record older than IN_PROGRESS_TIMEOUT belongs to a
+        worker that died mid-request; let this retry run the handler. Returns
+        the record's new created_at if this request took it over."""
+        started = record["created_at"].replace(tzinfo=timezone.utc)
+        if record["status"] != "in_progress" or record["fingerprint"] != fingerprint:
+            return None
+        now = datetime.now(timezone.utc)
+        if (now - started).total_seconds() < IN_PROGRESS_TIMEOUT:
+            return None
+        result = await db.idempotency_keys.update_one(
+            {"_id": record["_id"], "status": "in_progress", "created_at": record["created_at"]},
+            {"$set": {"created_at": now}},
+        )
+        return now if result.modified_count == 1 else None
+
+    def _recall(self, record_id):
+        entry = self._completed.get(record_id)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if datetime.now(timezone.utc) >= expires_at:
+            # Mongo's TTL monitor drops the record at the same point
+            del self._completed[record_id]
+            return None
+        return record
+
+    def _remember(self, record_id, record):
+        created_at = record["created_at"].replace(tzinfo=timezone.utc)
+        self._completed[record_id] = (created_at + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS), record)
+        self._completed.move_to_end(record_id)
+        while len(self._completed) > LOCAL_CACHE_SIZE:
+            self._completed.popitem(last=False)
+
+    async def _replay(self, record, fingerprint, record_id, send):
+        if record["fingerprint"] != fingerprint:
+            return await _send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+        if record["status"] != "completed":
+            return await _send_json(send, 409, {"detail": "A request with this Idempotency-Key is still in progress"}, [(b"retry-after", b"1")])
+        self._remember(record_id, record)
+        response = record["response"]
+        body = bytes(response["body"])
+        await send({
+            "type": "http.response.start",
+            "status": response["status"],
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in response["headers"]]
+            + [(b"content-length", str(len(body)).encode()), (b"idempotent-replayed", b"true")],
+        })
+        await send({"type": "http.response.body", "body": body})
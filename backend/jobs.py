@@ -0,0 +1,151 @@
+"""Background jobs: fire-and-forget tasks with progress stored in Mongo,
+and periodic maintenance loops guarded by a lease.
+
+Job documents live in `db.jobs` so any worker can report on a job started by
+another. Periodic loops run in every worker, but the schedule lives in
+`db.leases`: each job's document holds its `next_run_at`, and the worker
+that atomically moves it forward does the run. Because the schedule is in
+Mongo rather than in a per-process sleep, a job that is due runs right
+after startup, and recycled workers (max_requests) cannot keep pushing a
+6h or 24h job back indefinitely.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+# Upper bound on how long a loop sleeps before looking at the schedule again
+PERIODIC_POLL_SECONDS = 60
+
+_tasks = set()
+
+
+def spawn(coro):
+    """Run `coro` in the background, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def create_job(kind: str, params: dict, created_by: str = None) -> str:
+    job_id = f"job_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
+    await db.jobs.insert_one({
+        "job_id": job_id,
+        "kind": kind,
+        "params": params,
+        "status": "queued",
+        "progress": {},
+        "created_by": created_by,
+        "created_at": now,
+        "updated_at": now,
+    })
+    return job_id
+
+
+async def update_job(job_id: str, **fields):
+    if not job_id:
+        return
+    fields["updated_at"] = datetime.now(timezone.utc)
+    await db.jobs.update_one({"job_id": job_id}, {"$set": fields})
+
+
+async def run_job(job_id: str, fn):
+    """Run `fn(job_id)` and record its outcome on the job document."""
+    await update_job(job_id, status="running", started_at=datetime.now(timezone.utc))
+    try:
+        result = await fn(job_id)
+    except asyncio.CancelledError:
+        await update_job(job_id, status="interrupted")
+        raise
+    except Exception as exc:
+        logger.exception("Job %s failed", job_id)
+        await update_job(job_id, status="failed", error=str(exc))
+        return
+    await update_job(job_id, status="done", result=result, finished_at=datetime.now(timezone.utc))
+
+
+async def claim_run(name: str, interval: float):
+    """Claim the run of `name` if it is due, moving its next_run_at on by
+    `interval`. Returns (claimed, next_run_at); only one worker can claim a
+    given run."""
+    now = datetime.now(timezone.utc)
+    next_run_at = now + timedelta(seconds=interval)
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$or": [{"next_run_at": {"$lte": now}}, {"next_run_at": {"$exists": False}}]},
+            {"$set": {"holder": HOLDER, "last_run_at": now, "next_run_at": next_run_at}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        lease = await db.leases.find_one({"_id": name}, {"next_run_at": 1})
+        if not lease:
+            return False, now
+        return False, lease["next_run_at"].replace(tzinfo=timezone.utc)
+    return True, next_run_at
+
+
+def start_periodic(name: str, interval: float, fn):
+    """Call `fn()` every `interval` seconds, in one worker per run, starting
+    now if the job is already due."""
+    async def loop():
+        while True:
+            next_run_at = None
+            try:
+                claimed, next_run_at = await claim_run(name, interval)
+                if claimed:
+                    await fn()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Periodic job %s failed", name)
+            delay = PERIODIC_POLL_SECONDS
+            if next_run_at is not None:
+                delay = (next_run_at - datetime.now(timezone.utc)).total_seconds()
+            # Workers wake a little apart so they do not all race for the claim
+            await asyncio.sleep(min(max(delay, 1), PERIODIC_POLL_SECONDS) + random.random())
+
+    return spawn(loop())
+
+
+def start_once(name: str, fn):
+    """Call `fn()` once per database, in whichever worker claims it first
+    (e.g. seeding data that a new feature needs for existing documents).
+    A run that fails or is interrupted is retried at the next startup."""
+    async def run():
+        lease_id = f"once:{name}"
+        try:
+            await db.leases.insert_one({"_id": lease_id, "holder": HOLDER, "started_at": datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            return
+        try:
+            await fn()
+        except asyncio.CancelledError:
+            await asyncio.shield(db.leases.delete_one({"_id": lease_id}))
+            raise
+        except Exception:
+            logger.exception("One-off job %s failed", name)
+            await db.leases.delete_one({"_id": lease_id})
+            return
+        await db.leases.update_one({"_id": lease_id}, {"$set": {"done_at": datetime.now(timezone.utc)}})
+
+    return spawn(run())
+
+
+async def shutdown():
+    """Cancel outstanding background work (called from the lifespan).
+    Interrupted cascades are picked up again by the orphan sweeper."""
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
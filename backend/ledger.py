@@ -0,0 +1,179 @@
+"""Double-entry credit ledger.
+
+Every credit transaction carries two legs that sum to zero: the student's
+account and the school's. Posting the transaction and moving the cached
+`credit_balance` on the user happen in one Mongo transaction, so the two can
+no longer drift apart on a crash between the writes.
+
+Balances over time come from periodic snapshots: the balance at time T is the
+student's latest snapshot taken at or before T plus the transactions after
+it. `iter_drift` streams every student whose cached balance disagrees with
+that figure.
+"""
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from pymongo import InsertOne, UpdateOne
+
+from database import db, run_in_transaction
+from jobs import update_job
+
+SCHOOL_ACCOUNT = "school"
+
+SNAPSHOT_INTERVAL = int(os.getenv("CREDIT_SNAPSHOT_INTERVAL", str(24 * 60 * 60)))
+# Transactions newer than this are left for the next snapshot, so one whose
+# created_at was stamped just before a slow commit is never skipped.
+SNAPSHOT_SETTLE = timedelta(seconds=30)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def make_transaction(student_id: str, amount: float, note, created_by, now=None) -> dict:
+    return {
+        "tx_id": f"tx_{uuid.uuid4().hex[:12]}",
+        "student_id": student_id,
+        "amount": amount,
+        "note": note,
+        "entries": [
+            {"account": f"student:{student_id}", "amount": amount},
+            {"account": SCHOOL_ACCOUNT, "amount": -amount},
+        ],
+        "created_by": created_by,
+        "created_at": now or datetime.now(timezone.utc),
+    }
+
+
+async def post_adjustment(student_id: str, amount: float, note, created_by) -> dict:
+    transaction = make_transaction(student_id, amount, note, created_by)
+
+    async def write(session):
+        await db.credit_transactions.insert_one(transaction, session=session)
+        await db.users.update_one(
+            {"user_id": student_id},
+            {"$inc": {"credit_balance": amount}, "$set": {"updated_at": transaction["created_at"]}},
+            session=session
+        )
+
+    await run_in_transaction(write)
+    return transaction
+
+
+async def post_bulk(adjustments, note, created_by) -> int:
+    """Post {student_id: amount} in one transaction: one insert_many for the
+    ledger rows and one bulk_write for the balances."""
+    now = datetime.now(timezone.utc)
+    transactions = [make_transaction(sid, amount, note, created_by, now) for sid, amount in adjustments.items()]
+    if not transactions:
+        return 0
+
+    async def write(session):
+        await db.credit_transactions.bulk_write([InsertOne(t) for t in transactions], ordered=False, session=session)
+        await db.users.bulk_write([
+            UpdateOne({"user_id": sid}, {"$inc": {"credit_balance": amount}, "$set": {"updated_at": now}})
+            for sid, amount in adjustments.items()
+        ], ordered=False, session=session)
+
+    await run_in_transaction(write)
+    return len(transactions)
+
+
+async def balance_at(student_id: str, at: datetime) -> float:
+    snapshot = await db.credit_snapshots.find_one(
+        {"student_id": student_id, "as_of": {"$lte": at}}, sort=[("as_of", -1)]
+    )
+    since = snapshot["as_of"] if snapshot else _EPOCH
+    rows = await db.credit_transactions.aggregate([
+        {"$match": {"student_id": student_id, "created_at": {"$gt": since, "$lte": at}}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ]).to_list(1)
+    return (snapshot["balance"] if snapshot else 0) + (rows[0]["total"] if rows else 0)
+
+
+async def take_snapshots(job_id=None) -> dict:
+    """Snapshot every student whose balance moved since the previous run."""
+    as_of = datetime.now(timezone.utc) - SNAPSHOT_SETTLE
+    last_run = await db.credit_snapshot_runs.find_one({}, sort=[("as_of", -1)])
+    since = last_run["as_of"] if last_run else _EPOCH
+
+    deltas = {
+        row["_id"]: row["delta"]
+        async for row in db.credit_transactions.aggregate([
+            {"$match": {"created_at": {"$gt": since, "$lte": as_of}}},
+            {"$group": {"_id": "$student_id", "delta": {"$sum": "$amount"}}},
+        ])
+    }
+    previous = {
+        row["_id"]: row["balance"]
+        async for row in db.credit_snapshots.aggregate([
+            {"$match": {"student_id": {"$in": list(deltas)}}},
+            {"$sort": {"as_of": 1}},
+            {"$group": {"_id": "$student_id", "balance": {"$last": "$balance"}}},
+        ])
+    } if deltas else {}
+
+    snapshots = [
+        {"student_id": sid, "balance": previous.get(sid, 0) + delta, "as_of": as_of}
+        for sid, delta in deltas.items()
+    ]
+    if snapshots:
+        await db.credit_snapshots.insert_many(snapshots, ordered=False)
+    await db.credit_snapshot_runs.insert_one({"as_of": as_of, "students": len(snapshots)})
+    await update_job(job_id, progress={"students": len(snapshots)})
+    return {"as_of": as_of, "students": len(snapshots)}
+
+
+async def iter_drift(tolerance: float = 1e-6):
+    """Yield {student_id, recorded, expected} for each student whose cached
+    credit_balance disagrees with snapshot + ledger. Streams from one
+    aggregation cursor over users."""
+    pipeline = [
+        {"$match": {"role": "student"}},
+        {"$project": {"_id": 0, "user_id": 1, "credit_balance": 1}},
+        {"$lookup": {
+            "from": "credit_snapshots",
+            "let": {"uid": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$student_id", "$$uid"]}}},
+                {"$sort": {"as_of": -1}},
+                {"$limit": 1},
+            ],
+            "as": "snapshot",
+        }},
+        {"$set": {"snapshot": {"$arrayElemAt": ["$snapshot", 0]}}},
+        {"$lookup": {
+            "from": "credit_transactions",
+            "let": {"uid": "$user_id", "since": {"$ifNull": ["$snapshot.as_of", _EPOCH]}},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$student_id", "$$uid"]},
+                    {"$gt": ["$created_at", "$$since"]},
+                ]}}},
+                {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+            ],
+            "as": "since_snapshot",
+        }},
+        {"$project": {
+            "student_id": "$user_id",
+            "recorded": {"$ifNull": ["$credit_balance", 0]},
+            "expected": {"$add": [
+                {"$ifNull": ["$snapshot.balance", 0]},
+                {"$ifNull": [{"$arrayElemAt": ["$since_snapshot.total", 0]}, 0]},
+            ]},
+        }},
+        {"$match": {"$expr": {"$gt": [{"$abs": {"$subtract": ["$recorded", "$expected"]}}, tolerance]}}},
+    ]
+    async for row in db.users.aggregate(pipeline, batchSize=500):
+        yield row
+
+
+async def reconcile(job_id=None) -> dict:
+    drifted = []
+    count = 0
+    async for row in iter_drift():
+        count += 1
+        if len(drifted) < 1000:
+            drifted.append(row)
+        if count % 100 == 0:
+            await update_job(job_id, progress={"drifted": count})
+    return {"drifted": count, "sample": drifted}
@@ -0,0 +1,102 @@
+"""Request-scoped batching loaders (DataLoader style).
+
+A handler and its dependencies often need the same user or class document:
+get_current_user loads the caller, get_class loads the teacher, the access
+checks load the class again. A Loader collects every `load(key)` issued in the
+same event-loop tick into one `$in` query and memoises the result for the rest
+of the request. Identical batches issued by concurrent requests additionally
+share one in-flight query (see singleflight.py), so loaded documents are
+shared and must not be modified in place.
+
+    loaders = get_loaders(request)
+    class_doc = await loaders.classes.load(class_id)
+    teachers = await loaders.users.load_many(teacher_ids)
+"""
+import asyncio
+
+from fastapi import Request
+
+from database import db
+from singleflight import reads
+
+
+class Loader:
+    def __init__(self, batch_fn):
+        # batch_fn(keys) -> {key: doc} for the keys that exist
+        self._batch_fn = batch_fn
+        self._memo = {}
+        self._queue = []
+
+    def load(self, key):
+        """Future resolving to the document for `key`, or None if missing."""
+        future = self._memo.get(key)
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._memo[key] = future
+        self._queue.append((key, future))
+        if len(self._queue) == 1:
+            loop.call_soon(self._dispatch)
+        return future
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*(self.load(k) for k in keys))
+
+    def prime(self, key, doc):
+        """Seed the memo with a document the caller already has."""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(doc)
+        self._memo[key] = future
+
+    def clear(self, key):
+        """Forget `key`, e.g. after the handler modified the document."""
+        self._memo.pop(key, None)
+
+    def _dispatch(self):
+        pending, self._queue = self._queue, []
+        asyncio.ensure_future(self._run(pending))
+
+    async def _run(self, pending):
+        try:
+            found = await self._batch_fn([key for key, _ in pending])
+        except Exception as exc:
+            for key, future in pending:
+                if self._memo.get(key) is future:
+                    del self._memo[key]
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for key, future in pending:
+            if not future.done():
+                future.set_result(found.get(key))
+
+
+def _by_id(collection, id_field):
+    async def fetch(keys):
+        if len(keys) == 1:
+            doc = await db[collection].find_one({id_field: keys[0]}, {"_id": 0})
+            return {keys[0]: doc} if doc else {}
+        docs = await db[collection].find({id_field: {"$in": keys}}, {"_id": 0}).to_list(len(keys))
+        return {d[id_field]: d for d in docs}
+
+    async def batch(keys):
+        # Identical batches from concurrent requests (everyone opening the
+        # same class) share one query.
+        keys = sorted(set(keys), key=str)
+        return await reads.do((collection, tuple(keys)), lambda: fetch(keys))
+    return batch
+
+
+class Loaders:
+    def __init__(self):
+        self.users = Loader(_by_id("users", "user_id"))
+        self.classes = Loader(_by_id("classes", "class_id"))
+
+
+def get_loaders(request: Request) -> Loaders:
+    """FastAPI dependency: the Loaders instance for this request."""
+    loaders = getattr(request.state, "loaders", None)
+    if loaders is None:
+        loaders = request.state.loaders = Loaders()
+    return loaders
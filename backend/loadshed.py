@@ -0,0 +1,166 @@
+"""Per-route-group concurrency limits with load shedding.
+
+Without a limit, a slow Mongo makes requests pile up inside the worker, and
+every route gets slower, `/auth/me` included. Each request is matched to a
+group (auth, exports, admin writes, dashboards). A group runs at most
+`concurrency` requests; the next `queue` wait FIFO for a slot, and anything
+beyond that is answered 503 with Retry-After straight away. A queued request
+that has not got a slot within `max_wait` seconds is shed as well.
+
+The Motor pool's checkout wait (database.pool_wait) is the second signal.
+While it is above POOL_WAIT_TARGET_MS, Mongo is the bottleneck and more
+concurrency only lengthens the queue there. Non-critical groups then admit
+only half their concurrency and do not queue at all. The auth group is
+critical: it keeps its full allowance, so logins and /auth/me stay fast.
+
+Limits are per worker process; override one with
+LOADSHED_<GROUP>="<concurrency>,<queue>,<max_wait_seconds>".
+"""
+import asyncio
+import json
+import os
+import re
+from collections import deque
+
+import metrics
+from database import pool_wait
+
+POOL_WAIT_TARGET_MS = float(os.getenv("POOL_WAIT_TARGET_MS", "50"))
+RETRY_AFTER_SECONDS = 2
+
+# Never limited: the health check and the metrics that explain an overload
+EXEMPT_PATHS = {"/api/", "/api/metrics"}
+
+
+def _limits(name, concurrency, queue, max_wait):
+    spec = os.getenv(f"LOADSHED_{name.upper()}")
+    if spec:
+        concurrency, queue, max_wait = spec.split(",")
+    return int(concurrency), int(queue), float(max_wait)
+
+
+class RouteGroup:
+    def __init__(self, name, patterns, concurrency, queue, max_wait, critical=False):
+        self.name = name
+        self.patterns = [re.compile(p) for p in patterns]
+        self.concurrency, self.queue, self.max_wait = _limits(name, concurrency, queue, max_wait)
+        self.critical = critical
+        self.in_flight = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0, "pool_wait": 0}
+
+    def matches(self, path):
+        return any(p.search(path) for p in self.patterns)
+
+    async def acquire(self, congested):
+        """Take a slot; returns None when admitted, else the reason for shedding."""
+        reduced = congested and not self.critical
+        limit = max(1, self.concurrency // 2) if reduced else self.concurrency
+        if self.in_flight < limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if reduced:
+            return "pool_wait"
+        if len(self._waiters) >= self.queue:
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                return "timeout"
+            # release() handed over the slot just as the wait ran out
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot it was just handed
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+        return None
+
+    def release(self):
+        # Hand the slot straight to the oldest live waiter; in_flight is unchanged
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+        }
+
+
+# First match wins; the last group catches every other /api route.
+GROUPS = [
+    RouteGroup("auth", [r"^/api/auth/"], concurrency=16, queue=64, max_wait=2.0, critical=True),
+    RouteGroup("exports", [r"\.csv$", r"^/api/credits/reconcile$"], concurrency=2, queue=2, max_wait=0.25),
+    RouteGroup("admin_writes", [
+        r"^/api/admin/",
+        r"^/api/users/import$",
+        r"^/api/invoices/batch$",
+        r"^/api/credits/bulk$",
+    ], concurrency=4, queue=8, max_wait=1.0),
+    RouteGroup("dashboards", [r"^/api/"], concurrency=48, queue=96, max_wait=0.5),
+]
+
+
+def group_for(path):
+    if path in EXEMPT_PATHS:
+        return None
+    return next((g for g in GROUPS if g.matches(path)), None)
+
+
+async def _send_shed(send, group, reason):
+    body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(RETRY_AFTER_SECONDS).encode()),
+            (b"x-shed-reason", f"{group.name}:{reason}".encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class LoadShedMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        group = group_for(scope["path"]) if scope["type"] == "http" and scope["method"] != "OPTIONS" else None
+        if group is None:
+            return await self.app(scope, receive, send)
+        congested = pool_wait.wait_seconds() * 1000 > POOL_WAIT_TARGET_MS
+        reason = await group.acquire(congested)
+        if reason is not None:
+            group.shed[reason] += 1
+            return await _send_shed(send, group, reason)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
+
+
+metrics.register("loadshed", lambda: {
+    "pool": pool_wait.stats(),
+    "pool_wait_target_ms": POOL_WAIT_TARGET_MS,
+    **{g.name: g.stats() for g in GROUPS},
+})
@@ -0,0 +1,17 @@
+"""Process-local counters exposed through GET /api/metrics.
+
+Components register a zero-argument callable returning a dict; the endpoint
+collects them at request time. Figures are per worker process (the response
+carries the pid) — with several gunicorn workers each one reports its own.
+"""
+import os
+
+_sources = {}
+
+
+def register(name, snapshot_fn):
+    _sources[name] = snapshot_fn
+
+
+def snapshot():
+    return {"pid": os.getpid(), **{name: fn() for name, fn in _sources.items()}}
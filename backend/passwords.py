@@ -0,0 +1,64 @@
+"""Password hashing, plus a process pool for hashing in bulk.
+
+argon2 is deliberately CPU-heavy; hashing thousands of roster passwords on the
+event loop would stall every other request. `hash_many` spreads the work over
+a process pool, one process per core by default (PASSWORD_HASH_PROCESSES).
+Every gunicorn worker has its own pool, but processes are only started while
+an import is running and the OS shares the cores with the other workers.
+Pool processes are spawned, not forked: forking a process that runs an event
+loop and Motor's threads can deadlock the child. This module only imports
+passlib, so they start quickly.
+
+Imported passwords are hashed with `bulk_context`, argon2id at the OWASP
+minimum (19 MiB, 2 passes, 1 lane; about 45 ms a hash instead of 260 ms for
+the passlib defaults in `pwd_context`). They are a one-time initial password,
+and the first login rehashes them at full strength (auth.verify_and_rehash).
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+bulk_context = CryptContext(
+    schemes=["argon2"], argon2__memory_cost=19 * 1024, argon2__time_cost=2, argon2__parallelism=1,
+)
+
+PASSWORD_HASH_PROCESSES = int(os.getenv("PASSWORD_HASH_PROCESSES", str(os.cpu_count() or 2)))
+
+_pool = None
+
+
+def _hash_chunk(passwords):
+    return [bulk_context.hash(p) for p in passwords]
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def hash_many(passwords):
+    """Hash `passwords` across the pool, preserving order."""
+    if not passwords:
+        return []
+    size = max(1, -(-len(passwords) // PASSWORD_HASH_PROCESSES))
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(get_pool(), _hash_chunk, passwords[i:i + size])
+        for i in range(0, len(passwords), size)
+    ))
+    return [h for chunk in chunks for h in chunk]
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
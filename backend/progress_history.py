@@ -0,0 +1,93 @@
+"""Append-only progress history in bucketed documents.
+
+`progress` keeps one current-grade document per (class, student). Every grade
+event is also appended to a bucket in `progress_history`: one document per
+student per class per month, holding up to BUCKET_CAP events plus precomputed
+count/min/max/last values, so a year-long trend is ~12 document reads.
+
+When a month's bucket is full the filtered upsert misses and a new bucket for
+the same month is started.
+"""
+import re
+from datetime import datetime, timezone
+
+from database import db
+
+BUCKET_CAP = 200
+
+_number = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*%?\s*$")
+
+
+def numeric_score(grade):
+    """85, "85", "85%" -> 85.0; letter grades and "Pass" -> None."""
+    if grade is None:
+        return None
+    match = _number.match(str(grade))
+    return float(match.group(1)) if match else None
+
+
+async def record_progress_event(class_id: str, student_id: str, event: dict):
+    now = event.setdefault("at", datetime.now(timezone.utc))
+    score = event.setdefault("score", numeric_score(event.get("grade")))
+    update = {
+        "$push": {"events": event},
+        "$inc": {"count": 1},
+        "$set": {"last_grade": event.get("grade"), "last_score": score, "last_at": now},
+        "$setOnInsert": {"first_at": now},
+    }
+    if score is not None:
+        update["$min"] = {"min_score": score}
+        update["$max"] = {"max_score": score}
+    await db.progress_history.update_one(
+        {
+            "class_id": class_id,
+            "student_id": student_id,
+            "month": now.strftime("%Y-%m"),
+            "count": {"$lt": BUCKET_CAP},
+        },
+        update,
+        upsert=True,
+    )
+
+
+async def get_progress_history(class_id: str, student_id: str = None, since_month: str = None, include_events: bool = True):
+    """Per-student monthly trend (count/min/max/last) and, optionally, the events."""
+    query = {"class_id": class_id}
+    if student_id:
+        query["student_id"] = student_id
+    if since_month:
+        query["month"] = {"$gte": since_month}
+    projection = {"_id": 0}
+    if not include_events:
+        projection["events"] = 0
+    buckets = await db.progress_history.find(query, projection).sort(
+        [("student_id", 1), ("month", 1), ("first_at", 1)]
+    ).to_list(None)
+
+    students = {}
+    for b in buckets:
+        entry = students.setdefault(b["student_id"], {"student_id": b["student_id"], "trend": [], "events": []})
+        trend = entry["trend"]
+        if trend and trend[-1]["month"] == b["month"]:
+            # overflow bucket for the same month: fold it in
+            point = trend[-1]
+            point["count"] += b.get("count", 0)
+            point["last_grade"], point["last_score"] = b.get("last_grade"), b.get("last_score")
+            for key, pick in (("min_score", min), ("max_score", max)):
+                values = [v for v in (point[key], b.get(key)) if v is not None]
+                point[key] = pick(values) if values else None
+        else:
+            trend.append({
+                "month": b["month"],
+                "count": b.get("count", 0),
+                "min_score": b.get("min_score"),
+                "max_score": b.get("max_score"),
+                "last_grade": b.get("last_grade"),
+                "last_score": b.get("last_score"),
+            })
+        if include_events:
+            entry["events"].extend(b.get("events", []))
+    if not include_events:
+        for entry in students.values():
+            del entry["events"]
+    return list(students.values())
@@ -0,0 +1,165 @@
+"""Token-bucket rate limits in front of the argon2 endpoints (login, register).
+
+Every argon2 hash or verify costs tens of milliseconds of CPU. A burst of
+credential stuffing, or a client stuck in a retry loop, could otherwise
+starve every other request on the worker. Each limit is a token bucket:
+`capacity` attempts, refilled evenly over `per_seconds`. A request that
+finds the bucket empty gets 429 with Retry-After, before any database read
+or hashing happens.
+
+Stores:
+  * MemoryBucketStore — in-process, capped LRU of buckets. Each worker
+                        counts on its own, so the effective limit is
+                        roughly limit × workers. It doubles as the local
+                        stand-in for tests.
+  * RedisBucketStore  — shared by all workers, one atomic Lua call per
+                        check. Selected by CACHE_URL, the same Redis as
+                        cache.py.
+
+Limits are configured as "<count>/<seconds>", e.g. LOGIN_IP_LIMIT=300/60.
+Login is checked against three buckets:
+  * login_ip       — per client IP. Generous: a school or campus puts
+                     hundreds of students behind one NAT address, all
+                     logging in when the lesson starts.
+  * login_account  — per account *and* IP, tight. Guessing someone's
+                     password from one address cannot lock them out from
+                     anywhere else.
+  * login_email    — per account from any IP, looser than login_account.
+                     Caps guessing spread across many addresses.
+Tune them per deployment with LOGIN_IP_LIMIT, LOGIN_ACCOUNT_LIMIT,
+LOGIN_EMAIL_LIMIT, REGISTER_IP_LIMIT and REGISTER_ACCOUNT_LIMIT.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+import metrics
+from cache import CACHE_URL, redis_client
+
+BUCKETS_MAX_ENTRIES = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+
+def _parse(spec: str):
+    count, _, seconds = spec.partition("/")
+    return int(count), float(seconds)
+
+
+class MemoryBucketStore:
+    def __init__(self, max_entries=BUCKETS_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def take(self, key, capacity, rate):
+        """Take one token; 0.0 if granted, else seconds until one is available."""
+        now = self.clock()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # An evicted bucket just starts full again, which is the lenient side
+        while len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def reset(self, key):
+        self._buckets.pop(key, None)
+
+    def stats(self):
+        return {"buckets": len(self._buckets)}
+
+
+# KEYS[1] bucket; ARGV capacity, rate (tokens/s). Returns the wait in ms.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return math.ceil(wait * 1000)
+"""
+
+
+class RedisBucketStore:
+    def __init__(self, client=None):
+        self._client = client
+        self._script = None
+
+    @property
+    def client(self):
+        return self._client or redis_client()
+
+    async def take(self, key, capacity, rate):
+        if self._script is None:
+            self._script = self.client.register_script(_TAKE_SCRIPT)
+        wait_ms = await self._script(keys=[f"rl:{key}"], args=[capacity, rate])
+        return int(wait_ms) / 1000
+
+    async def reset(self, key):
+        await self.client.delete(f"rl:{key}")
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class RateLimit:
+    def __init__(self, name, spec, store):
+        self.name = name
+        self.capacity, self.per_seconds = _parse(spec)
+        self.rate = self.capacity / self.per_seconds
+        self.store = store
+        self.allowed = 0
+        self.rejected = 0
+
+    async def hit(self, key):
+        """Spend one attempt for `key`; raise 429 with Retry-After when empty."""
+        wait = await self.store.take(f"{self.name}:{key}", self.capacity, self.rate)
+        if wait > 0:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+        self.allowed += 1
+
+    async def reset(self, key):
+        await self.store.reset(f"{self.name}:{key}")
+
+    def stats(self):
+        return {"allowed": self.allowed, "rejected": self.rejected}
+
+
+store = RedisBucketStore() if CACHE_URL else MemoryBucketStore()
+
+login_ip = RateLimit("login_ip", os.getenv("LOGIN_IP_LIMIT", "300/60"), store)
+login_account = RateLimit("login_account", os.getenv("LOGIN_ACCOUNT_LIMIT", "5/300"), store)
+login_email = RateLimit("login_email", os.getenv("LOGIN_EMAIL_LIMIT", "30/900"), store)
+register_ip = RateLimit("register_ip", os.getenv("REGISTER_IP_LIMIT", "100/3600"), store)
+register_account = RateLimit("register_account", os.getenv("REGISTER_ACCOUNT_LIMIT", "3/3600"), store)
+
+LIMITS = (login_ip, login_account, login_email, register_ip, register_account)
+
+metrics.register("ratelimit", lambda: {
+    **{limit.name: limit.stats() for limit in LIMITS},
+    **store.stats(),
+})
@@ -0,0 +1,219 @@
+"""Invoice status sweeps and monthly revenue rollups.
+
+Each invoice belongs to the month it was issued (`rollup_month`, "YYYY-MM").
+`revenue_rollups` keeps, per month, the amounts and counts billed, paid,
+outstanding (unpaid + overdue) and overdue. create/update/delete_invoice,
+the batch endpoint and the overdue sweeper apply their change with `$inc`,
+so /api/reports/revenue reads one document per month.
+"""
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+
+from pymongo import UpdateOne
+
+from database import db
+from jobs import update_job
+
+OVERDUE_SWEEP_INTERVAL = int(os.getenv("OVERDUE_SWEEP_INTERVAL", str(60 * 60)))
+SWEEP_BATCH_SIZE = 1000
+
+FIELDS = ("billed", "paid", "outstanding", "overdue")
+
+# A rebuild re-runs the months written while it read the invoices, at most this often
+REBUILD_CATCH_UP_PASSES = 5
+# updated_at / deleted_at are stamped just before the write commits
+REBUILD_OVERLAP = timedelta(seconds=5)
+
+# rollup_month, or the creation month for invoices from before it was stored
+_MONTH = {"$ifNull": ["$rollup_month", {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}}]}
+
+
+def rollup_month(invoice: dict) -> str:
+    if invoice.get("rollup_month"):
+        return invoice["rollup_month"]
+    created_at = invoice.get("created_at") or datetime.now(timezone.utc)
+    return created_at.strftime("%Y-%m")
+
+
+def _inc(deltas: dict, invoice: dict, *changes):
+    """Accumulate (field, sign) changes for `invoice` into deltas[month]."""
+    month = deltas[rollup_month(invoice)]
+    for field, sign in changes:
+        month[f"{field}_amount"] += sign * invoice.get("amount", 0)
+        month[f"{field}_count"] += sign
+
+
+async def _apply(deltas: dict):
+    ops = [
+        UpdateOne({"month": month}, {"$inc": dict(inc)}, upsert=True)
+        for month, inc in deltas.items() if inc
+    ]
+    if ops:
+        await db.revenue_rollups.bulk_write(ops, ordered=False)
+
+
+def _deltas():
+    return defaultdict(lambda: defaultdict(int))
+
+
+async def on_created(invoices):
+    deltas = _deltas()
+    for invoice in invoices:
+        _inc(deltas, invoice, ("billed", 1), ("outstanding", 1))
+    await _apply(deltas)
+
+
+async def on_paid(before: dict):
+    """`before` is the invoice as it was prior to being marked paid."""
+    deltas = _deltas()
+    changes = [("paid", 1), ("outstanding", -1)]
+    if before.get("status") == "overdue":
+        changes.append(("overdue", -1))
+    _inc(deltas, before, *changes)
+    await _apply(deltas)
+
+
+async def on_deleted(before: dict):
+    deltas = _deltas()
+    changes = [("billed", -1)]
+    if before.get("status") == "paid":
+        changes.append(("paid", -1))
+    else:
+        changes.append(("outstanding", -1))
+        if before.get("status") == "overdue":
+            changes.append(("overdue", -1))
+    _inc(deltas, before, *changes)
+    await _apply(deltas)
+
+
+async def sweep_overdue(job_id=None) -> dict:
+    """Flip unpaid invoices past their due date to overdue, in bulk batches
+    driven by the (status, due_date) index."""
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    flipped = 0
+    while True:
+        batch = await db.invoices.find(
+            {"status": "unpaid", "due_date": {"$lt": today}},
+            {"_id": 0, "invoice_id": 1},
+        ).limit(SWEEP_BATCH_SIZE).to_list(SWEEP_BATCH_SIZE)
+        if not batch:
+            break
+        ids = [b["invoice_id"] for b in batch]
+        run_id = uuid.uuid4().hex
+        stamp = datetime.now(timezone.utc)
+        await db.invoices.update_many(
+            {"invoice_id": {"$in": ids}, "status": "unpaid"},
+            {"$set": {"status": "overdue", "overdue_at": stamp, "overdue_run": run_id, "updated_at": stamp}},
+        )
+        # Count what this update flipped, by its run id rather than by the
+        # current status: an invoice paid since then was still flipped here,
+        # and on_paid has taken (or will take) its overdue back out.
+        changed = await db.invoices.aggregate([
+            {"$match": {"invoice_id": {"$in": ids}, "overdue_run": run_id}},
+            {"$group": {"_id": _MONTH, "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+        ]).to_list(None)
+        deltas = _deltas()
+        for month in changed:
+            deltas[month["_id"]]["overdue_amount"] += month["amount"]
+            deltas[month["_id"]]["overdue_count"] += month["count"]
+        await _apply(deltas)
+        flipped += sum(month["count"] for month in changed)
+        await update_job(job_id, progress={"flipped": flipped})
+    return {"flipped": flipped}
+
+
+def _rollup_pipeline():
+    def amount_if(cond):
+        return {"$sum": {"$cond": [cond, "$amount", 0]}}
+
+    def count_if(cond):
+        return {"$sum": {"$cond": [cond, 1, 0]}}
+
+    is_paid = {"$eq": ["$status", "paid"]}
+    is_open = {"$ne": ["$status", "paid"]}
+    is_overdue = {"$eq": ["$status", "overdue"]}
+    return [
+        {"$group": {
+            "_id": _MONTH,
+            "billed_amount": {"$sum": "$amount"},
+            "billed_count": {"$sum": 1},
+            "paid_amount": amount_if(is_paid),
+            "paid_count": count_if(is_paid),
+            "outstanding_amount": amount_if(is_open),
+            "outstanding_count": count_if(is_open),
+            "overdue_amount": amount_if(is_overdue),
+            "overdue_count": count_if(is_overdue),
+        }},
+        {"$set": {"month": "$_id"}},
+        {"$unset": "_id"},
+    ]
+
+
+async def _recompute_months(months: list):
+    """Replace the rollups of `months` in place; drop those with no invoices left."""
+    match = {"$match": {"$or": [
+        {"rollup_month": {"$in": months}},
+        {"rollup_month": {"$exists": False}, "$expr": {"$in": [_MONTH, months]}},
+    ]}}
+    await db.invoices.aggregate([
+        match,
+        *_rollup_pipeline(),
+        {"$merge": {"into": "revenue_rollups", "on": "month", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]).to_list(None)
+    kept = {m["_id"] for m in await db.invoices.aggregate([match, {"$group": {"_id": _MONTH}}]).to_list(None)}
+    await db.revenue_rollups.delete_many({"month": {"$in": [m for m in months if m not in kept]}})
+
+
+async def _changed_months(since: datetime) -> list:
+    since = since - REBUILD_OVERLAP
+    months = {
+        rollup_month(invoice) async for invoice in db.invoices.find(
+            {"updated_at": {"$gte": since}}, {"_id": 0, "rollup_month": 1, "created_at": 1}
+        )
+    }
+    async for tombstone in db.tombstones.find(
+        {"collection": "invoices", "deleted_at": {"$gte": since}}, {"_id": 0, "rollup_month": 1}
+    ):
+        if tombstone.get("rollup_month"):
+            months.add(tombstone["rollup_month"])
+    return sorted(months)
+
+
+async def rebuild_revenue_rollups(job_id=None) -> dict:
+    """Recompute every month from the invoices. Runs once per database at
+    startup (jobs.start_once) to seed invoices issued before the rollups
+    existed, and on demand from the admin endpoint.
+
+    The result is built in a staging collection and renamed over
+    `revenue_rollups`, so readers never see empty months. The $inc hooks keep
+    running meanwhile, and the ones that land after the invoices were read
+    only reach the old rollups; the months they touched (invoices with a newer
+    updated_at, deleted invoices' tombstones) are recomputed again until a
+    pass finds none.
+    """
+    started = datetime.now(timezone.utc)
+    staging = f"revenue_rollups_rebuild_{uuid.uuid4().hex[:8]}"
+    # $out keeps the indexes of the collection it replaces
+    await db[staging].create_index("month", unique=True)
+    await db.invoices.aggregate(_rollup_pipeline() + [{"$out": staging}]).to_list(None)
+    await db[staging].rename("revenue_rollups", dropTarget=True)
+
+    since = started
+    for _ in range(REBUILD_CATCH_UP_PASSES):
+        pass_started = datetime.now(timezone.utc)
+        months = await _changed_months(since)
+        if not months:
+            break
+        await _recompute_months(months)
+        since = pass_started
+    return {"months": await db.revenue_rollups.count_documents({})}
+
+
+def present(doc: dict, month: str) -> dict:
+    doc = doc or {}
+    return {"month": month, **{
+        f"{field}_{kind}": doc.get(f"{field}_{kind}", 0)
+        for field in FIELDS for kind in ("amount", "count")
+    }}
@@ -0,0 +1,125 @@
+"""Term rollover: copy classes with their assignments and notes inside Mongo.
+
+Each copy is one aggregation per collection: `$match` the source documents,
+`$set` fresh ids, shifted dates and new timestamps, then `$merge` into the
+same collection on the unique id field. No document passes through Python.
+
+Ids are derived, not random: `class_abc123` cloned under tag `2025t1`
+becomes `class_2025t1_abc123`, and the same goes for `asn_` and `note_`
+ids. Children find their new class_id the same way. `$merge` uses
+`whenMatched: keepExisting`, so re-running a rollover with the same tag
+(for example after an interrupted job) only fills in what is missing and
+never duplicates. Clones carry `cloned_from` and `rollover_tag`.
+Enrollments, attendance, progress and videos stay with the old term.
+
+Dates are stored as the ISO strings the client sent. They are shifted by
+`shift_days` and written back in the same shape (date only, minutes, or
+full). A value that does not parse is copied unchanged.
+"""
+import re
+
+from fastapi import HTTPException
+
+from database import db
+from jobs import update_job
+
+ROLLOVER_BATCH_SIZE = 500
+
+# collection -> (id field, id prefix, date fields to shift)
+CLONED = {
+    "classes": ("class_id", "class_", ("start_time", "end_time")),
+    "assignments": ("assignment_id", "asn_", ("due_date",)),
+    "notes": ("note_id", "note_", ("session_date",)),
+}
+
+_TAG = re.compile(r"^[a-z0-9]{1,16}$")
+
+
+def check_tag(tag: str) -> str:
+    tag = (tag or "").lower()
+    if not _TAG.match(tag):
+        raise HTTPException(status_code=400, detail="Rollover tag must be 1-16 lowercase letters or digits")
+    return tag
+
+
+def clone_id(old_id: str, prefix: str, tag: str) -> str:
+    """Python twin of _clone_id_expr, e.g. for the new class_id of a clone."""
+    rest = old_id[len(prefix):] if old_id.startswith(prefix) else old_id
+    return f"{prefix}{tag}_{rest}"
+
+
+def _clone_id_expr(field: str, prefix: str, tag: str) -> dict:
+    return {"$concat": [prefix, tag, "_", {"$replaceOne": {"input": f"${field}", "find": prefix, "replacement": ""}}]}
+
+
+def _shift_expr(field: str, days: int) -> dict:
+    value = f"${field}"
+    shifted = {"$dateAdd": {
+        "startDate": {"$dateFromString": {"dateString": value, "onError": None, "onNull": None}},
+        "unit": "day",
+        "amount": days,
+    }}
+    length = {"$strLenCP": {"$ifNull": [value, ""]}}
+    formatted = {"$switch": {
+        "branches": [
+            {"case": {"$eq": [length, 10]}, "then": {"$dateToString": {"date": shifted, "format": "%Y-%m-%d"}}},
+            {"case": {"$eq": [length, 16]}, "then": {"$dateToString": {"date": shifted, "format": "%Y-%m-%dT%H:%M"}}},
+            {"case": {"$eq": [length, 19]}, "then": {"$dateToString": {"date": shifted, "format": "%Y-%m-%dT%H:%M:%S"}}},
+        ],
+        "default": {"$dateToString": {"date": shifted, "format": "%Y-%m-%dT%H:%M:%S.%LZ"}},
+    }}
+    return {"$ifNull": [formatted, value]}
+
+
+async def _clone_collection(collection: str, class_ids: list, tag: str, shift_days: int, overrides: dict = None):
+    id_field, prefix, date_fields = CLONED[collection]
+    changes = {
+        id_field: _clone_id_expr(id_field, prefix, tag),
+        "cloned_from": f"${id_field}",
+        "rollover_tag": tag,
+        "created_at": "$$NOW",
+        "updated_at": "$$NOW",
+        **{field: _shift_expr(field, shift_days) for field in date_fields},
+    }
+    if collection == "classes":
+        changes.update(enrolled_count=0, recording_link="$$REMOVE")
+    else:
+        changes["class_id"] = _clone_id_expr("class_id", "class_", tag)
+    changes.update(overrides or {})
+    await db[collection].aggregate([
+        {"$match": {"class_id": {"$in": class_ids}, "rollover_tag": {"$ne": tag}}},
+        {"$set": changes},
+        {"$unset": "_id"},
+        {"$merge": {"into": collection, "on": id_field, "whenMatched": "keepExisting", "whenNotMatched": "insert"}},
+    ]).to_list(None)
+
+
+async def clone_classes(class_ids: list, tag: str, shift_days: int, overrides: dict = None, job_id=None) -> dict:
+    """Clone the classes plus their assignments and notes, in batches of class ids."""
+    done = 0
+    for i in range(0, len(class_ids), ROLLOVER_BATCH_SIZE):
+        batch = class_ids[i:i + ROLLOVER_BATCH_SIZE]
+        for collection in CLONED:
+            await _clone_collection(collection, batch, tag, shift_days, overrides if collection == "classes" else None)
+        done += len(batch)
+        await update_job(job_id, progress={"classes": done, "of": len(class_ids)})
+    new_ids = [clone_id(cid, "class_", tag) for cid in class_ids]
+    return {
+        "tag": tag,
+        "classes": await db.classes.count_documents({"class_id": {"$in": new_ids}}),
+        "assignments": await db.assignments.count_documents({"class_id": {"$in": new_ids}}),
+        "notes": await db.notes.count_documents({"class_id": {"$in": new_ids}}),
+    }
+
+
+async def run_rollover(tag: str, shift_days: int, ended_before: str = None, teacher_id: str = None, job_id=None) -> dict:
+    """Admin rollover: clone every class (optionally only those that ended
+    before `ended_before`, or of one teacher) that is not itself a clone
+    made under this tag."""
+    query = {"rollover_tag": {"$ne": tag}}
+    if ended_before:
+        query["end_time"] = {"$lt": ended_before}
+    if teacher_id:
+        query["teacher_id"] = teacher_id
+    class_ids = await db.classes.distinct("class_id", query)
+    return await clone_classes(class_ids, tag, shift_days, job_id=job_id)
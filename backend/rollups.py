@@ -0,0 +1,208 @@
+"""Attendance rollups: present/absent/late counts per class and per
+(class, student), kept up to date by save_attendance.
+
+save_attendance replaces the session document for (class_id, session_date)
+and passes the previous and new document here; only the difference between
+the two is applied with `$inc`, so re-submitting a session never double counts.
+A session that was archived counts as the previous document, and re-saving
+it brings it back to the live collection.
+
+Rebuild from the raw attendance (live + archive) with
+
+    python rollups.py rebuild [class_id]
+
+or POST /api/admin/rollups/attendance/rebuild.
+"""
+import asyncio
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ASCENDING, UpdateOne
+
+from database import db
+
+STATUSES = ("present", "absent", "late")
+
+CLASS_ROLLUPS = "attendance_class_rollups"
+STUDENT_ROLLUPS = "attendance_student_rollups"
+
+# A rebuild re-runs the classes saved while it read the raw data, at most this often
+REBUILD_CATCH_UP_PASSES = 5
+# updated_at is stamped just before the write commits
+REBUILD_OVERLAP = timedelta(seconds=5)
+
+
+def _counts(doc):
+    if not doc:
+        return Counter()
+    return Counter(
+        (r.get("student_id"), r.get("status"))
+        for r in doc.get("records", [])
+        if r.get("status") in STATUSES
+    )
+
+
+async def apply_attendance_delta(class_id: str, before, after):
+    """Apply the change from session document `before` (None for a new
+    session) to `after` (None for a removed session) to the rollups."""
+    delta = _counts(after)
+    delta.subtract(_counts(before))
+
+    per_student = {}
+    per_class = Counter()
+    for (student_id, status), n in delta.items():
+        if n:
+            per_student.setdefault(student_id, Counter())[status] += n
+            per_class[status] += n
+    sessions = (after is not None) - (before is not None)
+
+    if per_student:
+        await db[STUDENT_ROLLUPS].bulk_write([
+            UpdateOne(
+                {"class_id": class_id, "student_id": student_id},
+                {"$inc": dict(counts)},
+                upsert=True,
+            )
+            for student_id, counts in per_student.items()
+        ], ordered=False)
+    if per_class or sessions:
+        await db[CLASS_ROLLUPS].update_one(
+            {"class_id": class_id},
+            {"$inc": {**per_class, "sessions": sessions}},
+            upsert=True,
+        )
+
+
+def _rate(counts):
+    total = sum(counts.get(s, 0) for s in STATUSES)
+    return round((counts.get("present", 0) + counts.get("late", 0)) / total, 4) if total else None
+
+
+def summarize(doc):
+    counts = {s: (doc or {}).get(s, 0) for s in STATUSES}
+    return {**counts, "attendance_rate": _rate(counts)}
+
+
+def _sources(class_ids=None):
+    match = [{"$match": {"class_id": {"$in": class_ids}}}] if class_ids is not None else []
+    return match + [{"$unionWith": {"coll": "attendance_archive", "pipeline": list(match)}}]
+
+
+_STATUS_SUMS = {s: {"$sum": {"$cond": [{"$eq": ["$records.status", s]}, 1, 0]}} for s in STATUSES}
+
+_PIPELINES = {
+    STUDENT_ROLLUPS: [
+        {"$unwind": "$records"},
+        {"$group": {"_id": {"class_id": "$class_id", "student_id": "$records.student_id"}, **_STATUS_SUMS}},
+        {"$replaceWith": {"$mergeObjects": ["$_id", {s: f"${s}" for s in STATUSES}]}},
+    ],
+    CLASS_ROLLUPS: [
+        {"$group": {
+            "_id": "$class_id",
+            "sessions": {"$sum": 1},
+            **{s: {"$sum": {"$size": {"$filter": {
+                "input": {"$ifNull": ["$records", []]},
+                "cond": {"$eq": ["$$this.status", s]},
+            }}}} for s in STATUSES},
+        }},
+        {"$set": {"class_id": "$_id"}},
+        {"$unset": "_id"},
+    ],
+}
+ROLLUP_KEYS = {CLASS_ROLLUPS: ["class_id"], STUDENT_ROLLUPS: ["class_id", "student_id"]}
+
+
+async def _compute(class_ids=None) -> dict:
+    """Recompute the rollups into fresh staging collections (indexed like
+    the real ones); returns {rollup collection: staging collection}."""
+    suffix = uuid.uuid4().hex[:8]
+    staging = {}
+    for target, pipeline in _PIPELINES.items():
+        name = staging[target] = f"{target}_rebuild_{suffix}"
+        # $out keeps the indexes of the collection it replaces
+        await db[name].create_index([(k, ASCENDING) for k in ROLLUP_KEYS[target]], unique=True)
+        await db.attendance.aggregate(_sources(class_ids) + pipeline + [{"$out": name}]).to_list(None)
+    return staging
+
+
+async def _swap_all(staging: dict):
+    for target, name in staging.items():
+        await db[name].rename(target, dropTarget=True)
+
+
+async def _swap_classes(staging: dict, class_ids: list):
+    """Replace the rollups of `class_ids` document by document, then drop the
+    ones with nothing left behind them."""
+    for target, name in staging.items():
+        keys = ROLLUP_KEYS[target]
+        await db[name].aggregate([
+            {"$unset": "_id"},
+            {"$merge": {"into": target, "on": keys, "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]).to_list(None)
+        rebuilt = {}
+        async for doc in db[name].find({}, {"_id": 0, **{k: 1 for k in keys}}):
+            rebuilt.setdefault(doc["class_id"], []).append(doc.get("student_id"))
+        for class_id in class_ids:
+            stale = {"class_id": class_id}
+            if target == STUDENT_ROLLUPS:
+                stale["student_id"] = {"$nin": rebuilt.get(class_id, [])}
+            elif class_id in rebuilt:
+                continue
+            await db[target].delete_many(stale)
+        await db[name].drop()
+
+
+async def _changed_classes(since: datetime) -> list:
+    query = {"updated_at": {"$gte": since - REBUILD_OVERLAP}}
+    live = await db.attendance.distinct("class_id", query)
+    archived = await db.attendance_archive.distinct("class_id", query)
+    return sorted(set(live) | set(archived))
+
+
+async def rebuild_attendance_rollups(class_id: str = None, job_id=None) -> dict:
+    """Recompute the rollups for one class (or all) from the raw data.
+
+    The result is built in staging collections and swapped in (renamed over
+    the live ones for a full rebuild, replaced per document for one class),
+    so readers never see empty rollups. Saves that land while the raw data is
+    read only reach the old rollups; the classes they touched are rebuilt
+    again until a pass finds none.
+    """
+    started = datetime.now(timezone.utc)
+    scope = {"class_id": class_id} if class_id else {}
+    if class_id:
+        await _swap_classes(await _compute([class_id]), [class_id])
+    else:
+        await _swap_all(await _compute())
+
+    since = started
+    for _ in range(REBUILD_CATCH_UP_PASSES):
+        pass_started = datetime.now(timezone.utc)
+        changed = [c for c in await _changed_classes(since) if not class_id or c == class_id]
+        if not changed:
+            break
+        await _swap_classes(await _compute(changed), changed)
+        since = pass_started
+
+    return {
+        "classes": await db[CLASS_ROLLUPS].count_documents(scope),
+        "students": await db[STUDENT_ROLLUPS].count_documents(scope),
+    }
+
+
+async def _main(argv):
+    import database
+
+    if not argv or argv[0] != "rebuild":
+        print("usage: python rollups.py rebuild [class_id]")
+        return 1
+    await database.ensure_indexes()
+    print(await rebuild_attendance_rollups(argv[1] if len(argv) > 1 else None))
+    database.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
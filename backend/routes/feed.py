@@ -0,0 +1,180 @@
+"""One timeline of announcements, assignments and notes across a user's classes.
+
+Every (class, kind) pair is its own stream, already sorted newest first by
+the (class_id, created_at desc, <id>) indexes (admins: (created_at desc,
+<id>)), so no stream needs an in-memory sort. The page is produced by a k-way heap
+merge over those cursors. A stream is only advanced when its head is taken,
+and its batches are sized for its share of the page, so a page reads
+roughly `limit + k` documents however many classes are involved.
+
+Order is (created_at desc, item_id asc); item ids are unique across kinds
+(ann_/asn_/note_), so the next-page cursor is simply the last pair.
+
+`feed_markers` keeps each user's read_at. The unread count is three
+bounded count queries over the same indexes.
+"""
+import asyncio
+import heapq
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from database import db
+from auth import get_current_user
+from loaders import Loaders, get_loaders
+from pagination import encode_cursor, decode_cursor
+
+router = APIRouter(prefix="/api/feed", tags=["Feed"])
+
+# collection -> (item kind, id field)
+FEED_KINDS = {
+    "announcements": ("announcement", "announcement_id"),
+    "assignments": ("assignment", "assignment_id"),
+    "notes": ("note", "note_id"),
+}
+MAX_PAGE = 100
+UNREAD_CAP = 99
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _naive(at: datetime) -> datetime:
+    return at.astimezone(timezone.utc).replace(tzinfo=None) if at.tzinfo else at
+
+
+def _sort_key(at: datetime, item_id: str):
+    # heapq is a min-heap: newest first means the smallest negated timestamp
+    return (-((_naive(at) - _EPOCH) // timedelta(microseconds=1)), item_id)
+
+
+async def _visible_class_ids(user: dict):
+    """Class ids the user follows, or None for an admin (everything)."""
+    if user.get("role") == "teacher":
+        taught = await db.classes.find({"teacher_id": user.get("user_id")}, {"_id": 0, "class_id": 1}).to_list(None)
+        return [c["class_id"] for c in taught]
+    if user.get("role") == "student":
+        return await db.enrollments.distinct("class_id", {"user_id": user.get("user_id")})
+    return None
+
+
+async def _head(cursor):
+    try:
+        return await cursor.next()
+    except StopAsyncIteration:
+        return None
+
+
+async def _merge(class_ids, after, limit):
+    """Yield up to `limit` feed items after the (created_at, item_id) `after` key."""
+    scopes = [None] if class_ids is None else class_ids
+    streams = []
+    batch = max(2, (limit + 1) // max(1, len(scopes) * len(FEED_KINDS)) + 1)
+    for collection, (kind, id_field) in FEED_KINDS.items():
+        for class_id in scopes:
+            query = {} if class_id is None else {"class_id": class_id}
+            if after:
+                at, last_id = after
+                # The range on created_at bounds the index scan; the $or only
+                # filters out the ties already served
+                query["created_at"] = {"$lte": at}
+                query["$or"] = [{"created_at": {"$lt": at}}, {id_field: {"$gt": last_id}}]
+            cursor = db[collection].find(query, {"_id": 0}).sort(
+                [("created_at", -1), (id_field, 1)]
+            ).limit(limit).batch_size(batch)
+            streams.append((kind, id_field, cursor))
+
+    heads = await asyncio.gather(*(_head(cursor) for _, _, cursor in streams))
+    heap = []
+    for index, doc in enumerate(heads):
+        if doc is not None:
+            _, id_field, _ = streams[index]
+            heap.append((_sort_key(doc["created_at"], doc[id_field]), index, doc))
+    heapq.heapify(heap)
+
+    taken = 0
+    while heap and taken < limit:
+        _, index, doc = heapq.heappop(heap)
+        kind, id_field, cursor = streams[index]
+        yield {"kind": kind, "item_id": doc[id_field], **doc}
+        taken += 1
+        if taken < limit:
+            nxt = await _head(cursor)
+            if nxt is not None:
+                heapq.heappush(heap, (_sort_key(nxt["created_at"], nxt[id_field]), index, nxt))
+    for _, _, cursor in streams:
+        await cursor.close()
+
+
+async def _read_at(user_id: str) -> Optional[datetime]:
+    marker = await db.feed_markers.find_one({"user_id": user_id}, {"_id": 0, "read_at": 1})
+    return marker["read_at"] if marker else None
+
+
+async def _unread_count(class_ids, read_at) -> int:
+    query = {"created_at": {"$gt": read_at}} if read_at else {}
+    if class_ids is not None:
+        query["class_id"] = {"$in": class_ids}
+    counts = await asyncio.gather(*(
+        db[collection].count_documents(query, limit=UNREAD_CAP + 1) for collection in FEED_KINDS
+    ))
+    return min(sum(counts), UNREAD_CAP + 1)
+
+
+@router.get("")
+async def get_feed(
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    user: dict = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
+):
+    """Newest-first announcements, assignments and notes from every class the
+    user teaches or is enrolled in. The first page also carries the unread
+    count (capped; `UNREAD_CAP + 1` means "more than UNREAD_CAP")."""
+    limit = max(1, min(limit, MAX_PAGE))
+    after = None
+    if cursor:
+        last_at, last_id = decode_cursor(cursor, 2)
+        try:
+            after = (datetime.fromisoformat(last_at), last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    class_ids = await _visible_class_ids(user)
+    if class_ids == []:
+        return {"items": [], "next_cursor": None, "unread": 0, "read_at": None}
+
+    items = [item async for item in _merge(class_ids, after, limit + 1)]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["created_at"].isoformat(), items[-1]["item_id"])
+
+    classes = await loaders.classes.load_many({i["class_id"] for i in items})
+    titles = {c["class_id"]: c.get("title") for c in classes if c}
+    for item in items:
+        item["class_title"] = titles.get(item["class_id"])
+
+    page = {"items": items, "next_cursor": next_cursor}
+    if not cursor:
+        read_at = await _read_at(user.get("user_id"))
+        page["read_at"] = read_at
+        page["unread"] = await _unread_count(class_ids, read_at)
+    return page
+
+
+class FeedRead(BaseModel):
+    # Mark everything up to this moment as read; defaults to now
+    read_at: Optional[datetime] = None
+
+
+@router.post("/read")
+async def mark_feed_read(data: FeedRead, user: dict = Depends(get_current_user)):
+    """Move the user's read marker forward (never backwards)."""
+    read_at = data.read_at or datetime.now(timezone.utc)
+    await db.feed_markers.update_one(
+        {"user_id": user.get("user_id")},
+        {"$max": {"read_at": read_at}},
+        upsert=True
+    )
+    return {"read_at": read_at}
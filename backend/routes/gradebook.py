@@ -0,0 +1,134 @@
+import csv
+import io
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from database import db
+from auth import get_current_user
+from loaders import Loaders, get_loaders
+
+router = APIRouter(prefix="/api/classes", tags=["Gradebook"])
+
+
+def _student_rows(class_id: str):
+    """Pipeline stages over `enrollments` producing one row per enrolled
+    student: name, current overall grade and {assignment_id: latest grade}."""
+    return [
+        {"$match": {"class_id": class_id}},
+        {"$lookup": {
+            "from": "users",
+            "let": {"uid": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$user_id", "$$uid"]}}},
+                {"$project": {"_id": 0, "name": 1}},
+            ],
+            "as": "user",
+        }},
+        {"$lookup": {
+            "from": "progress",
+            "let": {"uid": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$class_id", class_id]},
+                    {"$eq": ["$student_id", "$$uid"]},
+                ]}}},
+                {"$project": {"_id": 0, "grade": 1}},
+            ],
+            "as": "overall",
+        }},
+        {"$lookup": {
+            "from": "progress_history",
+            "let": {"uid": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$class_id", class_id]},
+                    {"$eq": ["$student_id", "$$uid"]},
+                ]}}},
+                {"$unwind": "$events"},
+                {"$match": {"events.assignment_id": {"$type": "string"}}},
+                {"$sort": {"events.at": 1}},
+                {"$group": {"_id": "$events.assignment_id", "grade": {"$last": "$events.grade"}}},
+                {"$project": {"_id": 0, "k": "$_id", "v": "$grade"}},
+            ],
+            "as": "cells",
+        }},
+        {"$project": {
+            "_id": 0,
+            "student_id": "$user_id",
+            "name": {"$arrayElemAt": ["$user.name", 0]},
+            "overall": {"$arrayElemAt": ["$overall.grade", 0]},
+            "cells": {"$arrayToObject": "$cells"},
+        }},
+        {"$sort": {"name": 1, "student_id": 1}},
+    ]
+
+
+async def _require_class_staff(class_id: str, user: dict, loaders: Loaders):
+    class_doc = await loaders.classes.load(class_id)
+    if not class_doc:
+        raise HTTPException(status_code=404, detail="Class not found")
+    if class_doc["teacher_id"] != user.get("user_id") and user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only the teacher or admin can view the gradebook")
+    return class_doc
+
+
+@router.get("/{class_id}/gradebook")
+async def get_gradebook(class_id: str, user=Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    """Students × assignments grid, built in a single aggregation."""
+    await _require_class_staff(class_id, user, loaders)
+    result = await db.classes.aggregate([
+        {"$match": {"class_id": class_id}},
+        {"$lookup": {
+            "from": "assignments",
+            "let": {"cid": "$class_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$class_id", "$$cid"]}}},
+                {"$sort": {"due_date": 1}},
+                {"$project": {"_id": 0, "assignment_id": 1, "title": 1, "due_date": 1}},
+            ],
+            "as": "assignments",
+        }},
+        {"$lookup": {
+            "from": "enrollments",
+            "pipeline": _student_rows(class_id),
+            "as": "students",
+        }},
+        {"$project": {"_id": 0, "class_id": 1, "title": 1, "assignments": 1, "students": 1}},
+    ]).to_list(1)
+    if not result:
+        raise HTTPException(status_code=404, detail="Class not found")
+    gradebook = result[0]
+    column_ids = [a["assignment_id"] for a in gradebook["assignments"]]
+    for student in gradebook["students"]:
+        cells = student.pop("cells", None) or {}
+        student["grades"] = [cells.get(a_id) for a_id in column_ids]
+    return gradebook
+
+
+@router.get("/{class_id}/gradebook.csv")
+async def export_gradebook_csv(class_id: str, user=Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    """The gradebook as CSV, streamed row by row from the aggregation cursor
+    so large classes are never materialised in memory."""
+    await _require_class_staff(class_id, user, loaders)
+    assignments = await db.assignments.find(
+        {"class_id": class_id}, {"_id": 0, "assignment_id": 1, "title": 1}
+    ).sort("due_date", 1).to_list(None)
+    column_ids = [a["assignment_id"] for a in assignments]
+
+    def line(values):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(values)
+        return buf.getvalue()
+
+    async def rows():
+        yield line(["student_id", "name", "overall"] + [a["title"] for a in assignments])
+        cursor = db.enrollments.aggregate(_student_rows(class_id), batchSize=500)
+        async for row in cursor:
+            cells = row.get("cells") or {}
+            yield line([row["student_id"], row.get("name"), row.get("overall")] + [cells.get(a_id) for a_id in column_ids])
+
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="gradebook_{class_id}.csv"'},
+    )
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException
+from database import db
+from auth import admin_required
+from jobs import create_job, run_job, spawn
+from cascade import sweep_orphans
+from archive import run_archive, ARCHIVE_AFTER_DAYS
+from rollups import rebuild_attendance_rollups
+from ledger import reconcile, take_snapshots
+from revenue import sweep_overdue, rebuild_revenue_rollups
+from rollover import check_tag, run_rollover
+
+router = APIRouter(prefix="/api/admin", tags=["Maintenance"])
+
+
+@router.post("/orphans/sweep")
+async def start_orphan_sweep(dry_run: bool = True, user=Depends(admin_required)):
+    """Start an orphan sweep in the background; poll the returned job for
+    progress. Defaults to a dry run that only counts."""
+    job_id = await create_job("orphan_sweep", {"dry_run": dry_run}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: sweep_orphans(dry_run=dry_run, job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.post("/archive")
+async def start_archive(older_than_days: int = ARCHIVE_AFTER_DAYS, user=Depends(admin_required)):
+    """Move attendance, announcements and notes past the cutoff (or from
+    classes that ended before it) into the archive collections."""
+    job_id = await create_job("archive", {"older_than_days": older_than_days}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: run_archive(job_id=jid, older_than_days=older_than_days)))
+    return {"job_id": job_id}
+
+
+@router.post("/rollups/attendance/rebuild")
+async def start_attendance_rollup_rebuild(class_id: str = None, user=Depends(admin_required)):
+    """Recompute attendance rollups for one class (or every class) from the raw sessions."""
+    job_id = await create_job("attendance_rollup_rebuild", {"class_id": class_id}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: rebuild_attendance_rollups(class_id, job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.post("/credits/snapshot")
+async def start_credit_snapshot(user=Depends(admin_required)):
+    job_id = await create_job("credit_snapshots", {}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: take_snapshots(job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.post("/credits/reconcile")
+async def start_credit_reconciliation(user=Depends(admin_required)):
+    """Background drift check; the job result lists the drifted students."""
+    job_id = await create_job("credit_reconcile", {}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: reconcile(job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.post("/invoices/overdue-sweep")
+async def start_overdue_sweep(user=Depends(admin_required)):
+    job_id = await create_job("overdue_invoices", {}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: sweep_overdue(job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.post("/rollups/revenue/rebuild")
+async def start_revenue_rollup_rebuild(user=Depends(admin_required)):
+    job_id = await create_job("revenue_rollup_rebuild", {}, user["user_id"])
+    spawn(run_job(job_id, lambda jid: rebuild_revenue_rollups(job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.post("/rollover")
+async def start_rollover(tag: str, shift_days: int = 0, ended_before: str = None, teacher_id: str = None,
+                         user=Depends(admin_required)):
+    """Clone classes (optionally only those that ended before `ended_before`,
+    or of one teacher) with their assignments and notes into a new term."""
+    tag = check_tag(tag)
+    params = {"tag": tag, "shift_days": shift_days, "ended_before": ended_before, "teacher_id": teacher_id}
+    job_id = await create_job("rollover", params, user["user_id"])
+    spawn(run_job(job_id, lambda jid: run_rollover(tag, shift_days, ended_before, teacher_id, job_id=jid)))
+    return {"job_id": job_id}
+
+
+@router.get("/jobs")
+async def list_jobs(kind: str = None, user=Depends(admin_required)):
+    query = {"kind": kind} if kind else {}
+    return await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).to_list(50)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user=Depends(admin_required)):
+    job = await db.jobs.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,174 @@
+import csv
+import hashlib
+import json
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from email_validator import validate_email, EmailNotValidError
+from fastapi import APIRouter, Depends, Request
+from pymongo.errors import BulkWriteError
+from database import db
+from auth import admin_required
+from passwords import hash_many
+
+router = APIRouter(prefix="/api/users", tags=["Roster"])
+
+IMPORT_CHUNK = 1000
+IMPORT_ROLES = {"student", "teacher"}
+MAX_REPORTED_ERRORS = 1000
+# Redeemed with POST /api/auth/accept-invite
+INVITE_TTL_DAYS = int(os.getenv("INVITE_TTL_DAYS", "14"))
+
+
+async def _lines(request: Request):
+    """Yield decoded lines from the streamed request body."""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+async def _rows(request: Request, fmt: str):
+    """Yield (row_number, dict) from a CSV (with header) or NDJSON body."""
+    header = None
+    number = 0
+    async for line in _lines(request):
+        if not line.strip():
+            continue
+        if fmt == "csv" and header is None:
+            header = [h.strip().lower() for h in next(csv.reader([line]))]
+            continue
+        number += 1
+        if fmt == "csv":
+            yield number, dict(zip(header, next(csv.reader([line]))))
+        else:
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+
+
+class _Report:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+        self.invites = []
+
+    def error(self, row, email, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "email": email, "error": message})
+
+
+async def _import_chunk(chunk, seen, report, created_by):
+    valid = []
+    for number, row in chunk:
+        if not isinstance(row, dict):
+            report.error(number, None, "Malformed row")
+            continue
+        raw_email = (row.get("email") or "").strip()
+        try:
+            email = validate_email(raw_email, check_deliverability=False).normalized
+        except EmailNotValidError as exc:
+            report.error(number, raw_email, str(exc))
+            continue
+        role = (row.get("role") or "student").strip().lower()
+        if role not in IMPORT_ROLES:
+            report.error(number, email, f"Invalid role {role!r}")
+            continue
+        if email in seen:
+            report.error(number, email, "Duplicate email in import")
+            continue
+        seen.add(email)
+        valid.append((number, email, (row.get("name") or "").strip() or email.split("@")[0], role, row.get("password") or None))
+
+    # One query for every email in the chunk that is already registered
+    existing = {
+        u["email"] for u in await db.users.find(
+            {"email": {"$in": [v[1] for v in valid]}}, {"_id": 0, "email": 1}
+        ).to_list(len(valid))
+    }
+    for number, email, *_ in valid:
+        if email in existing:
+            report.error(number, email, "Email already registered")
+    valid = [v for v in valid if v[1] not in existing]
+
+    hashed = iter(await hash_many([v[4] for v in valid if v[4]]))
+    now = datetime.now(timezone.utc)
+    docs = []
+    for number, email, name, role, password in valid:
+        doc = {
+            "user_id": f"user_{uuid.uuid4().hex[:12]}",
+            "email": email,
+            "name": name,
+            "role": role,
+            "created_at": now,
+            "imported_by": created_by,
+        }
+        if password:
+            doc["password"] = next(hashed)
+        else:
+            token = secrets.token_urlsafe(24)
+            doc["password"] = None
+            doc["invite_token_hash"] = hashlib.sha256(token.encode()).hexdigest()
+            doc["invite_expires_at"] = now + timedelta(days=INVITE_TTL_DAYS)
+            report.invites.append({"email": email, "invite_token": token})
+        docs.append((number, doc))
+    if not docs:
+        return
+
+    try:
+        await db.users.insert_many([d for _, d in docs], ordered=False)
+        report.created += len(docs)
+    except BulkWriteError as exc:
+        failed = {err["index"]: err for err in exc.details.get("writeErrors", [])}
+        report.created += len(docs) - len(failed)
+        for index, err in failed.items():
+            number, doc = docs[index]
+            message = "Email already registered" if err.get("code") == 11000 else err.get("errmsg")
+            report.error(number, doc["email"], message)
+
+
+@router.post("/import")
+async def import_roster(request: Request, format: str = None, user=Depends(admin_required)):
+    """Bulk-create users from a CSV (email,name,role,password) or NDJSON body.
+
+    The body is streamed and processed in chunks: one `$in` query per chunk
+    for existing emails, passwords hashed across a process pool (rows
+    without one get an invite token instead, which the user redeems with
+    POST /api/auth/accept-invite), and unordered insert_many.
+    """
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("ndjson" if "json" in content_type else "csv")
+    started = time.perf_counter()
+    report = _Report()
+    seen = set()
+    chunk = []
+    async for number, row in _rows(request, fmt):
+        report.rows += 1
+        chunk.append((number, row))
+        if len(chunk) >= IMPORT_CHUNK:
+            await _import_chunk(chunk, seen, report, user["user_id"])
+            chunk = []
+    if chunk:
+        await _import_chunk(chunk, seen, report, user["user_id"])
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": report.rows,
+        "created": report.created,
+        "failed": report.error_count,
+        "errors": report.errors,
+        "invites": report.invites,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(report.rows / seconds, 1) if seconds else None,
+    }
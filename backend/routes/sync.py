@@ -0,0 +1,123 @@
+"""Delta sync so the dashboards can keep a local cache.
+
+The first call (no `since`) returns everything the caller may see plus a
+token. Later calls pass the token back and get only the documents whose
+`updated_at` moved past it, and the tombstones of what was deleted. Each
+collection is read through its (scope, updated_at) index, where the scope
+is the caller's classes, or for invoices the student. Admins see everything.
+
+`reset: true` means the delta could not be served: too many changes, or a
+token older than the tombstone retention. The client should then drop its
+cache, refetch the usual list endpoints and keep the returned token.
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+from database import db, TOMBSTONE_TTL_DAYS
+from auth import get_current_user
+from loaders import Loaders, get_loaders
+from pagination import encode_cursor, decode_cursor
+
+router = APIRouter(prefix="/api", tags=["Sync"])
+
+# collection -> the field that decides who may see a document
+SYNCED = {
+    "classes": "class_id",
+    "videos": "class_id",
+    "announcements": "class_id",
+    "assignments": "class_id",
+    "notes": "class_id",
+    "invoices": "student_id",
+}
+SYNC_LIMIT = 2000
+# The next token starts this far before the request did, so a write stamped
+# just before this sync but committed just after it is still picked up.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def _decode_token(token: str) -> datetime:
+    (since,) = decode_cursor(token, 1)
+    try:
+        return datetime.fromisoformat(since)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+async def _class_scope(user: dict, since):
+    """(visible class ids or None for all, ids newly visible since `since`)."""
+    if user.get("role") == "teacher":
+        taught = await db.classes.find({"teacher_id": user.get("user_id")}, {"_id": 0, "class_id": 1}).to_list(None)
+        return [c["class_id"] for c in taught], []
+    if user.get("role") == "student":
+        enrollments = await db.enrollments.find(
+            {"user_id": user.get("user_id")}, {"_id": 0, "class_id": 1, "enrolled_at": 1}
+        ).to_list(None)
+        fresh = [
+            e["class_id"] for e in enrollments
+            if since and e.get("enrolled_at") and e["enrolled_at"].replace(tzinfo=timezone.utc) > since
+        ]
+        return [e["class_id"] for e in enrollments], fresh
+    return None, []
+
+
+def _query(scope_field: str, user: dict, class_ids, fresh_ids, since):
+    if scope_field == "student_id":
+        if user.get("role") == "admin":
+            base = {}
+        elif user.get("role") == "student":
+            base = {"student_id": user.get("user_id")}
+        else:
+            return None
+    else:
+        base = {} if class_ids is None else {"class_id": {"$in": class_ids}}
+    if since is None:
+        return base
+    changed = {**base, "updated_at": {"$gt": since}}
+    if fresh_ids and scope_field == "class_id":
+        # Content of a class the student just joined is new to them however old it is
+        return {"$or": [changed, {"class_id": {"$in": fresh_ids}}]}
+    return changed
+
+
+@router.get("/sync")
+async def sync(since: str = None, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    started = datetime.now(timezone.utc)
+    token = encode_cursor((started - SYNC_OVERLAP).isoformat())
+    since_at = _decode_token(since) if since else None
+    if since_at and since_at.tzinfo is None:
+        since_at = since_at.replace(tzinfo=timezone.utc)
+    if since_at and started - since_at > timedelta(days=TOMBSTONE_TTL_DAYS):
+        return {"token": token, "reset": True, "changes": {}, "deleted": []}
+
+    class_ids, fresh_ids = await _class_scope(user, since_at)
+
+    async def fetch(collection, scope_field):
+        query = _query(scope_field, user, class_ids, fresh_ids, since_at)
+        if query is None:
+            return []
+        return await db[collection].find(query, {"_id": 0}).limit(SYNC_LIMIT + 1).to_list(SYNC_LIMIT + 1)
+
+    results = await asyncio.gather(*(fetch(c, field) for c, field in SYNCED.items()))
+    changes = dict(zip(SYNCED, results))
+    if any(len(docs) > SYNC_LIMIT for docs in results):
+        return {"token": token, "reset": True, "changes": {}, "deleted": []}
+
+    # Same enrichment as GET /classes: the teacher's current meet_link
+    teachers = await loaders.users.load_many({c.get("teacher_id") for c in changes["classes"]})
+    meet_links = {t["user_id"]: t.get("meet_link") for t in teachers if t}
+    for cls in changes["classes"]:
+        cls["meet_link"] = meet_links.get(cls.get("teacher_id"))
+
+    deleted = []
+    if since_at:
+        query = {"deleted_at": {"$gt": since_at}}
+        if user.get("role") != "admin":
+            query["$or"] = [{"class_id": {"$in": class_ids}}, {"user_ids": user.get("user_id")}]
+        deleted = await db.tombstones.find(
+            query, {"_id": 0, "collection": 1, "doc_id": 1, "class_id": 1, "deleted_at": 1}
+        ).limit(SYNC_LIMIT + 1).to_list(SYNC_LIMIT + 1)
+        if len(deleted) > SYNC_LIMIT:
+            return {"token": token, "reset": True, "changes": {}, "deleted": []}
+
+    return {"token": token, "reset": False, "changes": changes, "deleted": deleted}
@@ -0,0 +1,75 @@
+"""Fast path for returning documents straight from our own collections.
+
+`[Model(**doc) for doc in docs]` validates every field of every row, and
+FastAPI then validates the list again against `response_model` before
+encoding it. For documents our own write handlers produced, both passes are
+pure overhead that grows with the list. Here the query projects exactly the
+model's fields; each row is shaped to the schema (missing fields get the
+model default) and the list is encoded in one pydantic_core call. The
+route keeps `response_model` so the OpenAPI schema is unchanged.
+
+Only use this for trusted rows. Anything built from user input still goes
+through the models.
+
+`fields=a,b,c` (sparse fieldsets) is handled the same way. The list is
+checked against the resource's allow-list and becomes the projection, so
+the other fields are neither read nor sent. When the query and the
+requested fields all sit in one index, Mongo answers from the index alone.
+"""
+from typing import Iterable, List, Optional, Type
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined, to_json
+
+
+def projection(model: Type[BaseModel]) -> dict:
+    """Mongo projection returning exactly the model's fields."""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+def _defaults(model: Type[BaseModel]) -> dict:
+    return {
+        name: None if field.default is PydanticUndefined else field.default
+        for name, field in model.model_fields.items()
+    }
+
+
+def shape(docs: Iterable[dict], model: Type[BaseModel], only: Optional[List[str]] = None) -> list:
+    """Rows with exactly the model's keys (or just `only`), without validating any values."""
+    defaults = _defaults(model)
+    if only is not None:
+        defaults = {name: defaults[name] for name in only}
+    return [{name: doc.get(name, default) for name, default in defaults.items()} for doc in docs]
+
+
+def trusted_json(docs: Iterable[dict], model: Type[BaseModel], only: Optional[List[str]] = None) -> Response:
+    return Response(content=to_json(shape(docs, model, only)), media_type="application/json")
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str], always: Iterable[str] = ()) -> Optional[List[str]]:
+    """The requested `fields=` list (plus `always`, e.g. the id), or None when
+    the parameter was not given. Unknown names are a 400."""
+    if fields is None:
+        return None
+    allowed = set(allowed)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(allowed))}"
+        )
+    return list(dict.fromkeys([*always, *requested]))
+
+
+def sparse_projection(selected: Optional[List[str]], default: dict) -> dict:
+    """Projection for the parse_fields() result, or `default` when no fields were asked for."""
+    if selected is None:
+        return default
+    return {"_id": 0, **{name: 1 for name in selected}}
+
+
+def trusted_json_one(doc: dict, model: Type[BaseModel], only: Optional[List[str]] = None) -> Response:
+    """trusted_json for a single (e.g. cached) document."""
+    return Response(content=to_json(shape([doc], model, only)[0]), media_type="application/json")
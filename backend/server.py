@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status, Cookie, Response, UploadFile, File, Form, Header
+from fastapi import FastAPI, APIRouter, HTTPException, status, Cookie, Response, UploadFile, File, Form, Header, Request
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -8,17 +8,45 @@ from fastapi import Depends
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 from fastapi import Response
-from  database import client
+from contextlib import asynccontextmanager
+import database
 from  database import db
 from  google_oauth import router as google_router
 import uuid
-from  routes import schedule
+from  routes import schedule, maintenance, gradebook, roster, sync, feed
+from  loaders import Loaders, get_loaders
+from  singleflight import reads
+from  cache import content_cache
+import jobs
+from  passwords import shutdown_pool
+from  cascade import cascade_delete_class, sweep_orphans, ORPHAN_SWEEP_INTERVAL
+from  archive import find_with_archive, run_archive, ARCHIVE_INTERVAL
+from  rollups import apply_attendance_delta, summarize, CLASS_ROLLUPS, STUDENT_ROLLUPS
+from pymongo import ReturnDocument, InsertOne
+from pymongo.errors import BulkWriteError
+import hashlib
+from  pagination import encode_cursor, decode_cursor
+from  progress_history import record_progress_event, get_progress_history
+from  idempotency import IdempotencyMiddleware
+from  loadshed import LoadShedMiddleware
+from  watch_progress import buffer as watch_buffer, video_class_id, is_enrolled, start_flushing, stop_flushing, completion_summary
+from  rollover import check_tag, clone_classes, clone_id
+from  serialization import projection, trusted_json, trusted_json_one, parse_fields, sparse_projection
+from  tombstones import record_tombstone
+from  revenue import on_created, on_paid, on_deleted, sweep_overdue, rebuild_revenue_rollups, rollup_month, present, OVERDUE_SWEEP_INTERVAL
+from  ledger import post_adjustment, post_bulk, balance_at, iter_drift, take_snapshots, SNAPSHOT_INTERVAL
+from fastapi.responses import StreamingResponse
+import json
+import metrics
+import ratelimit
 from  auth import (
     verify_password,
+    verify_and_rehash,
     hash_password,
     create_access_token,
+    current_user_id,
     get_current_user,
     admin_required
 )
@@ -26,13 +54,45 @@ from datetime import datetime, timezone, timedelta
 
 
 
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
-
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker startup and shutdown.
+
+    Runs before the worker accepts traffic: build the Motor client, make sure
+    the indexes exist and open the pool so the first real request does not
+    pay for connection setup. On shutdown (after gunicorn has drained the
+    worker) the client is closed.
+    """
+    mongo = database.connect()
+    await mongo.admin.command("ping")
+    await database.ensure_indexes()
+    jobs.start_periodic("orphan_sweep", ORPHAN_SWEEP_INTERVAL, sweep_orphans)
+    jobs.start_periodic("archive", ARCHIVE_INTERVAL, run_archive)
+    jobs.start_periodic("credit_snapshots", SNAPSHOT_INTERVAL, take_snapshots)
+    jobs.start_periodic("overdue_invoices", OVERDUE_SWEEP_INTERVAL, sweep_overdue)
+    # Invoices issued before the revenue rollups existed have no contribution yet
+    jobs.start_once("revenue_rollups_seed", rebuild_revenue_rollups)
+    start_flushing()
+    logger.info("Worker %s ready", os.getpid())
+    try:
+        yield
+    finally:
+        # Last flush of buffered watch progress first, while jobs still run
+        await stop_flushing()
+        await jobs.shutdown()
+        shutdown_pool()
+        await content_cache.backend.close()
+        database.close()
+
+
+app = FastAPI(lifespan=lifespan)
+api_router = APIRouter(prefix="/api")
+
+
 
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -119,8 +179,21 @@ class TokenResponse(BaseModel):
 async def root():
     return {"message": "ClassHub API", "status": "running"}
 
+@api_router.get("/metrics")
+async def get_metrics(current_user: dict = Depends(admin_required)):
+    """Per-worker performance counters (single-flight coalescing, ...)."""
+    return metrics.snapshot()
+
+def _client_ip(request: Request) -> str:
+    # uvicorn already resolved X-Forwarded-For, trusting only the proxies in
+    # forwarded_allow_ips (gunicorn.conf.py)
+    return request.client.host if request.client else "unknown"
+
 @api_router.post("/auth/register", response_model=User)
-async def register_user(user_data: RegisterRequest):
+async def register_user(user_data: RegisterRequest, request: Request):
+    # Throttled before any lookup or argon2 work
+    await ratelimit.register_ip.hit(_client_ip(request))
+    await ratelimit.register_account.hit(user_data.email.lower())
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -136,6 +209,7 @@ async def register_user(user_data: RegisterRequest):
         "role": "student",
         "created_at": datetime.now(timezone.utc)
     }
+    new_user["updated_at"] = new_user["created_at"]
 
     await db.users.insert_one(new_user)
 
@@ -149,17 +223,46 @@ from fastapi import Response
 
 @api_router.post("/auth/login")
 async def login_user(
+    request: Request,
     response: Response,
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
+    # Throttled per IP, per account+IP and per account before any lookup or
+    # argon2 verify (see ratelimit.py). The tight bucket is per account *and*
+    # IP, so guessing someone's password from one address cannot lock them
+    # out everywhere else; the looser account-wide one caps guessing spread
+    # over many addresses.
+    ip = _client_ip(request)
+    email = form_data.username.strip().lower()
+    account = f"{email}|{ip}"
+    await ratelimit.login_ip.hit(ip)
+    await ratelimit.login_account.hit(account)
+    await ratelimit.login_email.hit(email)
+
     user = await db.users.find_one({"email": form_data.username})
 
     if not user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
-    if not verify_password(form_data.password, user["password"]):
+    # Imported users without a password have not accepted their invite yet
+    if not user.get("password"):
+        raise HTTPException(status_code=400, detail="Invalid credentials")
+    ok, new_hash = verify_and_rehash(form_data.password, user["password"])
+    if not ok:
         raise HTTPException(status_code=400, detail="Invalid credentials")
+    if new_hash:
+        await db.users.update_one(
+            {"user_id": user["user_id"], "password": user["password"]}, {"$set": {"password": new_hash}}
+        )
+
+    # A successful login forgives the account's earlier typos
+    await ratelimit.login_account.reset(account)
+    await ratelimit.login_email.reset(email)
+    return _start_session(response, user)
+
 
+def _start_session(response: Response, user: dict):
+    """Set the auth cookie and build the login response for `user`."""
     access_token = create_access_token({"sub": user["user_id"]})
 
     is_production = os.getenv("ENVIRONMENT", "development") == "production"
@@ -178,6 +281,35 @@ async def login_user(
     }
 
 
+class AcceptInviteRequest(BaseModel):
+    token: str
+    password: str
+
+@api_router.post("/auth/accept-invite")
+async def accept_invite(data: AcceptInviteRequest, request: Request, response: Response):
+    """Redeem an invite token from a roster import: set the password and log in."""
+    await ratelimit.login_ip.hit(_client_ip(request))
+    token_hash = hashlib.sha256(data.token.encode()).hexdigest()
+    invited = {"invite_token_hash": token_hash, "invite_expires_at": {"$gt": datetime.now(timezone.utc)}}
+    if not await db.users.find_one(invited, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Invalid or expired invite")
+
+    now = datetime.now(timezone.utc)
+    # Conditional on the token, so an invite can only be redeemed once
+    user = await db.users.find_one_and_update(
+        invited,
+        {
+            "$set": {"password": hash_password(data.password), "updated_at": now},
+            "$unset": {"invite_token_hash": "", "invite_expires_at": ""},
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not user:
+        raise HTTPException(status_code=400, detail="Invalid or expired invite")
+    return _start_session(response, user)
+
+
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Return the currently authenticated user (used by AuthContext on every page load)."""
@@ -218,6 +350,7 @@ async def create_class(class_data: ClassCreate, user: dict = Depends(get_current
         "meet_link": user.get("meet_link"),
         "created_at": datetime.now(timezone.utc)
     }
+    new_class["updated_at"] = new_class["created_at"]
     
     await db.classes.insert_one(new_class)
     
@@ -225,43 +358,68 @@ async def create_class(class_data: ClassCreate, user: dict = Depends(get_current
     return ClassResponse(**class_doc)
 
 @api_router.get("/classes", response_model=List[ClassResponse])
-async def get_classes(user: dict = Depends(get_current_user)):
+async def get_classes(fields: Optional[str] = None, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    selected = parse_fields(fields, ClassResponse.model_fields, always=["class_id"])
+    with_meet_link = selected is None or "meet_link" in selected
+    read = selected if not with_meet_link or selected is None else [*selected, "teacher_id"]
+    class_projection = sparse_projection(read, projection(ClassResponse))
     if user.get("role") == "teacher":
-        classes = await db.classes.find({"teacher_id": user.get("user_id")}, {"_id": 0}).to_list(1000)
+        classes = await db.classes.find({"teacher_id": user.get("user_id")}, class_projection).to_list(1000)
     elif user.get("role") == "student":
         enrollments = await db.enrollments.find({"user_id": user.get("user_id")}, {"_id": 0}).to_list(1000)
         class_ids = [e["class_id"] for e in enrollments]
-        classes = await db.classes.find({"class_id": {"$in": class_ids}}, {"_id": 0}).to_list(1000)
+        classes = await db.classes.find({"class_id": {"$in": class_ids}}, class_projection).to_list(1000)
     else:
-        classes = await db.classes.find({}, {"_id": 0}).to_list(1000)
+        classes = await db.classes.find({}, class_projection).to_list(1000)
 
     # Enrich each class with the teacher's *current* meet_link
-    teacher_cache = {}
-    for cls in classes:
-        tid = cls.get("teacher_id")
-        if tid not in teacher_cache:
-            teacher_cache[tid] = await db.users.find_one({"user_id": tid}, {"_id": 0})
-        teacher = teacher_cache.get(tid) or {}
-        cls["meet_link"] = teacher.get("meet_link")
-    return [ClassResponse(**c) for c in classes]
+    if with_meet_link:
+        teachers = await loaders.users.load_many({c.get("teacher_id") for c in classes})
+        meet_links = {t["user_id"]: t.get("meet_link") for t in teachers if t}
+        for cls in classes:
+            cls["meet_link"] = meet_links.get(cls.get("teacher_id"))
+    return trusted_json(classes, ClassResponse, selected)
 
 @api_router.get("/classes/{class_id}", response_model=ClassResponse)
-async def get_class(class_id: str, user: dict = Depends(get_current_user)):
-    class_doc = await db.classes.find_one({"class_id": class_id}, {"_id": 0})
+async def get_class(class_id: str, fields: Optional[str] = None, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    selected = parse_fields(fields, ClassResponse.model_fields, always=["class_id"])
+    class_doc = await content_cache.get_or_load(class_id, "class", lambda: loaders.classes.load(class_id))
     if not class_doc:
         raise HTTPException(status_code=404, detail="Class not found")
 
     # Always show teacher's current meet_link
-    teacher = await db.users.find_one({"user_id": class_doc.get("teacher_id")}, {"_id": 0}) or {}
+    teacher = await loaders.users.load(class_doc.get("teacher_id")) or {}
     class_doc["meet_link"] = teacher.get("meet_link")
 
+    if selected is not None:
+        return trusted_json_one(class_doc, ClassResponse, selected)
     return ClassResponse(**class_doc)
 
+class ClassClone(BaseModel):
+    tag: Optional[str] = None     # term label, e.g. "2025t1"; random when omitted
+    shift_days: int = 0           # added to start/end times, due dates and note dates
+    title: Optional[str] = None
+
+@api_router.post("/classes/{class_id}/clone")
+async def clone_class(class_id: str, data: ClassClone, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    """Copy a class with its assignments and notes into a new term, entirely
+    inside Mongo (see rollover.py). The same tag always yields the same new
+    class, so repeating the call does not create duplicates."""
+    class_doc = await loaders.classes.load(class_id)
+    if not class_doc:
+        raise HTTPException(status_code=404, detail="Class not found")
+    if class_doc["teacher_id"] != user.get("user_id") and user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only the teacher or admin can clone this class")
+    tag = check_tag(data.tag or uuid.uuid4().hex[:6])
+    overrides = {"title": {"$literal": data.title}} if data.title else None
+    result = await clone_classes([class_id], tag, data.shift_days, overrides)
+    return {"class_id": clone_id(class_id, "class_", tag), **result}
+
 @api_router.post("/classes/{class_id}/meet")
-async def create_meet_link(class_id: str, user: dict = Depends(get_current_user)):
+async def create_meet_link(class_id: str, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
    
     
-    class_doc = await db.classes.find_one({"class_id": class_id}, {"_id": 0})
+    class_doc = await loaders.classes.load(class_id)
     if not class_doc:
         raise HTTPException(status_code=404, detail="Class not found")
     
@@ -273,18 +431,20 @@ async def create_meet_link(class_id: str, user: dict = Depends(get_current_user)
     
     await db.classes.update_one(
         {"class_id": class_id},
-        {"$set": {"meet_link": meet_link}}
+        {"$set": {"meet_link": meet_link, "updated_at": datetime.now(timezone.utc)}}
     )
+    loaders.classes.clear(class_id)
+    await content_cache.invalidate(class_id)
     
     return {"meet_link": meet_link}
 
 @api_router.post("/enrollments")
-async def enroll_in_class(enrollment: EnrollmentCreate, user: dict = Depends(get_current_user)):
+async def enroll_in_class(enrollment: EnrollmentCreate, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
 
     if user.get("role") != "student":
         raise HTTPException(status_code=403, detail="Only students can enroll")
     
-    class_doc = await db.classes.find_one({"class_id": enrollment.class_id}, {"_id": 0})
+    class_doc = await loaders.classes.load(enrollment.class_id)
     if not class_doc:
         raise HTTPException(status_code=404, detail="Class not found")
     
@@ -296,17 +456,21 @@ async def enroll_in_class(enrollment: EnrollmentCreate, user: dict = Depends(get
         raise HTTPException(status_code=400, detail="Class is full")
     
     enrollment_id = f"enroll_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
     await db.enrollments.insert_one({
         "enrollment_id": enrollment_id,
         "user_id": user.get("user_id"),
         "class_id": enrollment.class_id,
-        "enrolled_at": datetime.now(timezone.utc)
+        "enrolled_at": now,
+        "updated_at": now,
     })
     
     await db.classes.update_one(
         {"class_id": enrollment.class_id},
-        {"$inc": {"enrolled_count": 1}}
+        {"$inc": {"enrolled_count": 1}, "$set": {"updated_at": now}}
     )
+    loaders.classes.clear(enrollment.class_id)
+    await content_cache.invalidate(enrollment.class_id)
     
     return {"message": "Enrolled successfully"}
 
@@ -316,6 +480,105 @@ async def get_enrollments(user: dict = Depends(get_current_user)):
     enrollments = await db.enrollments.find({"user_id": user.get("user_id")}, {"_id": 0}).to_list(1000)
     return enrollments
 
+class BulkEnrollment(BaseModel):
+    student_ids: List[str] = Field(..., min_length=1)
+
+async def _require_class_owner(class_id: str, user: dict, loaders: Loaders):
+    class_doc = await loaders.classes.load(class_id)
+    if not class_doc:
+        raise HTTPException(status_code=404, detail="Class not found")
+    if class_doc["teacher_id"] != user.get("user_id") and user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only the teacher or admin can manage enrollments")
+    return class_doc
+
+@api_router.post("/classes/{class_id}/enrollments/bulk")
+async def bulk_enroll(class_id: str, data: BulkEnrollment, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    """Enroll many students at once (teacher of the class or admin).
+
+    Seats for the whole batch are reserved with one conditional $inc, so the
+    class can never go over max_students; any seats not used (a concurrent
+    enrollment won the race) are handed back afterwards.
+    """
+    await _require_class_owner(class_id, user, loaders)
+    requested = list(dict.fromkeys(data.student_ids))
+
+    students = await db.users.find(
+        {"user_id": {"$in": requested}, "role": "student"}, {"_id": 0, "user_id": 1}
+    ).to_list(len(requested))
+    student_ids = {s["user_id"] for s in students}
+    already = {
+        e["user_id"] for e in await db.enrollments.find(
+            {"class_id": class_id, "user_id": {"$in": list(student_ids)}}, {"_id": 0, "user_id": 1}
+        ).to_list(len(student_ids))
+    }
+    to_add = [sid for sid in requested if sid in student_ids and sid not in already]
+    not_students = [sid for sid in requested if sid not in student_ids]
+
+    if to_add:
+        reserved = await db.classes.find_one_and_update(
+            {"class_id": class_id, "$expr": {"$lte": [{"$add": ["$enrolled_count", len(to_add)]}, "$max_students"]}},
+            {"$inc": {"enrolled_count": len(to_add)}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+        if reserved is None:
+            current = await db.classes.find_one({"class_id": class_id}, {"_id": 0, "enrolled_count": 1, "max_students": 1}) or {}
+            seats = max(0, current.get("max_students", 0) - current.get("enrolled_count", 0))
+            raise HTTPException(status_code=400, detail=f"Class is full: {seats} seats left for {len(to_add)} students")
+
+        now = datetime.now(timezone.utc)
+        docs = [{
+            "enrollment_id": f"enroll_{uuid.uuid4().hex[:12]}",
+            "user_id": sid,
+            "class_id": class_id,
+            "enrolled_at": now,
+            "updated_at": now,
+        } for sid in to_add]
+        inserted = len(to_add)
+        try:
+            try:
+                await db.enrollments.bulk_write([InsertOne(d) for d in docs], ordered=False)
+            except BulkWriteError as exc:
+                inserted -= len(exc.details.get("writeErrors", []))
+            except Exception:
+                # Outcome unknown (network error, timeout): count what landed
+                inserted = await db.enrollments.count_documents(
+                    {"enrollment_id": {"$in": [d["enrollment_id"] for d in docs]}}
+                )
+                raise
+        finally:
+            # Hand back the seats that were reserved but not used
+            if inserted < len(to_add):
+                await db.classes.update_one(
+                    {"class_id": class_id},
+                    {"$inc": {"enrolled_count": inserted - len(to_add)}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+                )
+        loaders.classes.clear(class_id)
+        await content_cache.invalidate(class_id)
+    else:
+        inserted = 0
+
+    return {
+        "enrolled": inserted,
+        "already_enrolled": sorted(already),
+        "not_students": not_students,
+    }
+
+@api_router.delete("/classes/{class_id}/enrollments/bulk")
+async def bulk_unenroll(class_id: str, data: BulkEnrollment, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    """Remove many students from a class; enrolled_count drops by exactly the
+    number of enrollments deleted."""
+    await _require_class_owner(class_id, user, loaders)
+    result = await db.enrollments.delete_many({"class_id": class_id, "user_id": {"$in": data.student_ids}})
+    if result.deleted_count:
+        await db.classes.update_one(
+            {"class_id": class_id},
+            {"$inc": {"enrolled_count": -result.deleted_count}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+        loaders.classes.clear(class_id)
+        await content_cache.invalidate(class_id)
+        # The removed students' clients drop the class on their next sync
+        await record_tombstone("classes", class_id, user_ids=data.student_ids)
+    return {"unenrolled": result.deleted_count}
+
 @api_router.post("/videos", response_model=VideoResponse)
 async def create_video(video_data: VideoCreate, user: dict = Depends(get_current_user)):
     
@@ -333,6 +596,7 @@ async def create_video(video_data: VideoCreate, user: dict = Depends(get_current
         "uploaded_by": user.get("user_id"),
         "created_at": datetime.now(timezone.utc)
     }
+    new_video["updated_at"] = new_video["created_at"]
     
     await db.videos.insert_one(new_video)
     
@@ -340,17 +604,63 @@ async def create_video(video_data: VideoCreate, user: dict = Depends(get_current
     return VideoResponse(**video_doc)
 
 @api_router.get("/videos", response_model=List[VideoResponse])
-async def get_videos(class_id: Optional[str] = None, user: dict = Depends(get_current_user)):
+async def get_videos(class_id: Optional[str] = None, fields: Optional[str] = None, user: dict = Depends(get_current_user)):
     
+    selected = parse_fields(fields, VideoResponse.model_fields, always=["video_id"])
     query = {"class_id": class_id} if class_id else {}
-    videos = await db.videos.find(query, {"_id": 0}).to_list(1000)
+    videos = await reads.do(
+        ("videos", class_id, tuple(selected or ())),
+        lambda: db.videos.find(query, sparse_projection(selected, projection(VideoResponse))).to_list(1000)
+    )
     
-    return [VideoResponse(**v) for v in videos]
+    return trusted_json(videos, VideoResponse, selected)
+
+class VideoHeartbeat(BaseModel):
+    position: float = Field(..., ge=0)   # seconds
+    duration: float = Field(..., gt=0)   # seconds
+
+@api_router.post("/videos/{video_id}/progress")
+async def record_video_progress(video_id: str, data: VideoHeartbeat, user_id: str = Depends(current_user_id)):
+    """Player heartbeat. Only the auth token is checked (no user lookup) and
+    the position goes to the in-memory buffer, so once the video's class and
+    the caller's enrollment are known a heartbeat does no database work at all."""
+    class_id = await video_class_id(video_id)
+    if not class_id:
+        raise HTTPException(status_code=404, detail="Video not found")
+    if not await is_enrolled(user_id, class_id):
+        raise HTTPException(status_code=403, detail="Not enrolled in this class")
+    watch_buffer.add(user_id, video_id, class_id, min(data.position, data.duration), data.duration)
+    return {"message": "Progress recorded"}
+
+@api_router.get("/videos/{video_id}/progress")
+async def get_video_progress(video_id: str, user_id: str = Depends(current_user_id)):
+    """Where the caller left off, including heartbeats not flushed yet."""
+    doc = await db.video_progress.find_one({"student_id": user_id, "video_id": video_id}, {"_id": 0}) or {
+        "student_id": user_id, "video_id": video_id, "position": 0, "max_position": 0,
+    }
+    pending = watch_buffer.pending(user_id, video_id)
+    if pending:
+        doc.update(position=pending["position"], duration=pending["duration"])
+        doc["max_position"] = max(doc.get("max_position", 0), pending["max_position"])
+        if "completed_at" in pending and not doc.get("completed_at"):
+            doc["completed_at"] = pending["completed_at"]
+    return doc
+
+@api_router.get("/classes/{class_id}/videos/progress")
+async def get_video_completion(class_id: str, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    """Teacher view: per video, how many enrolled students started and finished it."""
+    class_doc = await loaders.classes.load(class_id)
+    if not class_doc:
+        raise HTTPException(status_code=404, detail="Class not found")
+    if class_doc["teacher_id"] != user.get("user_id") and user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only the teacher or admin can view watch progress")
+    return {"class_id": class_id, "videos": await completion_summary(class_id)}
 
 @api_router.get("/users", response_model=List[User])
-async def get_users(current_user: dict = Depends(admin_required)):
-    users = await db.users.find({}, {"_id": 0}).to_list(1000)
-    return [User(**u) for u in users]
+async def get_users(fields: Optional[str] = None, current_user: dict = Depends(admin_required)):
+    selected = parse_fields(fields, User.model_fields, always=["user_id"])
+    users = await db.users.find({}, sparse_projection(selected, projection(User))).to_list(1000)
+    return trusted_json(users, User, selected)
     
 
 @api_router.patch("/users/{user_id}")
@@ -364,13 +674,17 @@ async def update_user(
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
+    now = datetime.now(timezone.utc)
     result = await db.users.update_one(
         {"user_id": user_id},
-        {"$set": update_data}
+        {"$set": {**update_data, "updated_at": now}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    if "meet_link" in update_data:
+        # Classes are served with their teacher's current meet_link
+        await db.classes.update_many({"teacher_id": user_id}, {"$set": {"updated_at": now}})
     
     return {"message": "User updated successfully"}
 
@@ -378,9 +692,10 @@ async def update_user(
 async def add_recording(
     class_id: str,
     recording_link: str,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
 ):
-    class_doc = await db.classes.find_one({"class_id": class_id})
+    class_doc = await loaders.classes.load(class_id)
     if not class_doc:
         raise HTTPException(status_code=404, detail="Class not found")
 
@@ -389,25 +704,37 @@ async def add_recording(
 
     await db.classes.update_one(
         {"class_id": class_id},
-        {"$set": {"recording_link": recording_link}}
+        {"$set": {"recording_link": recording_link, "updated_at": datetime.now(timezone.utc)}}
     )
+    loaders.classes.clear(class_id)
+    await content_cache.invalidate(class_id)
 
     return {"message": "Recording link added successfully"}
 
 @api_router.delete("/classes/{class_id}")
-async def delete_class(class_id: str, user: dict = Depends(get_current_user)):
+async def delete_class(class_id: str, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
     
-    class_doc = await db.classes.find_one({"class_id": class_id}, {"_id": 0})
+    class_doc = await loaders.classes.load(class_id)
     if not class_doc:
         raise HTTPException(status_code=404, detail="Class not found")
     
     if class_doc["teacher_id"] != user.get("user_id") and user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Only the teacher or admin can delete this class")
     
+    members = await db.enrollments.distinct("user_id", {"class_id": class_id})
     await db.classes.delete_one({"class_id": class_id})
     await db.enrollments.delete_many({"class_id": class_id})
+    loaders.classes.clear(class_id)
+    await content_cache.invalidate(class_id)
+    # One tombstone for the class; clients drop its videos, notes, ... with it
+    await record_tombstone("classes", class_id, user_ids=[class_doc["teacher_id"], *members])
+
+    # Announcements, notes, attendance, ... are removed in the background in
+    # throttled batches; anything left behind is caught by the orphan sweeper.
+    job_id = await jobs.create_job("cascade_delete_class", {"class_id": class_id}, user.get("user_id"))
+    jobs.spawn(jobs.run_job(job_id, lambda jid: cascade_delete_class(class_id, job_id=jid)))
     
-    return {"message": "Class deleted successfully"}
+    return {"message": "Class deleted successfully", "job_id": job_id}
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -431,12 +758,19 @@ async def create_announcement(class_id: str, data: AnnouncementCreate, user: dic
         "posted_by_name": user.get("name"),
         "created_at": datetime.now(timezone.utc),
     }
+    doc["updated_at"] = doc["created_at"]
     await db.announcements.insert_one(doc)
+    await content_cache.invalidate(class_id)
     return {"message": "Announcement posted", "announcement_id": doc["announcement_id"]}
 
 @api_router.get("/classes/{class_id}/announcements")
-async def get_announcements(class_id: str, user: dict = Depends(get_current_user)):
-    items = await db.announcements.find({"class_id": class_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
+async def get_announcements(class_id: str, include_archived: bool = False, user: dict = Depends(get_current_user)):
+    if include_archived:
+        return await find_with_archive("announcements", {"class_id": class_id}, [("created_at", -1)], 100, True)
+    items = await content_cache.get_or_load(class_id, "announcements", lambda: reads.do(
+        ("announcements", class_id),
+        lambda: db.announcements.find({"class_id": class_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    ))
     return items
 
 
@@ -463,12 +797,17 @@ async def create_assignment(class_id: str, data: AssignmentCreate, user: dict =
         "created_by_name": user.get("name"),
         "created_at": datetime.now(timezone.utc),
     }
+    doc["updated_at"] = doc["created_at"]
     await db.assignments.insert_one(doc)
+    await content_cache.invalidate(class_id)
     return {"message": "Assignment created", "assignment_id": doc["assignment_id"]}
 
 @api_router.get("/classes/{class_id}/assignments")
 async def get_assignments(class_id: str, user: dict = Depends(get_current_user)):
-    items = await db.assignments.find({"class_id": class_id}, {"_id": 0}).sort("due_date", 1).to_list(100)
+    items = await content_cache.get_or_load(
+        class_id, "assignments",
+        lambda: db.assignments.find({"class_id": class_id}, {"_id": 0}).sort("due_date", 1).to_list(100)
+    )
     return items
 
 @api_router.get("/assignments")
@@ -490,7 +829,10 @@ async def get_all_assignments(user: dict = Depends(get_current_user)):
 async def delete_assignment(class_id: str, assignment_id: str, user: dict = Depends(get_current_user)):
     if user.get("role") not in ["teacher", "admin"]:
         raise HTTPException(status_code=403, detail="Only teachers/admins can delete assignments")
-    await db.assignments.delete_one({"assignment_id": assignment_id, "class_id": class_id})
+    result = await db.assignments.delete_one({"assignment_id": assignment_id, "class_id": class_id})
+    await content_cache.invalidate(class_id)
+    if result.deleted_count:
+        await record_tombstone("assignments", assignment_id, class_id=class_id)
     return {"message": "Assignment deleted"}
 
 
@@ -515,19 +857,29 @@ async def create_note(class_id: str, data: NoteCreate, user: dict = Depends(get_
         "created_by_name": user.get("name"),
         "created_at": datetime.now(timezone.utc),
     }
+    doc["updated_at"] = doc["created_at"]
     await db.notes.insert_one(doc)
+    await content_cache.invalidate(class_id)
     return {"message": "Note saved", "note_id": doc["note_id"]}
 
 @api_router.get("/classes/{class_id}/notes")
-async def get_notes(class_id: str, user: dict = Depends(get_current_user)):
-    items = await db.notes.find({"class_id": class_id}, {"_id": 0}).sort("session_date", -1).to_list(200)
+async def get_notes(class_id: str, include_archived: bool = False, user: dict = Depends(get_current_user)):
+    if include_archived:
+        return await find_with_archive("notes", {"class_id": class_id}, [("session_date", -1)], 200, True)
+    items = await content_cache.get_or_load(
+        class_id, "notes",
+        lambda: db.notes.find({"class_id": class_id}, {"_id": 0}).sort("session_date", -1).to_list(200)
+    )
     return items
 
 @api_router.delete("/classes/{class_id}/notes/{note_id}")
 async def delete_note(class_id: str, note_id: str, user: dict = Depends(get_current_user)):
     if user.get("role") not in ["teacher", "admin"]:
         raise HTTPException(status_code=403, detail="Only teachers/admins can delete notes")
-    await db.notes.delete_one({"note_id": note_id, "class_id": class_id})
+    result = await db.notes.delete_one({"note_id": note_id, "class_id": class_id})
+    await content_cache.invalidate(class_id)
+    if result.deleted_count:
+        await record_tombstone("notes", note_id, class_id=class_id)
     return {"message": "Note deleted"}
 
 
@@ -555,19 +907,117 @@ async def save_attendance(class_id: str, data: AttendanceCreate, user: dict = De
         "marked_by": user.get("user_id"),
         "created_at": datetime.now(timezone.utc),
     }
+    doc["updated_at"] = doc["created_at"]
     # Upsert by class_id + session_date so re-submitting a date overwrites
-    await db.attendance.replace_one(
+    previous = await db.attendance.find_one_and_replace(
         {"class_id": class_id, "session_date": data.session_date},
         doc,
-        upsert=True
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
     )
+    if previous is None:
+        # An archived session is already counted: it moves back to the live
+        # collection, and the rollups see only the difference
+        previous = await db.attendance_archive.find_one_and_delete(
+            {"class_id": class_id, "session_date": data.session_date}
+        )
+    await apply_attendance_delta(class_id, previous, doc)
     return {"message": "Attendance saved"}
 
+ATTENDANCE_FIELDS = ("attendance_id", "class_id", "session_date", "records", "marked_by", "created_at", "updated_at")
+
 @api_router.get("/classes/{class_id}/attendance")
-async def get_attendance(class_id: str, user: dict = Depends(get_current_user)):
-    items = await db.attendance.find({"class_id": class_id}, {"_id": 0}).sort("session_date", -1).to_list(200)
+async def get_attendance(class_id: str, include_archived: bool = False, fields: Optional[str] = None, user: dict = Depends(get_current_user)):
+    """`fields=session_date` (the calendar view) is answered from the
+    (class_id, session_date) index alone, without the records arrays."""
+    selected = parse_fields(fields, ATTENDANCE_FIELDS)
+    items = await find_with_archive(
+        "attendance", {"class_id": class_id}, [("session_date", -1)], 200, include_archived,
+        projection=sparse_projection(selected, {"_id": 0})
+    )
     return items
 
+@api_router.get("/classes/{class_id}/attendance/summary")
+async def get_attendance_summary(class_id: str, user: dict = Depends(get_current_user)):
+    """Attendance counts and rate from the rollups — no session documents are read.
+    Students get their own figures only."""
+    class_rollup = await db[CLASS_ROLLUPS].find_one({"class_id": class_id}, {"_id": 0})
+    student_query = {"class_id": class_id}
+    if user.get("role") == "student":
+        student_query["student_id"] = user.get("user_id")
+    students = await db[STUDENT_ROLLUPS].find(student_query, {"_id": 0}).to_list(1000)
+    return {
+        "class_id": class_id,
+        "sessions": (class_rollup or {}).get("sessions", 0),
+        **summarize(class_rollup),
+        "students": [{"student_id": s["student_id"], **summarize(s)} for s in students],
+    }
+
+
+@api_router.get("/students/{student_id}/attendance")
+async def get_student_attendance(
+    student_id: str,
+    class_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    user: dict = Depends(get_current_user)
+):
+    """Every session a student appears in, across classes, newest first.
+
+    Served by the multikey index on records.student_id; only the student's
+    own record is returned from each session's records array.
+    """
+    if user.get("role") == "student" and user.get("user_id") != student_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    limit = max(1, min(limit, 200))
+
+    match = {"records.student_id": student_id}
+    if user.get("role") == "teacher":
+        taught = await db.classes.find({"teacher_id": user.get("user_id")}, {"_id": 0, "class_id": 1}).to_list(1000)
+        taught_ids = [c["class_id"] for c in taught]
+        if class_id and class_id not in taught_ids:
+            raise HTTPException(status_code=403, detail="Access denied")
+        match["class_id"] = class_id or {"$in": taught_ids}
+    elif class_id:
+        match["class_id"] = class_id
+    if date_from or date_to:
+        match["session_date"] = {
+            **({"$gte": date_from} if date_from else {}),
+            **({"$lte": date_to} if date_to else {}),
+        }
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, 2)
+        match["$or"] = [
+            {"session_date": {"$lt": last_date}},
+            {"session_date": last_date, "attendance_id": {"$lt": last_id}},
+        ]
+
+    rows = await db.attendance.aggregate([
+        {"$match": match},
+        {"$sort": {"session_date": -1, "attendance_id": -1}},
+        {"$limit": limit + 1},
+        {"$project": {
+            "_id": 0,
+            "attendance_id": 1,
+            "class_id": 1,
+            "session_date": 1,
+            "status": {"$arrayElemAt": [{"$filter": {
+                "input": "$records",
+                "cond": {"$eq": ["$$this.student_id", student_id]},
+            }}, 0]},
+        }},
+    ]).to_list(limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["session_date"], rows[-1]["attendance_id"])
+    for row in rows:
+        row["status"] = (row.get("status") or {}).get("status")
+    return {"items": rows, "next_cursor": next_cursor}
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # PROGRESS / GRADES
@@ -577,6 +1027,7 @@ class ProgressCreate(BaseModel):
     student_id: str
     grade: Optional[str] = None   # e.g. "A", "85%", "Pass"
     comment: Optional[str] = None
+    assignment_id: Optional[str] = None   # set when the grade is for an assignment (gradebook cell)
 
 @api_router.post("/classes/{class_id}/progress")
 async def add_progress(class_id: str, data: ProgressCreate, user: dict = Depends(get_current_user)):
@@ -591,12 +1042,24 @@ async def add_progress(class_id: str, data: ProgressCreate, user: dict = Depends
         "added_by": user.get("user_id"),
         "created_at": datetime.now(timezone.utc),
     }
-    # Upsert: one progress record per student per class
-    await db.progress.replace_one(
-        {"class_id": class_id, "student_id": data.student_id},
-        doc,
-        upsert=True
-    )
+    doc["updated_at"] = doc["created_at"]
+    # Upsert: one progress record per student per class (the current grade).
+    # An assignment grade is not the overall grade; it only goes to history.
+    if not data.assignment_id:
+        await db.progress.replace_one(
+            {"class_id": class_id, "student_id": data.student_id},
+            doc,
+            upsert=True
+        )
+    # ...and the grade event is kept in the bucketed history for trends
+    await record_progress_event(class_id, data.student_id, {
+        "progress_id": doc["progress_id"],
+        "grade": data.grade,
+        "comment": data.comment,
+        "assignment_id": data.assignment_id,
+        "added_by": doc["added_by"],
+        "at": doc["created_at"],
+    })
     return {"message": "Progress updated"}
 
 @api_router.get("/classes/{class_id}/progress")
@@ -609,6 +1072,22 @@ async def get_progress(class_id: str, user: dict = Depends(get_current_user)):
         items = await db.progress.find({"class_id": class_id}, {"_id": 0}).to_list(100)
     return items
 
+@api_router.get("/progress/history")
+async def get_progress_trends(
+    class_id: str,
+    student_id: Optional[str] = None,
+    since_month: Optional[str] = None,   # "YYYY-MM"
+    include_events: bool = True,
+    user: dict = Depends(get_current_user)
+):
+    """Grade history for a class: monthly trend per student plus the raw events.
+    Students only ever see their own."""
+    if user.get("role") == "student":
+        if student_id and student_id != user.get("user_id"):
+            raise HTTPException(status_code=403, detail="Access denied")
+        student_id = user.get("user_id")
+    return await get_progress_history(class_id, student_id, since_month, include_events)
+
 @api_router.get("/progress")
 async def get_my_progress(user: dict = Depends(get_current_user)):
     """All progress records for the current student."""
@@ -626,47 +1105,108 @@ class CreditAdjust(BaseModel):
     amount: float          # positive = add, negative = deduct
     note: Optional[str] = None
 
+class CreditBulkAdjust(BaseModel):
+    # Either the same amount for a list of students, or a per-student amount
+    student_ids: Optional[List[str]] = None
+    amount: Optional[float] = None
+    adjustments: Optional[Dict[str, float]] = None
+    note: Optional[str] = None
+
 @api_router.post("/students/{student_id}/credits")
 async def adjust_credits(student_id: str, data: CreditAdjust, user: dict = Depends(get_current_user)):
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
-    transaction = {
-        "tx_id": f"tx_{uuid.uuid4().hex[:12]}",
-        "student_id": student_id,
-        "amount": data.amount,
-        "note": data.note,
-        "created_by": user.get("user_id"),
-        "created_at": datetime.now(timezone.utc),
-    }
-    await db.credit_transactions.insert_one(transaction)
-    # Update balance on user document
-    await db.users.update_one(
-        {"user_id": student_id},
-        {"$inc": {"credit_balance": data.amount}}
+    # Ledger row and balance update are written in one transaction
+    transaction = await post_adjustment(student_id, data.amount, data.note, user.get("user_id"))
+    return {"message": "Credits adjusted", "tx_id": transaction["tx_id"]}
+
+@api_router.post("/credits/bulk")
+async def bulk_adjust_credits(data: CreditBulkAdjust, user: dict = Depends(get_current_user)):
+    """Credit or debit many students at once (one insert + one bulk_write, in a transaction)."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    adjustments = dict(data.adjustments or {})
+    if data.student_ids:
+        if data.amount is None:
+            raise HTTPException(status_code=400, detail="amount is required with student_ids")
+        for sid in data.student_ids:
+            adjustments[sid] = adjustments.get(sid, 0) + data.amount
+    if not adjustments:
+        raise HTTPException(status_code=400, detail="No students to adjust")
+
+    found = await db.users.find(
+        {"user_id": {"$in": list(adjustments)}, "role": "student"}, {"_id": 0, "user_id": 1}
+    ).to_list(len(adjustments))
+    found_ids = {u["user_id"] for u in found}
+    unknown = [sid for sid in adjustments if sid not in found_ids]
+    posted = await post_bulk(
+        {sid: amount for sid, amount in adjustments.items() if sid in found_ids},
+        data.note, user.get("user_id")
     )
-    return {"message": "Credits adjusted"}
+    return {"message": "Credits adjusted", "posted": posted, "unknown_students": unknown}
 
 @api_router.get("/students/{student_id}/credits")
-async def get_credits(student_id: str, user: dict = Depends(get_current_user)):
+async def get_credits(
+    student_id: str,
+    at: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    user: dict = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
+):
+    """Balance plus one page of the ledger, newest first. With `at`, the
+    balance as of that moment (latest snapshot + transactions since)."""
     if user.get("role") != "admin" and user.get("user_id") != student_id:
         raise HTTPException(status_code=403, detail="Access denied")
-    student = await db.users.find_one({"user_id": student_id}, {"_id": 0})
+    student = await loaders.users.load(student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
+    limit = max(1, min(limit, 200))
+    query = {"student_id": student_id}
+    if cursor:
+        last_at, last_id = decode_cursor(cursor, 2)
+        last_at = datetime.fromisoformat(last_at)
+        query["$or"] = [
+            {"created_at": {"$lt": last_at}},
+            {"created_at": last_at, "tx_id": {"$lt": last_id}},
+        ]
     transactions = await db.credit_transactions.find(
-        {"student_id": student_id}, {"_id": 0}
-    ).sort("created_at", -1).to_list(200)
-    return {"balance": student.get("credit_balance", 0), "transactions": transactions}
+        query, {"_id": 0, "entries": 0}
+    ).sort([("created_at", -1), ("tx_id", -1)]).to_list(limit + 1)
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(transactions[-1]["created_at"].isoformat(), transactions[-1]["tx_id"])
+    balance = await balance_at(student_id, at) if at else student.get("credit_balance", 0)
+    return {"balance": balance, "transactions": transactions, "next_cursor": next_cursor}
+
+@api_router.get("/credits/reconcile")
+async def reconcile_credits(user: dict = Depends(get_current_user)):
+    """Stream (NDJSON) every student whose cached balance has drifted from the ledger."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    async def lines():
+        async for row in iter_drift():
+            yield json.dumps(row, default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+CREDIT_FIELDS = ("user_id", "name", "email", "credit_balance")
 
 @api_router.get("/credits")
-async def get_all_credits(user: dict = Depends(get_current_user)):
-    """Admin: get credit balance for all students."""
+async def get_all_credits(fields: Optional[str] = None, user: dict = Depends(get_current_user)):
+    """Admin: get credit balance for all students.
+
+    Only the returned fields are projected, and (role, user_id, name, email,
+    credit_balance) covers the query, so no user document is fetched."""
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
-    students = await db.users.find({"role": "student"}, {"_id": 0}).to_list(1000)
+    selected = parse_fields(fields, CREDIT_FIELDS, always=["user_id"]) or list(CREDIT_FIELDS)
+    students = await db.users.find({"role": "student"}, sparse_projection(selected, None)).to_list(1000)
+    # A covered read returns a missing credit_balance (never adjusted) as null
     return [
-        {"user_id": s["user_id"], "name": s.get("name"), "email": s.get("email"),
-         "credit_balance": s.get("credit_balance", 0)}
+        {name: (s.get(name) or 0) if name == "credit_balance" else s.get(name) for name in selected}
         for s in students
     ]
 
@@ -682,10 +1222,10 @@ class InvoiceCreate(BaseModel):
     due_date: str   # ISO date string
 
 @api_router.post("/invoices")
-async def create_invoice(data: InvoiceCreate, user: dict = Depends(get_current_user)):
+async def create_invoice(data: InvoiceCreate, user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
-    student = await db.users.find_one({"user_id": data.student_id}, {"_id": 0})
+    student = await loaders.users.load(data.student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     doc = {
@@ -696,20 +1236,133 @@ async def create_invoice(data: InvoiceCreate, user: dict = Depends(get_current_u
         "amount": data.amount,
         "description": data.description,
         "due_date": data.due_date,
-        "status": "unpaid",     # "unpaid" | "paid"
+        "status": "unpaid",     # "unpaid" | "overdue" | "paid"
         "created_by": user.get("user_id"),
         "created_at": datetime.now(timezone.utc),
     }
+    doc["updated_at"] = doc["created_at"]
+    doc["rollup_month"] = rollup_month(doc)
     await db.invoices.insert_one(doc)
+    await on_created([doc])
     return {"message": "Invoice created", "invoice_id": doc["invoice_id"]}
 
+class InvoiceBatchCreate(BaseModel):
+    # Who to bill: exactly one of these
+    class_id: Optional[str] = None
+    role: Optional[str] = None
+    student_ids: Optional[List[str]] = None
+    amount: float
+    description: str
+    due_date: str   # ISO date string
+    billing_period: str = Field(..., pattern=r"^\d{4}-\d{2}$")   # "YYYY-MM"
+
+INVOICE_BATCH_CHUNK = 1000
+
+async def _resolve_billed_students(data: InvoiceBatchCreate):
+    # Only students are ever billed, whichever selector was used
+    projection = {"_id": 0, "user_id": 1, "name": 1, "email": 1}
+    if data.class_id:
+        return await db.enrollments.aggregate([
+            {"$match": {"class_id": data.class_id}},
+            {"$lookup": {
+                "from": "users",
+                "let": {"uid": "$user_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$user_id", "$$uid"]}, "role": "student"}},
+                    {"$project": projection},
+                ],
+                "as": "user",
+            }},
+            {"$unwind": "$user"},
+            {"$replaceWith": "$user"},
+        ]).to_list(None)
+    if data.role:
+        if data.role != "student":
+            raise HTTPException(status_code=400, detail="Only students can be billed")
+        return await db.users.find({"role": "student"}, projection).to_list(None)
+    return await db.users.find({"user_id": {"$in": data.student_ids}, "role": "student"}, projection).to_list(None)
+
+@api_router.post("/invoices/batch")
+async def create_invoice_batch(data: InvoiceBatchCreate, user: dict = Depends(get_current_user)):
+    """Bill a class, a role or a list of students in one go.
+
+    Students are resolved with one projected query and invoices written with
+    chunked insert_many. Each invoice carries a billing_key (period +
+    description); a unique (student_id, billing_key) index makes re-running
+    the same batch for the same period skip students already billed.
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if sum(x is not None for x in (data.class_id, data.role, data.student_ids)) != 1:
+        raise HTTPException(status_code=400, detail="Specify exactly one of class_id, role or student_ids")
+
+    students = await _resolve_billed_students(data)
+    billing_key = f"{data.billing_period}:{hashlib.sha1(data.description.encode()).hexdigest()[:12]}"
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    now = datetime.now(timezone.utc)
+    docs = [{
+        "invoice_id": f"inv_{uuid.uuid4().hex[:12]}",
+        "student_id": s["user_id"],
+        "student_name": s.get("name"),
+        "student_email": s.get("email"),
+        "amount": data.amount,
+        "description": data.description,
+        "due_date": data.due_date,
+        "status": "unpaid",
+        "billing_period": data.billing_period,
+        "billing_key": billing_key,
+        "batch_id": batch_id,
+        "created_by": user.get("user_id"),
+        "created_at": now,
+        "updated_at": now,
+        "rollup_month": now.strftime("%Y-%m"),
+    } for s in students]
+
+    created = skipped = 0
+    errors = []
+    for i in range(0, len(docs), INVOICE_BATCH_CHUNK):
+        chunk = docs[i:i + INVOICE_BATCH_CHUNK]
+        failed = set()
+        try:
+            await db.invoices.insert_many(chunk, ordered=False)
+        except BulkWriteError as exc:
+            for err in exc.details.get("writeErrors", []):
+                failed.add(err["index"])
+                if err.get("code") == 11000:
+                    skipped += 1
+                else:
+                    errors.append({"student_id": chunk[err["index"]]["student_id"], "error": err.get("errmsg")})
+        inserted = [d for n, d in enumerate(chunk) if n not in failed]
+        created += len(inserted)
+        await on_created(inserted)
+
+    missing = []
+    if data.student_ids:
+        found = {s["user_id"] for s in students}
+        missing = [sid for sid in data.student_ids if sid not in found]
+    return {
+        "batch_id": batch_id,
+        "billing_period": data.billing_period,
+        "requested": len(docs),
+        "created": created,
+        "skipped_already_billed": skipped,
+        "missing_students": missing,
+        "errors": errors,
+    }
+
+INVOICE_FIELDS = (
+    "invoice_id", "student_id", "student_name", "student_email", "amount", "description", "due_date",
+    "status", "paid_at", "overdue_at", "billing_period", "batch_id", "created_by", "created_at", "updated_at",
+)
+
 @api_router.get("/invoices")
-async def get_invoices(user: dict = Depends(get_current_user)):
+async def get_invoices(fields: Optional[str] = None, user: dict = Depends(get_current_user)):
+    invoice_projection = sparse_projection(parse_fields(fields, INVOICE_FIELDS, always=["invoice_id"]), {"_id": 0})
     if user.get("role") == "admin":
-        items = await db.invoices.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
+        items = await db.invoices.find({}, invoice_projection).sort("created_at", -1).to_list(500)
     else:
         items = await db.invoices.find(
-            {"student_id": user.get("user_id")}, {"_id": 0}
+            {"student_id": user.get("user_id")}, invoice_projection
         ).sort("created_at", -1).to_list(200)
     return items
 
@@ -718,23 +1371,53 @@ async def update_invoice(invoice_id: str, user: dict = Depends(get_current_user)
     """Mark an invoice as paid (admin only)."""
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
-    result = await db.invoices.update_one(
-        {"invoice_id": invoice_id},
-        {"$set": {"status": "paid", "paid_at": datetime.now(timezone.utc)}}
+    now = datetime.now(timezone.utc)
+    before = await db.invoices.find_one_and_update(
+        {"invoice_id": invoice_id, "status": {"$ne": "paid"}},
+        {"$set": {"status": "paid", "paid_at": now, "updated_at": now}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Invoice not found")
+    if before is None:
+        if not await db.invoices.find_one({"invoice_id": invoice_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Invoice not found")
+        return {"message": "Invoice marked as paid"}   # already paid
+    await on_paid(before)
     return {"message": "Invoice marked as paid"}
 
 @api_router.delete("/invoices/{invoice_id}")
 async def delete_invoice(invoice_id: str, user: dict = Depends(get_current_user)):
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
-    await db.invoices.delete_one({"invoice_id": invoice_id})
+    before = await db.invoices.find_one_and_delete({"invoice_id": invoice_id}, projection={"_id": 0})
+    if before:
+        await on_deleted(before)
+        await record_tombstone(
+            "invoices", invoice_id, user_ids=[before["student_id"]], extra={"rollup_month": rollup_month(before)}
+        )
     return {"message": "Invoice deleted"}
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# REPORTS
+# ─────────────────────────────────────────────────────────────────────────────
 
+@api_router.get("/reports/revenue")
+async def get_revenue_report(month: Optional[str] = None, user: dict = Depends(get_current_user)):
+    """Billed / paid / outstanding / overdue per month, read from the rollups."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if month:
+        doc = await db.revenue_rollups.find_one({"month": month}, {"_id": 0})
+        return present(doc, month)
+    docs = await db.revenue_rollups.find({}, {"_id": 0}).sort("month", -1).to_list(120)
+    return [present(d, d["month"]) for d in docs]
+
+
+
+app.add_middleware(IdempotencyMiddleware)
+# Outside idempotency (shed before its DB write), inside CORS (503s keep CORS headers)
+app.add_middleware(LoadShedMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -756,10 +1439,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
-
 app.include_router(api_router)
 app.include_router(google_router, prefix="/api")
-app.include_router(schedule.router)
\ No newline at end of file
+app.include_router(schedule.router)
+app.include_router(maintenance.router)
+app.include_router(gradebook.router)
+app.include_router(roster.router)
+app.include_router(sync.router)
+app.include_router(feed.router)
\ No newline at end of file
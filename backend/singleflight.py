@@ -0,0 +1,55 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+When a class starts, hundreds of students request the same class document,
+announcements and videos within the same second. `do(key, fn)` runs `fn` once
+for all concurrent callers with the same key and hands every caller the same
+result; the next call after it finishes starts a fresh one. Nothing is cached
+beyond the in-flight window.
+
+Only the database call is shared — auth and permission checks stay in the
+handlers and run per caller. Results are shared objects, so callers must treat
+them as read-only (copy before modifying).
+"""
+import asyncio
+
+import metrics
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+        metrics.register(f"singleflight.{name}", self.stats)
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        # shield: a caller that disconnects must not cancel the shared call
+        # for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved; waiters already got it
+
+    def stats(self):
+        total = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+            "in_flight": len(self._inflight),
+        }
+
+
+reads = SingleFlight("reads")
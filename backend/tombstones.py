@@ -0,0 +1,37 @@
+"""Deletion markers for /api/sync.
+
+A deleted document cannot show up in an `updated_at > since` query, so the
+delete handlers leave a tombstone behind: {collection, doc_id, deleted_at}
+plus who it concerns — `class_id` for content inside a class that still
+exists, `user_ids` for everything else (a deleted class: its teacher and
+former students; an invoice: its student; an unenrollment: the students
+removed). Tombstones expire after TOMBSTONE_TTL_DAYS; a client whose token
+is older than that is told to refetch from scratch.
+"""
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from database import db
+
+
+async def record_tombstone(collection: str, doc_id: str, class_id: Optional[str] = None, user_ids: Optional[List[str]] = None,
+                           extra: Optional[dict] = None):
+    """`extra` is kept on the marker for other readers (e.g. an invoice's
+    rollup_month for the revenue rebuild) but not returned by /api/sync."""
+    doc = {**(extra or {}), "collection": collection, "doc_id": doc_id, "deleted_at": datetime.now(timezone.utc)}
+    if class_id:
+        doc["class_id"] = class_id
+    if user_ids:
+        doc["user_ids"] = list(user_ids)
+    await db.tombstones.insert_one(doc)
+
+
+async def record_tombstones(collection: str, docs: List[dict], id_field: str):
+    """Tombstones for many class content documents at once (e.g. archived ones)."""
+    if not docs:
+        return
+    now = datetime.now(timezone.utc)
+    await db.tombstones.insert_many([
+        {"collection": collection, "doc_id": d[id_field], "class_id": d.get("class_id"), "deleted_at": now}
+        for d in docs
+    ])
@@ -0,0 +1,244 @@
+"""Video watch progress, written through an in-memory coalescing buffer.
+
+Players send a heartbeat every few seconds while a recording plays. Writing
+each one would mean thousands of tiny updates per second, so heartbeats
+only update `buffer`, which keeps the latest position per (student, video).
+Every WATCH_FLUSH_INTERVAL seconds (or once WATCH_MAX_PENDING pairs are
+waiting) the buffer is written with one unordered bulk_write of upserts
+into `video_progress`. On shutdown the flusher is stopped (not cancelled)
+after one last flush.
+
+Only students enrolled in the video's class are recorded. Both that check
+and the video's class are remembered per process, so a steady heartbeat
+still does no database work. Before writing, a flush drops the videos that
+no longer exist (their class was deleted), so buffered upserts cannot
+recreate rows the cascade removed.
+
+Each worker has its own buffer, and a student's heartbeats may land on
+different workers. The upserts are therefore order-independent where that
+matters: `max_position` and `completed_at` use $max/$min, so a late flush
+from another worker cannot move them backwards. A crash loses at most one
+interval of positions.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+import metrics
+from database import db
+from jobs import spawn
+
+logger = logging.getLogger(__name__)
+
+WATCH_FLUSH_INTERVAL = float(os.getenv("WATCH_FLUSH_INTERVAL", "10"))
+WATCH_MAX_PENDING = int(os.getenv("WATCH_MAX_PENDING", "50000"))
+# Share of a video that counts as watched
+COMPLETION_RATIO = 0.9
+VIDEO_CLASS_CACHE_SIZE = 10000
+ENROLLMENT_CACHE_SIZE = 50000
+# How long a confirmed enrollment is trusted before it is checked again
+ENROLLMENT_CACHE_SECONDS = 60
+
+
+class WatchBuffer:
+    def __init__(self):
+        self._pending = {}  # (student_id, video_id) -> latest heartbeat
+        self._lock = asyncio.Lock()
+        self._early_flush = None
+        self.heartbeats = 0
+        self.written = 0
+        self.flushes = 0
+
+    def add(self, student_id: str, video_id: str, class_id: str, position: float, duration: float):
+        now = datetime.now(timezone.utc)
+        key = (student_id, video_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {"class_id": class_id, "max_position": position}
+        entry.update(position=position, duration=duration, at=now)
+        entry["max_position"] = max(entry["max_position"], position)
+        if duration and entry["max_position"] >= duration * COMPLETION_RATIO:
+            entry.setdefault("completed_at", now)
+        self.heartbeats += 1
+        if len(self._pending) >= WATCH_MAX_PENDING and (self._early_flush is None or self._early_flush.done()):
+            self._early_flush = spawn(self.flush())
+
+    def pending(self, student_id: str, video_id: str):
+        return self._pending.get((student_id, video_id))
+
+    def _restore(self, pending: dict):
+        """Put a batch that was not written back, merged with newer heartbeats."""
+        for key, old in pending.items():
+            new = self._pending.setdefault(key, old)
+            if new is not old:
+                new["max_position"] = max(new["max_position"], old["max_position"])
+                if "completed_at" in old:
+                    new["completed_at"] = min(new.get("completed_at", old["completed_at"]), old["completed_at"])
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            try:
+                pending = await _drop_deleted_videos(pending)
+            except BaseException:
+                self._restore(pending)
+                raise
+            ops = []
+            for (student_id, video_id), e in pending.items():
+                update = {
+                    "$set": {
+                        "class_id": e["class_id"],
+                        "position": e["position"],
+                        "duration": e["duration"],
+                        "last_seen_at": e["at"],
+                        "updated_at": e["at"],
+                    },
+                    "$max": {"max_position": e["max_position"]},
+                    "$setOnInsert": {"first_seen_at": e["at"]},
+                }
+                if "completed_at" in e:
+                    update["$min"] = {"completed_at": e["completed_at"]}
+                ops.append(UpdateOne({"student_id": student_id, "video_id": video_id}, update, upsert=True))
+            if not ops:
+                return 0
+            try:
+                await db.video_progress.bulk_write(ops, ordered=False)
+            except BaseException:
+                # Cancellation included: the upserts are idempotent, so writing
+                # the batch again is safe whereas dropping it is not
+                self._restore(pending)
+                raise
+            self.written += len(ops)
+            self.flushes += 1
+            return len(ops)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "heartbeats": self.heartbeats,
+            "written": self.written,
+            "flushes": self.flushes,
+        }
+
+
+buffer = WatchBuffer()
+metrics.register("watch_progress", buffer.stats)
+
+_video_classes = OrderedDict()
+_enrollments = OrderedDict()  # (student_id, class_id) -> confirmed until (monotonic)
+
+
+async def _drop_deleted_videos(pending: dict) -> dict:
+    """`pending` without the videos that have been deleted since."""
+    video_ids = list({video_id for _, video_id in pending})
+    existing = set(await db.videos.distinct("video_id", {"video_id": {"$in": video_ids}}))
+    for video_id in set(video_ids) - existing:
+        _video_classes.pop(video_id, None)
+    return {key: e for key, e in pending.items() if key[1] in existing}
+
+
+async def video_class_id(video_id: str):
+    """class_id of a video, remembered per process (videos never move class)."""
+    class_id = _video_classes.get(video_id)
+    if class_id is None:
+        video = await db.videos.find_one({"video_id": video_id}, {"_id": 0, "class_id": 1})
+        if not video:
+            return None
+        class_id = _video_classes[video_id] = video["class_id"]
+        if len(_video_classes) > VIDEO_CLASS_CACHE_SIZE:
+            _video_classes.popitem(last=False)
+    return class_id
+
+
+async def is_enrolled(student_id: str, class_id: str) -> bool:
+    key = (student_id, class_id)
+    now = time.monotonic()
+    if _enrollments.get(key, 0) > now:
+        return True
+    if not await db.enrollments.find_one({"user_id": student_id, "class_id": class_id}, {"_id": 1}):
+        _enrollments.pop(key, None)
+        return False
+    _enrollments[key] = now + ENROLLMENT_CACHE_SECONDS
+    _enrollments.move_to_end(key)
+    if len(_enrollments) > ENROLLMENT_CACHE_SIZE:
+        _enrollments.popitem(last=False)
+    return True
+
+
+_flusher = None
+
+
+def start_flushing():
+    """Flush this worker's buffer every WATCH_FLUSH_INTERVAL seconds until
+    stop_flushing(). Not scheduled like jobs.start_periodic (every worker owns
+    its own buffer), and not spawned through jobs either: jobs.shutdown()
+    cancels those, and a cancelled flush must not be the last one."""
+    global _flusher
+    stop = asyncio.Event()
+
+    async def loop():
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), WATCH_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await buffer.flush()
+            except Exception:
+                logger.exception("Watch progress flush failed")
+
+    _flusher = (stop, asyncio.create_task(loop()))
+    return _flusher[1]
+
+
+async def stop_flushing():
+    """Stop the flusher after one final flush (from the lifespan, before
+    jobs.shutdown())."""
+    global _flusher
+    if _flusher is None:
+        return
+    stop, task = _flusher
+    _flusher = None
+    stop.set()
+    await task
+
+
+async def completion_summary(class_id: str) -> list:
+    """Per video in the class: enrolled students who started it, finished it,
+    and the average share watched (over enrolled students)."""
+    enrolled = await db.enrollments.distinct("user_id", {"class_id": class_id})
+    rows = await db.video_progress.aggregate([
+        {"$match": {"class_id": class_id, "student_id": {"$in": enrolled}}},
+        {"$group": {
+            "_id": "$video_id",
+            "viewers": {"$sum": 1},
+            "completed": {"$sum": {"$cond": [{"$ifNull": ["$completed_at", False]}, 1, 0]}},
+            "watched": {"$sum": {"$cond": [
+                {"$gt": ["$duration", 0]},
+                {"$min": [1, {"$divide": ["$max_position", "$duration"]}]},
+                0,
+            ]}},
+        }},
+    ]).to_list(None)
+    by_video = {r["_id"]: r for r in rows}
+    videos = await db.videos.find({"class_id": class_id}, {"_id": 0, "video_id": 1, "title": 1}).to_list(1000)
+    summary = []
+    for video in videos:
+        row = by_video.get(video["video_id"], {})
+        summary.append({
+            "video_id": video["video_id"],
+            "title": video.get("title"),
+            "enrolled": len(enrolled),
+            "viewers": row.get("viewers", 0),
+            "completed": row.get("completed", 0),
+            "completion_rate": round(row.get("completed", 0) / len(enrolled), 4) if enrolled else 0.0,
+            "avg_watched": round(row.get("watched", 0) / len(enrolled), 4) if enrolled else 0.0,
+        })
+    return summary
@@ -0,0 +1,353 @@
+"""Backend benchmarks.
+
+Run from the repository root with the backend requirements installed and a
+MongoDB reachable through MONGO_URL / DB_NAME:
+
+    python backend_bench.py                # every benchmark
+    python backend_bench.py workers        # just one of them
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def _hammer(url, seconds, counter):
+    """Client process: issue requests back to back on a keep-alive session."""
+    session = requests.Session()
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        session.get(url)
+        done += 1
+    with counter.get_lock():
+        counter.value += done
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# WORKER SCALING
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bench_workers(seconds=5.0, clients=None):
+    """Requests/second against gunicorn with 1..N uvicorn workers."""
+    cpus = multiprocessing.cpu_count()
+    clients = clients or cpus * 4
+    counts = sorted({1, 2, max(1, cpus // 2), cpus})
+    print(f"\n== worker scaling ({cpus} cpus, {clients} client processes, {seconds}s each)")
+    baseline = None
+    for workers in counts:
+        port = _free_port()
+        env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), LOG_LEVEL="warning")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "server:app", "-c", "gunicorn.conf.py", "--access-logfile", ""],
+            cwd=BACKEND_DIR, env=env,
+        )
+        url = f"http://127.0.0.1:{port}/api/"
+        try:
+            _wait_until_up(url)
+            counter = multiprocessing.Value("l", 0)
+            procs = [multiprocessing.Process(target=_hammer, args=(url, seconds, counter)) for _ in range(clients)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            rps = counter.value / seconds
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or rps
+        print(f"   {workers:>3} workers: {rps:>9.0f} req/s  (x{rps / baseline:.2f})")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# COLD START
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Budgets for a cold start on a small Render instance; exceeding one makes
+# this benchmark exit non-zero so a regression (e.g. a heavy import creeping
+# back to module level) is caught.
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+FIRST_REQUEST_BUDGET_SECONDS = float(os.getenv("FIRST_REQUEST_BUDGET_SECONDS", "3.0"))
+
+
+def bench_startup(runs=5):
+    """Import time of server.py and process start → first 200 response."""
+    print(f"\n== cold start (best of {runs})")
+    probe = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+    import_times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        import_times.append(float(out.stdout.strip().splitlines()[-1]))
+
+    first_request_times = []
+    for _ in range(runs):
+        port = _free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR,
+        )
+        try:
+            _wait_until_up(f"http://127.0.0.1:{port}/api/")
+            first_request_times.append(time.perf_counter() - started)
+        finally:
+            server.terminate()
+            server.wait()
+
+    import_s, first_s = min(import_times), min(first_request_times)
+    print(f"   import server:   {import_s * 1000:8.1f} ms  (budget {IMPORT_BUDGET_SECONDS * 1000:.0f} ms)")
+    print(f"   first request:   {first_s * 1000:8.1f} ms  (budget {FIRST_REQUEST_BUDGET_SECONDS * 1000:.0f} ms)")
+    if import_s > IMPORT_BUDGET_SECONDS or first_s > FIRST_REQUEST_BUDGET_SECONDS:
+        raise SystemExit("cold start over budget")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# CONTENT CACHE
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bench_cache(classes=500, reads=200_000, write_ratio=0.01, max_entries=1000):
+    """Hit ratio of the per-class content cache under a skewed read/write mix.
+
+    Reads follow a Zipf-like popularity (a few classes are live at any time),
+    writes invalidate a random class. The loader stands in for Mongo.
+    """
+    from cache import ContentCache, LRUBackend
+
+    kinds = ["class", "announcements", "notes", "assignments"]
+    weights = [1 / (rank + 1) for rank in range(classes)]
+    rng = random.Random(42)
+    payload = [{"title": "x" * 200, "content": "y" * 800} for _ in range(20)]
+
+    async def load():
+        return payload
+
+    async def run():
+        cache = ContentCache(LRUBackend(max_entries=max_entries), ttl=None)
+        started = time.perf_counter()
+        for class_idx in rng.choices(range(classes), weights, k=reads):
+            class_id = f"class_{class_idx}"
+            if rng.random() < write_ratio:
+                await cache.invalidate(class_id)
+            else:
+                await cache.get_or_load(class_id, rng.choice(kinds), load)
+        return cache, time.perf_counter() - started
+
+    cache, elapsed = asyncio.run(run())
+    stats = cache.stats()
+    print(f"\n== content cache ({classes} classes, {reads} ops, {write_ratio:.0%} writes, cap {max_entries})")
+    print(f"   hit ratio:  {stats['hit_ratio']:.1%}   ({stats['hits']} hits / {stats['misses']} misses)")
+    print(f"   evictions:  {stats['evictions']}   resident: {stats['entries']} entries, {stats['bytes'] / 1024:.0f} KiB")
+    print(f"   per op:     {elapsed / reads * 1e6:.1f} µs")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# RATE LIMITER
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bench_ratelimit(checks=200_000, keys=10_000, hashes=5):
+    """Cost of a limiter check next to the argon2 work it protects.
+
+    Runs the in-process store (the same code path workers use without
+    CACHE_URL) over a spread of IPs, then an attack on one key where nearly
+    every check is a rejection.
+    """
+    from fastapi import HTTPException
+    from passwords import pwd_context
+    from ratelimit import MemoryBucketStore, RateLimit
+
+    rng = random.Random(42)
+
+    async def run(limit, key_for):
+        rejected = 0
+        started = time.perf_counter()
+        for i in range(checks):
+            try:
+                await limit.hit(key_for(i))
+            except HTTPException:
+                rejected += 1
+        return time.perf_counter() - started, rejected
+
+    spread = RateLimit("bench_ip", "20/60", MemoryBucketStore())
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(keys)]
+    spread_s, spread_rejected = asyncio.run(run(spread, lambda i: rng.choice(ips)))
+    attack = RateLimit("bench_account", "5/300", MemoryBucketStore())
+    attack_s, attack_rejected = asyncio.run(run(attack, lambda i: "victim@example.com"))
+
+    started = time.perf_counter()
+    for _ in range(hashes):
+        pwd_context.hash("correct horse battery staple")
+    argon2_s = (time.perf_counter() - started) / hashes
+
+    print(f"\n== rate limiter ({checks} checks, memory store)")
+    print(f"   {keys} keys:   {spread_s / checks * 1e6:6.2f} µs/check  ({spread_rejected} rejected)")
+    print(f"   one key:      {attack_s / checks * 1e6:6.2f} µs/check  ({attack_rejected} rejected)")
+    print(f"   argon2 hash:  {argon2_s * 1e3:6.1f} ms  (a check costs {spread_s / checks / argon2_s:.4%} of one)")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# RESPONSE SERIALIZATION
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bench_serialization(rows=10_000, runs=5):
+    """Per-row cost of turning DB documents into a JSON list response.
+
+    "models" is the previous path: Model(**doc) per row, then what FastAPI
+    does with response_model (dump, validate the list again, encode).
+    "trusted" is serialization.trusted_json on projected rows.
+    """
+    import json
+    from datetime import datetime, timezone
+    from typing import List
+
+    from pydantic import TypeAdapter
+
+    from serialization import trusted_json
+    from server import ClassResponse, User, VideoResponse
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    samples = {
+        "classes": (ClassResponse, lambda i: {
+            "class_id": f"class_{i:012x}", "title": f"Class {i}", "description": "Weekly session " * 4,
+            "teacher_id": f"user_{i % 50:012x}", "teacher_name": "Teacher", "start_time": "2024-09-01T10:00",
+            "end_time": "2024-09-01T11:00", "max_students": 50, "enrolled_count": i % 50,
+            "meet_link": "https://meet.google.com/abcdefghij", "created_at": now,
+        }),
+        "videos": (VideoResponse, lambda i: {
+            "video_id": f"video_{i:012x}", "class_id": f"class_{i % 200:012x}", "title": f"Lesson {i}",
+            "video_url": "https://example.com/v.mp4", "video_data": None, "description": "Recording",
+            "uploaded_by": "user_000000000001", "created_at": now,
+        }),
+        "users": (User, lambda i: {
+            "user_id": f"user_{i:012x}", "email": f"student{i}@example.com", "name": f"Student {i}",
+            "picture": None, "role": "student", "created_at": now, "meet_link": None, "recording_link": None,
+        }),
+    }
+
+    def best(fn):
+        times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    print(f"\n== response serialization ({rows} rows, best of {runs})")
+    for name, (model, make) in samples.items():
+        docs = [make(i) for i in range(rows)]
+        adapter = TypeAdapter(List[model])
+
+        def models():
+            objs = [model(**d) for d in docs]
+            content = adapter.validate_python([o.model_dump() for o in objs])
+            json.dumps(adapter.dump_python(content, mode="json")).encode()
+
+        def trusted():
+            trusted_json(docs, model)
+
+        before, after = best(models), best(trusted)
+        print(f"   {name:<8} models: {before / rows * 1e6:6.2f} µs/row   trusted: {after / rows * 1e6:6.2f} µs/row   (x{before / after:.1f})")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# ROSTER IMPORT
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bench_import(rows=10_000):
+    """Wall time of a roster import, with and without passwords.
+
+    Feeds generated rows through the import's chunk path (validation, the
+    per-chunk `$in` lookup, hashing across the pool, insert_many) against
+    MONGO_URL, then deletes the users it created. Also prints one hash with
+    the login parameters next to one with the bulk-import parameters.
+    """
+    from database import db
+    from passwords import PASSWORD_HASH_PROCESSES, bulk_context, pwd_context, shutdown_pool
+    from routes.roster import IMPORT_CHUNK, _import_chunk, _Report
+
+    def per_hash(context, n=5):
+        started = time.perf_counter()
+        for _ in range(n):
+            context.hash("correct horse battery staple")
+        return (time.perf_counter() - started) / n
+
+    run_id = f"bench_import_{os.getpid()}"
+
+    async def run(with_passwords):
+        rows_in = [
+            (i + 1, {
+                "email": f"{run_id}_{with_passwords:d}_{i}@example.com",
+                "name": f"Student {i}",
+                "role": "student",
+                "password": f"initial-{i}" if with_passwords else "",
+            })
+            for i in range(rows)
+        ]
+        report = _Report()
+        started = time.perf_counter()
+        try:
+            for i in range(0, rows, IMPORT_CHUNK):
+                await _import_chunk(rows_in[i:i + IMPORT_CHUNK], set(), report, run_id)
+            return time.perf_counter() - started, report
+        finally:
+            await db.users.delete_many({"imported_by": run_id})
+
+    print(f"\n== roster import ({rows} rows, {PASSWORD_HASH_PROCESSES} hashing processes)")
+    print(f"   argon2 login params: {per_hash(pwd_context) * 1e3:6.1f} ms/hash   bulk params: {per_hash(bulk_context) * 1e3:6.1f} ms/hash")
+    try:
+        for with_passwords in (False, True):
+            seconds, report = asyncio.run(run(with_passwords))
+            label = "with passwords:" if with_passwords else "invites only:  "
+            print(f"   {label} {seconds:7.1f} s   ({report.created} created, {rows / seconds:7.0f} rows/s)")
+    finally:
+        shutdown_pool()
+
+
+BENCHMARKS = {
+    "workers": bench_workers,
+    "startup": bench_startup,
+    "cache": bench_cache,
+    "ratelimit": bench_ratelimit,
+    "serialization": bench_serialization,
+    "import": bench_import,
+}
+
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark {name!r}; choose from {', '.join(BENCHMARKS)}")
+            return 1
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
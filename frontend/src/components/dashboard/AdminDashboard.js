@@ -449,7 +449,7 @@ const AdminDashboard = ({ activeTab, user }) => {
   // ── BILLING TAB ─────────────────────────────────────────────────────────
   if (activeTab === 'billing') {
     const students = users.filter(u => u.role === 'student');
-    const unpaidInvoices = invoices.filter(i => i.status === 'unpaid');
+    const unpaidInvoices = invoices.filter(i => i.status !== 'paid');
 
     const handleAdjustCredit = async (e) => {
       e.preventDefault();
@@ -572,7 +572,7 @@ const AdminDashboard = ({ activeTab, user }) => {
                   <div className="flex items-center gap-3">
                     <p className="font-bold text-lg">₹{inv.amount.toFixed(2)}</p>
                     <span className={`px-3 py-1 text-xs font-semibold rounded-full ${inv.status === 'paid' ? 'bg-green-100 text-green-700' : 'bg-red-100 text-red-700'}`}>{inv.status}</span>
-                    {inv.status === 'unpaid' && <Button onClick={() => handleMarkPaid(inv.invoice_id)} size="sm" className="bg-green-600 hover:bg-green-700 text-white rounded-full text-xs">Mark Paid</Button>}
+                    {inv.status !== 'paid' && <Button onClick={() => handleMarkPaid(inv.invoice_id)} size="sm" className="bg-green-600 hover:bg-green-700 text-white rounded-full text-xs">Mark Paid</Button>}
                     <Button onClick={() => handleDeleteInvoice(inv.invoice_id)} variant="ghost" className="text-red-400 hover:text-red-600"><Trash2 className="w-4 h-4" /></Button>
                   </div>
                 </Card>
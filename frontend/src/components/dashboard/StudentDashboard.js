@@ -311,7 +311,7 @@ const StudentDashboard = ({ activeTab, user }) => {
 
   // ── BILLING ───────────────────────────────────────────────────────────────
   if (activeTab === 'billing') {
-    const unpaid = invoices.filter(i => i.status === 'unpaid');
+    const unpaid = invoices.filter(i => i.status !== 'paid');
     const paid = invoices.filter(i => i.status === 'paid');
     return (
       <div className="space-y-6">
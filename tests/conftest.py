@@ -0,0 +1,27 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# The backend modules import each other as top-level modules (`from database import db`)
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+# Tests that need a real MongoDB (aggregation stages mongomock lacks, explain
+# plans) run only when TEST_MONGO_URL points at one; each gets a scratch db.
+TEST_MONGO_URL = os.getenv("TEST_MONGO_URL")
+
+
+@pytest.fixture
+def mongo_db():
+    """A function returning a Motor database on TEST_MONGO_URL. Call it inside
+    the test's event loop; the database is dropped afterwards."""
+    if not TEST_MONGO_URL:
+        pytest.skip("TEST_MONGO_URL not set")
+    import pymongo
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    yield lambda: AsyncIOMotorClient(TEST_MONGO_URL)[name]
+    pymongo.MongoClient(TEST_MONGO_URL).drop_database(name)
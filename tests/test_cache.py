@@ -0,0 +1,56 @@
+import asyncio
+
+from cache import ContentCache, LRUBackend
+
+
+def _load(value):
+    async def loader():
+        return value
+    return loader
+
+
+def test_invalidate_retires_cached_entries():
+    async def run():
+        cache = ContentCache(LRUBackend(), ttl=None)
+        assert await cache.get_or_load("c1", "notes", _load(["old"])) == ["old"]
+        assert await cache.get_or_load("c1", "notes", _load(["new"])) == ["old"]
+        await cache.invalidate("c1")
+        assert await cache.get_or_load("c1", "notes", _load(["new"])) == ["new"]
+
+    asyncio.run(run())
+
+
+def test_evicted_version_does_not_resurrect_old_entries():
+    async def run():
+        cache = ContentCache(LRUBackend(), ttl=None)
+        await cache.get_or_load("c1", "notes", _load(["v1"]))
+        await cache.invalidate("c1")
+        await cache.get_or_load("c1", "notes", _load(["v2"]))
+        await cache.backend.delete("ver:c1")
+        assert await cache.get_or_load("c1", "notes", _load(["v3"])) == ["v3"]
+
+    asyncio.run(run())
+
+
+def test_hits_are_copies():
+    async def run():
+        cache = ContentCache(LRUBackend(), ttl=None)
+        first = await cache.get_or_load("c1", "notes", _load([{"title": "a"}]))
+        first[0]["title"] = "changed"
+        assert await cache.get_or_load("c1", "notes", _load(None)) == [{"title": "a"}]
+
+    asyncio.run(run())
+
+
+def test_lru_evicts_oldest_by_count():
+    async def run():
+        backend = LRUBackend(max_entries=2)
+        await backend.set("a", b"1")
+        await backend.set("b", b"2")
+        await backend.get("a")
+        await backend.set("c", b"3")
+        assert await backend.get("b") is None
+        assert await backend.get("a") == b"1"
+        assert backend.evictions == 1
+
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import INDEXES
+from routes import feed
+from routes.feed import FEED_KINDS
+
+
+def _index_keys(collection):
+    return [keys for keys, _ in INDEXES[collection]]
+
+
+@pytest.mark.parametrize("collection", list(FEED_KINDS))
+def test_feed_sort_is_indexed(collection):
+    _, id_field = FEED_KINDS[collection]
+    assert [("class_id", 1), ("created_at", -1), (id_field, 1)] in _index_keys(collection)
+    assert [("created_at", -1), (id_field, 1)] in _index_keys(collection)
+
+
+def _stages(plan):
+    stages = [plan["stage"]]
+    for child in [plan.get("inputStage"), *plan.get("inputStages", [])]:
+        if child:
+            stages += _stages(child)
+    return stages
+
+
+def test_feed_cursors_read_about_limit_documents(mongo_db, monkeypatch):
+    limit = 21
+    start = datetime(2024, 1, 1)
+
+    async def run():
+        db = mongo_db()
+        monkeypatch.setattr(feed, "db", db)
+        for collection, (_, id_field) in FEED_KINDS.items():
+            for keys in _index_keys(collection):
+                await db[collection].create_index(keys)
+            await db[collection].insert_many([
+                {id_field: f"{collection}_{i:04d}", "class_id": f"class_{i % 3}",
+                 # pairs of items share a timestamp, to exercise the id tiebreak
+                 "created_at": start + timedelta(minutes=i // 2)}
+                for i in range(600)
+            ])
+
+        first = [item async for item in feed._merge(["class_0", "class_1"], None, limit)]
+        after = (first[-1]["created_at"], first[-1]["item_id"])
+        second = [item async for item in feed._merge(["class_0", "class_1"], after, limit)]
+        keys = [feed._sort_key(i["created_at"], i["item_id"]) for i in first + second]
+        assert keys == sorted(keys) and len(set(keys)) == 2 * limit
+
+        for collection, (_, id_field) in FEED_KINDS.items():
+            for class_id in ("class_0", None):
+                for query in ({}, {"created_at": {"$lte": after[0]},
+                                   "$or": [{"created_at": {"$lt": after[0]}}, {id_field: {"$gt": after[1]}}]}):
+                    query = dict(query, **({"class_id": class_id} if class_id else {}))
+                    plan = await db[collection].find(query).sort(
+                        [("created_at", -1), (id_field, 1)]
+                    ).limit(limit).explain()
+                    assert "SORT" not in _stages(plan["queryPlanner"]["winningPlan"]), (collection, query)
+                    assert plan["executionStats"]["totalDocsExamined"] <= limit + 2, (collection, query)
+
+    asyncio.run(run())
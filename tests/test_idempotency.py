@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from pymongo.errors import DuplicateKeyError
+
+import idempotency
+from auth import create_access_token
+from idempotency import IdempotencyMiddleware, _fingerprint, _record_id
+
+USER = "user_1"
+
+
+class FakeKeys:
+    """The slice of a Motor collection IdempotencyMiddleware uses."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def _matches(self, doc, query):
+        return all(doc.get(k) == v for k, v in query.items())
+
+    async def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]] = dict(doc)
+
+    async def find_one(self, query):
+        doc = self.docs.get(query["_id"])
+        return dict(doc) if doc and self._matches(doc, query) else None
+
+    async def update_one(self, query, update):
+        doc = self.docs.get(query["_id"])
+        if doc is None or not self._matches(doc, query):
+            return SimpleNamespace(modified_count=0)
+        doc.update(update["$set"])
+        return SimpleNamespace(modified_count=1)
+
+    async def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    store = FakeKeys()
+    monkeypatch.setattr(idempotency, "db", SimpleNamespace(idempotency_keys=store))
+    return store
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.state.calls = 0
+    app.state.status = 201
+
+    @app.post("/api/invoices")
+    async def create_invoice(request: Request):
+        app.state.calls += 1
+        payload = await request.json()
+        return JSONResponse({"n": app.state.calls, **payload}, status_code=app.state.status)
+
+    app.add_middleware(IdempotencyMiddleware)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    client = TestClient(app)
+    client.cookies.set("access_token", create_access_token({"sub": USER}))
+    return client
+
+
+def _post(client, body, key="k1"):
+    return client.post("/api/invoices", json=body, headers={"Idempotency-Key": key})
+
+
+def _seed(keys, body, status="in_progress", age=0, key=b"k1"):
+    record_id = _record_id(USER, key)
+    scope = {"path": "/api/invoices", "query_string": b""}
+    keys.docs[record_id] = {
+        "_id": record_id,
+        "fingerprint": _fingerprint(scope, body),
+        "status": status,
+        "created_at": datetime.now(timezone.utc) - timedelta(seconds=age),
+    }
+    return record_id
+
+
+def test_replays_stored_response(app, client, keys):
+    first = _post(client, {"amount": 10})
+    second = _post(client, {"amount": 10})
+    assert first.status_code == second.status_code == 201
+    assert second.json() == first.json() == {"n": 1, "amount": 10}
+    assert second.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert app.state.calls == 1
+
+
+def test_replays_from_store_in_another_worker(app, client, keys):
+    _post(client, {"amount": 10})
+    other = TestClient(IdempotencyMiddleware(app.router))
+    other.cookies.set("access_token", client.cookies.get("access_token"))
+    replay = _post(other, {"amount": 10})
+    assert replay.json() == {"n": 1, "amount": 10}
+    assert app.state.calls == 1
+
+
+def test_in_progress_key_gets_409(app, client, keys):
+    _seed(keys, b'{"amount":10}')
+    response = _post(client, {"amount": 10})
+    assert response.status_code == 409
+    assert response.headers["retry-after"] == "1"
+    assert app.state.calls == 0
+
+
+def test_different_body_gets_422(app, client, keys):
+    _post(client, {"amount": 10})
+    response = _post(client, {"amount": 99})
+    assert response.status_code == 422
+    assert app.state.calls == 1
+
+
+def test_server_errors_are_not_stored(app, client, keys):
+    app.state.status = 503
+    assert _post(client, {"amount": 10}).status_code == 503
+    assert keys.docs == {}
+    app.state.status = 201
+    retry = _post(client, {"amount": 10})
+    assert retry.status_code == 201
+    assert app.state.calls == 2
+
+
+def test_takes_over_abandoned_in_progress_key(app, client, keys):
+    record_id = _seed(keys, b'{"amount":10}', age=idempotency.IN_PROGRESS_TIMEOUT + 1)
+    response = _post(client, {"amount": 10})
+    assert response.status_code == 201
+    assert app.state.calls == 1
+    assert keys.docs[record_id]["status"] == "completed"
+
+
+def test_local_cache_honours_ttl(app, client, keys, monkeypatch):
+    _post(client, {"amount": 10})
+    # Mongo's TTL monitor has dropped the record; the local copy has expired too
+    keys.docs.clear()
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_TTL_SECONDS", 0)
+    middleware = app.middleware_stack
+    while not isinstance(middleware, IdempotencyMiddleware):
+        middleware = middleware.app
+    record_id = _record_id(USER, b"k1")
+    _, record = middleware._completed[record_id]
+    middleware._remember(record_id, record)
+    response = _post(client, {"amount": 10})
+    assert response.json() == {"n": 2, "amount": 10}
+    assert "idempotent-replayed" not in response.headers
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from loaders import Loader
+
+
+class FakeBatch:
+    """batch_fn that records every batch it is asked for."""
+
+    def __init__(self, docs, error=None):
+        self.docs = docs
+        self.error = error
+        self.batches = []
+
+    async def __call__(self, keys):
+        self.batches.append(sorted(keys))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return {k: self.docs[k] for k in keys if k in self.docs}
+
+
+DOCS = {"u1": {"user_id": "u1"}, "u2": {"user_id": "u2"}, "u3": {"user_id": "u3"}}
+
+
+def test_loads_in_the_same_tick_are_one_batch():
+    async def run():
+        batch = FakeBatch(DOCS)
+        loader = Loader(batch)
+        futures = [loader.load("u1"), loader.load("u2"), loader.load("missing")]
+        assert await asyncio.gather(*futures) == [DOCS["u1"], DOCS["u2"], None]
+        assert await loader.load_many(["u3", "u1"]) == [DOCS["u3"], DOCS["u1"]]
+        assert batch.batches == [["missing", "u1", "u2"], ["u3"]]
+
+    asyncio.run(run())
+
+
+def test_memoized_keys_are_not_fetched_again():
+    async def run():
+        batch = FakeBatch(DOCS)
+        loader = Loader(batch)
+        first = await loader.load("u1")
+        assert await loader.load("u1") is first
+        await loader.load_many(["u1", "u2"])
+        assert batch.batches == [["u1"], ["u2"]]
+
+    asyncio.run(run())
+
+
+def test_prime_skips_the_fetch():
+    async def run():
+        batch = FakeBatch(DOCS)
+        loader = Loader(batch)
+        loader.prime("u1", {"user_id": "u1", "primed": True})
+        assert (await loader.load("u1"))["primed"] is True
+        assert batch.batches == []
+
+    asyncio.run(run())
+
+
+def test_clear_fetches_again():
+    async def run():
+        batch = FakeBatch(DOCS)
+        loader = Loader(batch)
+        await loader.load("u1")
+        loader.clear("u1")
+        loader.clear("never-loaded")
+        await loader.load("u1")
+        assert batch.batches == [["u1"], ["u1"]]
+
+    asyncio.run(run())
+
+
+def test_batch_error_reaches_every_caller_and_is_not_memoized():
+    async def run():
+        batch = FakeBatch(DOCS, error=RuntimeError("mongo down"))
+        loader = Loader(batch)
+        results = await asyncio.gather(loader.load("u1"), loader.load("u2"), return_exceptions=True)
+        assert [str(r) for r in results] == ["mongo down", "mongo down"]
+        batch.error = None
+        assert await loader.load("u1") == DOCS["u1"]
+        assert batch.batches == [["u1", "u2"], ["u1"]]
+
+    asyncio.run(run())
+
+
+def test_load_outside_a_running_loop_fails():
+    with pytest.raises(RuntimeError):
+        Loader(FakeBatch(DOCS)).load("u1")
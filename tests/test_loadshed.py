@@ -0,0 +1,144 @@
+import asyncio
+
+import loadshed
+from loadshed import LoadShedMiddleware, RouteGroup
+
+
+def _group(concurrency=1, queue=1, max_wait=1.0, critical=False):
+    return RouteGroup("test", [r"^/api/"], concurrency, queue, max_wait, critical)
+
+
+def test_sheds_when_queue_is_full():
+    async def run():
+        group = _group(concurrency=1, queue=1)
+        assert await group.acquire(False) is None
+        queued = asyncio.ensure_future(group.acquire(False))
+        await asyncio.sleep(0)
+        assert await group.acquire(False) == "queue_full"
+        group.release()
+        assert await queued is None
+        assert group.stats()["in_flight"] == 1
+
+    asyncio.run(run())
+
+
+def test_queued_request_times_out():
+    async def run():
+        group = _group(concurrency=1, queue=4, max_wait=0.01)
+        await group.acquire(False)
+        assert await group.acquire(False) == "timeout"
+        assert group.stats()["queued"] == 0
+        # The expired waiter does not swallow the released slot
+        group.release()
+        assert group.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_release_hands_slot_to_oldest_waiter():
+    async def run():
+        group = _group(concurrency=1, queue=4)
+        await group.acquire(False)
+        first = asyncio.ensure_future(group.acquire(False))
+        second = asyncio.ensure_future(group.acquire(False))
+        await asyncio.sleep(0)
+        group.release()
+        assert await first is None
+        assert not second.done()
+        assert group.in_flight == 1
+        group.release()
+        assert await second is None
+        group.release()
+        assert group.in_flight == 0
+        assert group.admitted == 3
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        group = _group(concurrency=1, queue=4)
+        await group.acquire(False)
+        gone = asyncio.ensure_future(group.acquire(False))
+        waiting = asyncio.ensure_future(group.acquire(False))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.gather(gone, return_exceptions=True)
+        assert gone.cancelled()
+        assert group.stats()["queued"] == 1
+        group.release()
+        assert await waiting is None
+        assert group.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_after_handoff_does_not_leak_the_slot():
+    async def run():
+        group = _group(concurrency=1, queue=4)
+        await group.acquire(False)
+        gone = asyncio.ensure_future(group.acquire(False))
+        waiting = asyncio.ensure_future(group.acquire(False))
+        await asyncio.sleep(0)
+        group.release()
+        gone.cancel()
+        await asyncio.gather(gone, return_exceptions=True)
+        if not gone.cancelled():
+            # Some Python versions' wait_for keep the slot it was handed
+            assert gone.result() is None
+            group.release()
+        assert await waiting is None
+        group.release()
+        assert group.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_congestion_halves_non_critical_groups_and_skips_the_queue():
+    async def run():
+        group = _group(concurrency=4, queue=8)
+        assert await group.acquire(True) is None
+        assert await group.acquire(True) is None
+        assert await group.acquire(True) == "pool_wait"
+        assert group.stats()["queued"] == 0
+
+        critical = _group(concurrency=4, queue=8, critical=True)
+        for _ in range(4):
+            assert await critical.acquire(True) is None
+
+    asyncio.run(run())
+
+
+def test_middleware_counts_and_answers_pool_wait_sheds(monkeypatch):
+    group = _group(concurrency=2, queue=2)
+    monkeypatch.setattr(loadshed, "GROUPS", [group])
+    monkeypatch.setattr(loadshed.pool_wait, "wait_seconds", lambda: 1.0)
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await asyncio.sleep(0.01)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def request(middleware):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware({"type": "http", "method": "GET", "path": "/api/classes"}, None, send)
+        return sent[0]
+
+    async def run():
+        middleware = LoadShedMiddleware(app)
+        return await asyncio.gather(request(middleware), request(middleware))
+
+    admitted, shed = asyncio.run(run())
+    assert admitted["status"] == 200
+    assert shed["status"] == 503
+    assert (b"x-shed-reason", b"test:pool_wait") in shed["headers"]
+    assert (b"retry-after", b"2") in shed["headers"]
+    assert group.shed == {"queue_full": 0, "timeout": 0, "pool_wait": 1}
+    assert calls == ["/api/classes"]
+    assert group.in_flight == 0
@@ -0,0 +1,25 @@
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2025-03-01T10:00:00+00:00", "ann_abc123")
+    assert "=" not in cursor
+    assert decode_cursor(cursor, 2) == ["2025-03-01T10:00:00+00:00", "ann_abc123"]
+
+
+def test_cursor_values_that_are_not_json_are_stringified():
+    from datetime import datetime, timezone
+
+    at = datetime(2025, 3, 1, 10, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(at), 1) == [str(at)]
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor("a", "b"), "e30"])
+def test_invalid_cursor_is_a_400(cursor):
+    # garbage, the wrong number of values, and a JSON object instead of a list
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, 1)
+    assert exc.value.status_code == 400
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from ratelimit import MemoryBucketStore, RateLimit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_capacity_then_refills():
+    async def run():
+        clock = FakeClock()
+        store = MemoryBucketStore(clock=clock)
+        for _ in range(5):
+            assert await store.take("k", 5, 1.0) == 0.0
+        assert await store.take("k", 5, 1.0) == pytest.approx(1.0)
+        clock.now += 1.0
+        assert await store.take("k", 5, 1.0) == 0.0
+
+    asyncio.run(run())
+
+
+def test_buckets_are_per_key_and_capped():
+    async def run():
+        store = MemoryBucketStore(max_entries=2, clock=FakeClock())
+        await store.take("a", 1, 1.0)
+        assert await store.take("b", 1, 1.0) == 0.0
+        await store.take("c", 1, 1.0)
+        assert store.stats()["buckets"] == 2
+        # "a" was evicted and starts full again
+        assert await store.take("a", 1, 1.0) == 0.0
+
+    asyncio.run(run())
+
+
+def test_limit_raises_429_with_retry_after_and_resets():
+    async def run():
+        limit = RateLimit("test", "2/60", MemoryBucketStore(clock=FakeClock()))
+        await limit.hit("user@example.com|10.0.0.1")
+        await limit.hit("user@example.com|10.0.0.1")
+        with pytest.raises(HTTPException) as exc:
+            await limit.hit("user@example.com|10.0.0.1")
+        assert exc.value.status_code == 429
+        assert exc.value.headers["Retry-After"] == "30"
+        # Another address is not locked out by the first one's failures
+        await limit.hit("user@example.com|10.0.0.2")
+        await limit.reset("user@example.com|10.0.0.1")
+        await limit.hit("user@example.com|10.0.0.1")
+        assert limit.rejected == 1
+
+    asyncio.run(run())
+
+
+def test_account_bucket_is_looser_than_account_and_ip():
+    import ratelimit
+
+    assert ratelimit.login_email.capacity > ratelimit.login_account.capacity
+    assert ratelimit.login_ip.capacity >= 100
+
+
+def test_account_bucket_caps_guessing_across_addresses():
+    async def run():
+        store = MemoryBucketStore(clock=FakeClock())
+        per_ip = RateLimit("account", "2/60", store)
+        per_email = RateLimit("email", "5/60", store)
+        email = "user@example.com"
+        for n in range(5):
+            await per_ip.hit(f"{email}|10.0.0.{n}")
+            await per_email.hit(email)
+        with pytest.raises(HTTPException):
+            await per_email.hit(email)
+        # Another account is unaffected
+        await per_email.hit("other@example.com")
+
+    asyncio.run(run())
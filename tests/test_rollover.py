@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import rollover
+from database import INDEXES
+from rollover import CLONED, check_tag, clone_classes, clone_id
+
+
+def test_clone_id_keeps_prefix_and_inserts_tag():
+    assert clone_id("class_abc123", "class_", "2025t1") == "class_2025t1_abc123"
+    assert clone_id("asn_9f", "asn_", "t2") == "asn_t2_9f"
+
+
+def test_clone_id_without_prefix():
+    assert clone_id("legacy", "note_", "t2") == "note_t2_legacy"
+
+
+def test_check_tag_lowercases():
+    assert check_tag("2025T1") == "2025t1"
+
+
+@pytest.mark.parametrize("tag", ["", None, "spring term", "a_b", "x" * 17])
+def test_check_tag_rejects(tag):
+    with pytest.raises(HTTPException) as exc:
+        check_tag(tag)
+    assert exc.value.status_code == 400
+
+
+# The pipelines use $replaceOne, $strLenCP and $dateAdd, which mongomock
+# does not implement; these run against TEST_MONGO_URL (see conftest.py).
+
+def _seed():
+    return {
+        "classes": [{
+            "class_id": "class_abc", "title": "Algebra", "teacher_id": "user_t",
+            "start_time": "2024-09-01T10:00", "end_time": "2024-12-20T11:00",
+            "enrolled_count": 25, "recording_link": "https://example.com/rec",
+        }],
+        "assignments": [
+            {"assignment_id": "asn_1", "class_id": "class_abc", "title": "HW 1", "due_date": "2024-09-08"},
+            {"assignment_id": "asn_2", "class_id": "class_abc", "title": "HW 2", "due_date": "2024-09-15T23:59:30"},
+            {"assignment_id": "legacy", "class_id": "class_abc", "title": "HW 3", "due_date": "next friday"},
+            {"assignment_id": "asn_3", "class_id": "class_abc", "title": "HW 4", "due_date": None},
+        ],
+        "notes": [
+            {"note_id": "note_1", "class_id": "class_abc", "title": "Week 1", "session_date": "2024-09-01"},
+            {"note_id": "note_x", "class_id": "class_other", "title": "Elsewhere", "session_date": "2024-09-01"},
+        ],
+    }
+
+
+async def _setup(db):
+    for collection in CLONED:
+        for keys, options in INDEXES[collection]:
+            await db[collection].create_index(keys, **options)
+    for collection, docs in _seed().items():
+        await db[collection].insert_many(docs)
+
+
+def test_clone_classes_copies_with_new_ids_and_shifted_dates(mongo_db, monkeypatch):
+    async def run():
+        db = mongo_db()
+        monkeypatch.setattr(rollover, "db", db)
+        await _setup(db)
+        result = await clone_classes(["class_abc"], "t2", 7, overrides={"teacher_id": "user_new"})
+        assert result == {"tag": "t2", "classes": 1, "assignments": 4, "notes": 1}
+
+        cls = await db.classes.find_one({"class_id": "class_t2_abc"}, {"_id": 0})
+        assert cls["start_time"] == "2024-09-08T10:00"
+        assert cls["end_time"] == "2024-12-27T11:00"
+        assert cls["enrolled_count"] == 0
+        assert "recording_link" not in cls
+        assert cls["teacher_id"] == "user_new"
+        assert (cls["cloned_from"], cls["rollover_tag"]) == ("class_abc", "t2")
+
+        assignments = {
+            a["cloned_from"]: a async for a in db.assignments.find({"rollover_tag": "t2"}, {"_id": 0})
+        }
+        assert {a["assignment_id"] for a in assignments.values()} == {
+            clone_id(old, "asn_", "t2") for old in ("asn_1", "asn_2", "legacy", "asn_3")
+        }
+        assert {a["class_id"] for a in assignments.values()} == {"class_t2_abc"}
+        # Each date keeps the shape it was stored in; unparseable and null are copied
+        assert assignments["asn_1"]["due_date"] == "2024-09-15"
+        assert assignments["asn_2"]["due_date"] == "2024-09-22T23:59:30"
+        assert assignments["legacy"]["due_date"] == "next friday"
+        assert assignments["asn_3"]["due_date"] is None
+
+        note = await db.notes.find_one({"rollover_tag": "t2"}, {"_id": 0})
+        assert (note["note_id"], note["session_date"]) == ("note_t2_1", "2024-09-08")
+        assert await db.notes.count_documents({"class_id": "class_other"}) == 1
+
+    asyncio.run(run())
+
+
+def test_rerunning_a_rollover_fills_gaps_without_duplicates(mongo_db, monkeypatch):
+    async def run():
+        db = mongo_db()
+        monkeypatch.setattr(rollover, "db", db)
+        await _setup(db)
+        await clone_classes(["class_abc"], "t2", 7)
+        # An interrupted run: one clone missing, one edited since
+        await db.assignments.delete_one({"assignment_id": "asn_t2_1"})
+        await db.assignments.update_one({"assignment_id": "asn_t2_2"}, {"$set": {"title": "Edited"}})
+
+        result = await clone_classes(["class_abc"], "t2", 7)
+        assert result == {"tag": "t2", "classes": 1, "assignments": 4, "notes": 1}
+        assert await db.assignments.count_documents({}) == 8
+        assert (await db.assignments.find_one({"assignment_id": "asn_t2_2"}))["title"] == "Edited"
+        # Clones are not cloned again under the same tag
+        assert await db.classes.count_documents({"rollover_tag": "t2"}) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+import json
+from datetime import datetime
+from typing import List, Optional
+
+import pytest
+from fastapi import HTTPException
+from pydantic import BaseModel, TypeAdapter
+
+from serialization import parse_fields, projection, shape, sparse_projection, trusted_json, trusted_json_one
+
+
+class Item(BaseModel):
+    item_id: str
+    title: str
+    max_students: int = 30
+    description: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+def test_projection_is_exactly_the_model_fields():
+    assert projection(Item) == {
+        "_id": 0, "item_id": 1, "title": 1, "max_students": 1, "description": 1, "created_at": 1,
+    }
+
+
+def test_shape_fills_defaults_and_drops_extra_keys():
+    rows = shape([{"item_id": "i1", "title": "A", "secret": "x"}], Item)
+    assert rows == [{"item_id": "i1", "title": "A", "max_students": 30, "description": None, "created_at": None}]
+
+
+def test_trusted_json_matches_the_model_path():
+    docs = [
+        {"item_id": "i1", "title": "A", "created_at": datetime(2024, 9, 1, 10, 30)},
+        {"item_id": "i2", "title": "B", "max_students": 5, "description": "d"},
+    ]
+    adapter = TypeAdapter(List[Item])
+    expected = adapter.dump_python([Item(**d) for d in docs], mode="json")
+    response = trusted_json(docs, Item)
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == expected
+
+
+def test_shape_only_selected_fields():
+    assert shape([{"item_id": "i1", "title": "A"}], Item, ["item_id", "max_students"]) == [
+        {"item_id": "i1", "max_students": 30}
+    ]
+
+
+def test_trusted_json_one_only_selected_fields():
+    response = trusted_json_one({"item_id": "i1", "title": "A"}, Item, ["title"])
+    assert json.loads(response.body) == {"title": "A"}
+
+
+def test_parse_fields_absent_means_everything():
+    assert parse_fields(None, Item.model_fields) is None
+
+
+def test_parse_fields_keeps_order_adds_always_and_dedupes():
+    selected = parse_fields(" title, item_id ,,title", Item.model_fields, always=["item_id"])
+    assert selected == ["item_id", "title"]
+
+
+def test_parse_fields_unknown_name_is_a_400():
+    with pytest.raises(HTTPException) as exc:
+        parse_fields("title,password", Item.model_fields)
+    assert exc.value.status_code == 400
+    assert "password" in exc.value.detail
+
+
+def test_sparse_projection():
+    default = {"_id": 0}
+    assert sparse_projection(None, default) is default
+    assert sparse_projection(["item_id", "title"], default) == {"_id": 0, "item_id": 1, "title": 1}
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def run():
+        flight = SingleFlight("test_share")
+        started = 0
+
+        async def fetch():
+            nonlocal started
+            started += 1
+            await asyncio.sleep(0.01)
+            return {"class_id": "c1"}
+
+        results = await asyncio.gather(*(flight.do("c1", fetch) for _ in range(5)))
+        assert started == 1
+        assert all(r is results[0] for r in results)
+        assert flight.stats() == {"calls": 1, "coalesced": 4, "coalesced_ratio": 0.8, "in_flight": 0}
+
+    asyncio.run(run())
+
+
+def test_a_finished_call_is_not_reused():
+    async def run():
+        flight = SingleFlight("test_fresh")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return len(calls)
+
+        assert await flight.do("k", fetch) == 1
+        assert await flight.do("k", fetch) == 2
+        assert flight.stats()["coalesced"] == 0
+
+    asyncio.run(run())
+
+
+def test_different_keys_do_not_share():
+    async def run():
+        flight = SingleFlight("test_keys")
+
+        async def fetch(value):
+            await asyncio.sleep(0)
+            return value
+
+        assert await asyncio.gather(flight.do("a", lambda: fetch("a")), flight.do("b", lambda: fetch("b"))) == ["a", "b"]
+        assert flight.stats()["calls"] == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def run():
+        flight = SingleFlight("test_shield")
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "doc"
+
+        first = asyncio.ensure_future(flight.do("k", fetch))
+        second = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 1
+        release.set()
+        assert await second == "doc"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_error_reaches_every_waiter():
+    async def run():
+        flight = SingleFlight("test_error")
+
+        async def fetch():
+            await asyncio.sleep(0)
+            raise LookupError("boom")
+
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(3)), return_exceptions=True)
+        assert [type(r) for r in results] == [LookupError] * 3
+        assert flight.stats() == {"calls": 1, "coalesced": 2, "coalesced_ratio": 0.6667, "in_flight": 0}
+
+    asyncio.run(run())
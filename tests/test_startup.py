@@ -0,0 +1,65 @@
+"""Cold start: importing the app must stay cheap. No Mongo connection and no
+Google client libraries until they are needed, and the first request is
+served within budget. (backend_bench.py startup measures the same against a
+real uvicorn process and Mongo.)"""
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+FIRST_REQUEST_BUDGET_SECONDS = float(os.getenv("FIRST_REQUEST_BUDGET_SECONDS", "3.0"))
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server, database
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "connected": database._client is not None,
+    "google": sorted(m for m in sys.modules if m.split(".")[0] in ("googleapiclient", "google_auth_oauthlib")),
+}))
+"""
+
+
+# Process start to the first response. The lifespan is not entered (it
+# needs Mongo), so this is import, app and middleware build, and routing.
+FIRST_REQUEST_PROBE = """
+import json, time
+started = time.perf_counter()
+from fastapi.testclient import TestClient
+import server
+status = TestClient(server.app).get("/api/").status_code
+print(json.dumps({"seconds": time.perf_counter() - started, "status": status}))
+"""
+
+
+def _run(probe):
+    # A fresh interpreter each time: the point is what a cold worker pays
+    out = subprocess.run([sys.executable, "-c", probe], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _import_server():
+    return _run(PROBE)
+
+
+def test_import_does_not_connect_to_mongo():
+    assert _import_server()["connected"] is False
+
+
+def test_import_does_not_load_google_clients():
+    assert _import_server()["google"] == []
+
+
+def test_import_time_within_budget():
+    best = min(_import_server()["seconds"] for _ in range(3))
+    assert best < IMPORT_BUDGET_SECONDS
+
+
+def test_first_request_within_budget():
+    runs = [_run(FIRST_REQUEST_PROBE) for _ in range(3)]
+    assert all(r["status"] == 200 for r in runs)
+    assert min(r["seconds"] for r in runs) < FIRST_REQUEST_BUDGET_SECONDS
@@ -0,0 +1,46 @@
+from watch_progress import COMPLETION_RATIO, WatchBuffer
+
+
+def test_heartbeats_coalesce_per_student_and_video():
+    buffer = WatchBuffer()
+    buffer.add("s1", "v1", "c1", 10, 100)
+    buffer.add("s1", "v1", "c1", 40, 100)
+    buffer.add("s1", "v2", "c1", 5, 60)
+    buffer.add("s2", "v1", "c1", 1, 100)
+    assert buffer.heartbeats == 4
+    assert buffer.stats()["pending"] == 3
+    assert buffer.pending("s1", "v1")["position"] == 40
+
+
+def test_seeking_back_keeps_the_furthest_position():
+    buffer = WatchBuffer()
+    buffer.add("s1", "v1", "c1", 50, 100)
+    buffer.add("s1", "v1", "c1", 20, 100)
+    entry = buffer.pending("s1", "v1")
+    assert entry["position"] == 20
+    assert entry["max_position"] == 50
+
+
+def test_completion_is_stamped_once():
+    buffer = WatchBuffer()
+    buffer.add("s1", "v1", "c1", 100 * COMPLETION_RATIO - 1, 100)
+    assert "completed_at" not in buffer.pending("s1", "v1")
+    buffer.add("s1", "v1", "c1", 100 * COMPLETION_RATIO, 100)
+    completed_at = buffer.pending("s1", "v1")["completed_at"]
+    buffer.add("s1", "v1", "c1", 10, 100)
+    assert buffer.pending("s1", "v1")["completed_at"] == completed_at
+
+
+def test_unwritten_batch_merges_back_with_newer_heartbeats():
+    buffer = WatchBuffer()
+    buffer.add("s1", "v1", "c1", 95, 100)
+    buffer.add("s1", "v2", "c1", 30, 100)
+    # What flush() does when the bulk_write fails or is cancelled
+    batch, buffer._pending = buffer._pending, {}
+    buffer.add("s1", "v1", "c1", 12, 100)
+    buffer._restore(batch)
+    v1 = buffer.pending("s1", "v1")
+    assert v1["position"] == 12
+    assert v1["max_position"] == 95
+    assert v1["completed_at"] == batch[("s1", "v1")]["completed_at"]
+    assert buffer.pending("s1", "v2")["position"] == 30